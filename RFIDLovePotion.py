@@ -4,43 +4,135 @@ from __future__ import print_function
 
 # System imports.
 import argparse
-from flask import Flask, redirect, render_template, request, session, url_for
+import binascii
 from datetime import datetime
 import Queue
 import os
 import signal
+import subprocess
 import sys
 import threading
 import time
 
 # Local imports.
+import door_ipc
+import durable_io
+import event_store
+import event_stream
 import hardware
 import log_writer
-import reverse_proxy_hack
+import remote_hardware
 import send_string
+import swipe_filter
+import unknown_tags
 import user_db
+import web_app
 
 
 def ParseFlags():
     parser = argparse.ArgumentParser()
     parser.add_argument('--mock', action='store_true', help='Use mock hardware')
     parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--serve', default='dev', choices=('dev', 'production'),
+                        help='"dev" serves the web interface from this process, with '
+                        'the Werkzeug server. "production" runs it in gunicorn worker '
+                        'processes, which call back into this one over --control_socket')
+    parser.add_argument('--gunicorn', default='gunicorn', type=str,
+                        help='Command running gunicorn, for --serve=production')
+    parser.add_argument('--workers', default=2, type=int,
+                        help='Number of gunicorn worker processes')
+    parser.add_argument('--threads', default=8, type=int,
+                        help='Number of request threads per gunicorn worker')
+    parser.add_argument('--max_streams', default=4, type=int,
+                        help='Number of request threads per gunicorn worker that may '
+                        'stream live updates to open dashboards. Further dashboards '
+                        'poll instead. Must be less than --threads, or open '
+                        'dashboards can take all threads')
+    parser.add_argument('--control_socket', default='~/.config/lovepotion/control.sock',
+                        type=str, help='Unix socket the gunicorn workers call this '
+                        'process on')
     parser.add_argument('--open_time', type=int, default=3,
-                        help='Time in seconds to keep lock open')
+                        help='Time in seconds to keep lock open, for doors without '
+                        'an open_time of their own')
     parser.add_argument('--user_db', default='~/.config/lovepotion/users.db', type=str,
-                        help='User database file location')
+                        help='User database location: a text file, or sqlite:<path> for '
+                        'an SQLite database')
     parser.add_argument('--user_db_backup_dir', default='~/.config/lovepotion/users_backup', type=str,
                         help='User database backup directory')
+    parser.add_argument('--user_db_durability', default=durable_io.FULL,
+                        choices=durable_io.LEVELS,
+                        help='How hard to try to get user database changes on disk '
+                        'before returning: "full" survives power cuts, "data" may lose '
+                        'the last change, "none" may lose recent changes entirely. '
+                        'The cost is paid per change, not per swipe: "data" fsyncs '
+                        'every file written (the database and its backup), "full" '
+                        'also the directories they are renamed in. Run '
+                        '"user_db_benchmark.py commit" to measure it on this disk')
     parser.add_argument('--speak_server', default='192.168.1.17', type=str,
                         help='TTS server')
     parser.add_argument('--speak_port', default=4000, type=int,
                         help='TTS server port')
+    parser.add_argument('--doorbell_port', default=4002, type=int,
+                        help='Port of the TTS server to announce doorbell presses on')
+    parser.add_argument('--doorbell_message', default='foo', type=str,
+                        help='String sent to the doorbell port when the doorbell is pressed')
+    parser.add_argument('--doorbell_debounce', default=1.0, type=float,
+                        help='Seconds during which further doorbell presses are ignored')
     parser.add_argument('--log_file', default='~/.config/lovepotion/log.txt', type=str,
                         help='Location of the log file')
+    parser.add_argument('--log_sync', default=log_writer.SYNC_FLUSH,
+                        choices=log_writer.SYNC_POLICIES,
+                        help='What to do after writing a log line: nothing, '
+                        'flush it to the OS or fsync it to disk')
+    parser.add_argument('--log_max_bytes', default=10 * 1024 * 1024, type=int,
+                        help='Rotate the log file when it grows past this size, '
+                        '0 to disable')
+    parser.add_argument('--log_rotate_daily', action='store_true',
+                        help='Rotate the log file every day')
+    parser.add_argument('--log_keep', default=20, type=int,
+                        help='Number of rotated log files to keep, 0 to delete '
+                        'them right away')
+    parser.add_argument('--log_max_latency', default=0.1, type=float,
+                        help='Commit log lines in groups, at most this many '
+                        'seconds after they were logged; negative to write '
+                        'each line right away')
+    parser.add_argument('--log_batch_size', default=100, type=int,
+                        help='Max number of log lines committed as one group')
+    parser.add_argument('--event_db', default='~/.config/lovepotion/events.db',
+                        type=str, help='Location of the indexed event database')
+    parser.add_argument('--door_socket', default='', type=str,
+                        help='Socket of a door_daemon.py to leave the doors to, e.g. '
+                        '~/.config/lovepotion/door.sock. The daemon then authorizes '
+                        'swipes with its own --user_db (point it at the same one) and '
+                        '--unknown_tag_* flags, and unlocks; this process only logs '
+                        'and shows them. By default this process runs the doors '
+                        'itself, as set up by --mock, --open_time, --pin_config, '
+                        '--swipe_window, --wiegand_lengths and --doorbell_debounce')
     parser.add_argument('--pin_config', default='~/.config/lovepotion/pins.cfg',
-                        type=str, help='Location of the pin configuration file')
+                        type=str, help='Location of the pin configuration file, with a '
+                        '[door:<name>] section per door, see door_config.py')
+    parser.add_argument('--swipe_window', default=1.0, type=float,
+                        help='Seconds during which repeated reads of the same card by '
+                        'a reader are ignored')
+    parser.add_argument('--wiegand_lengths', default='', type=str,
+                        help='Comma separated frame lengths in bits to accept from the '
+                        'reader, e.g. 26,34,37. By default all are accepted. 26, 34 '
+                        'and 37 bit frames are parity checked')
+    parser.add_argument('--unknown_tag_ttl', default=30, type=float,
+                        help='Seconds to remember an unknown tag. Repeated reads of it '
+                        'are counted instead of looked up and logged')
+    parser.add_argument('--unknown_tag_limit', default=0, type=int,
+                        help='Lock the reader out once more than this many different '
+                        'unknown tags were read within a minute. During the lockout '
+                        'known tags are ignored too, so this trades brute-force '
+                        'protection for a way to lock members out. 0 (the default) '
+                        'disables this')
+    parser.add_argument('--unknown_tag_lockout', default=60, type=float,
+                        help='Seconds to ignore all tags for after too many unknown tags')
 
     args = parser.parse_args()
+    if args.serve == 'production' and not 0 <= args.max_streams < args.threads:
+        parser.error('--max_streams must be at least 0 and less than --threads')
     return args
 
 
@@ -49,135 +141,244 @@ class Server(object):
     def __init__(self):
         self._args = ParseFlags()
 
-        self._users = user_db.UserDb(
-                self._args.user_db, self._args.user_db_backup_dir)
-        self._hw = hardware.Instantiate(self._args.mock, self._args.open_time,
-                                        os.path.expanduser(self._args.pin_config))
+        self._users = user_db.Instantiate(
+                self._args.user_db, self._args.user_db_backup_dir,
+                durability=self._args.user_db_durability)
+        if self._args.door_socket:
+            self._hw = remote_hardware.RemoteHardware(
+                    os.path.expanduser(self._args.door_socket))
+        else:
+            self._hw = hardware.Instantiate(
+                    self._args.mock, self._args.open_time,
+                    os.path.expanduser(self._args.pin_config),
+                    swipe_window=self._args.swipe_window,
+                    wiegand_lengths=swipe_filter.ParseLengths(self._args.wiegand_lengths),
+                    doorbell_debounce=self._args.doorbell_debounce)
         self._speak_server = send_string.SendString(
                 self._args.speak_server,
                 self._args.speak_port)
+        self._doorbell_server = send_string.SendString(
+                self._args.speak_server,
+                self._args.doorbell_port)
 
-        self._log = log_writer.LogWriter(self._args.log_file)
+        self._events = event_store.EventStore(self._args.event_db)
+        self._log = log_writer.LogWriter(
+                self._args.log_file,
+                self._args.log_sync,
+                max_bytes=self._args.log_max_bytes,
+                rotate_daily=self._args.log_rotate_daily,
+                keep=self._args.log_keep,
+                event_store=self._events,
+                max_latency=(self._args.log_max_latency
+                             if self._args.log_max_latency >= 0 else None),
+                batch_size=self._args.log_batch_size)
+        # Live updates for the dashboard: new log lines and unknown tags.
+        self._stream = event_stream.EventStream()
+        self._log.AddListener(lambda line: self._stream.Publish('log', line))
         # Last seen rfid tag, if it was unauthorized, otherwise, empty string.
         self._last_rfid = ''
+        # gunicorn process of --serve=production, while it runs.
+        self._workers = None
+        # Repeated reads of unknown tags are only counted.
+        self._unknown_tags = unknown_tags.UnknownTagFilter(
+                self._log.Log,
+                ttl=self._args.unknown_tag_ttl,
+                limit=self._args.unknown_tag_limit,
+                lockout=self._args.unknown_tag_lockout)
+
+    def _SetLastRfid(self, rfid):
+        if rfid != self._last_rfid:
+            self._last_rfid = rfid
+            self._stream.Publish('rfid', rfid)
 
-    def _TagSeenHandler(self, rfid):
-        print("Tag Read: %s" % rfid)
-        authorized, name = self._users.AuthorizeRfidTag(rfid)
-        self._log.Log(rfid=rfid, authorized=authorized, name=name)
+    def _TagSeenHandler(self, rfid, door=None, **details):
+        # Called from the thread of the door's reader.
+        if self._unknown_tags.Check(rfid) != unknown_tags.LOOKUP:
+            return
+        authorized, name = self._users.AuthorizeRfidTag(rfid, door=door)
+        if name is None:
+            self._unknown_tags.AddUnknown(rfid)
+        if authorized:
+            self._hw.UnlockDoor(door)
+        self._SwipeHandler(rfid, authorized=authorized, name=name, door=door, **details)
+
+    def _SwipeHandler(self, rfid, authorized=False, name=None, door=None, **details):
+        # Logs and shows a swipe that was decided on. With --door_socket,
+        # called with door_daemon.py's decision from the thread receiving its
+        # events.
+        print("Tag Read: %s at %s" % (rfid, door))
+        self._log.Log(action='swipe', rfid=rfid, authorized=authorized, name=name,
+                      door=door, **details)
         if authorized:
             msg = '%s goes there' % name
             self._speak_server.Send(msg)
-            self._hw.UnlockDoor()
-            self._last_rfid = ''
+            self._SetLastRfid('')
+        elif name is None:
+            self._SetLastRfid(rfid)
         else:
-            self._last_rfid = rfid
+            # Known tag, outside of its time windows. Nothing to add.
+            self._SetLastRfid('')
+
+    def _DoorbellHandler(self, door):
+        # Called from the thread watching the button: both only queue.
+        self._log.Log(action='doorbell', door=door)
+        self._doorbell_server.Send(self._args.doorbell_message)
+
+    def GetStatus(self):
+        """Returns what the dashboard shows, as a dict."""
+        # The dashboard streams the events after last_event, so it must not
+        # have missed, nor already show, any of their lines.
+        last_lines, last_event = self._log.GetLastLinesAt(self._stream.GetLast)
+        return dict(
+                doors=[door.name for door in self._hw.doors],
+                last_event=last_event,
+                last_lines=last_lines,
+                rfid=self._last_rfid)
+
+    def Login(self, user, password):
+        """Checks a web login, and logs it.
+
+        Returns:
+            (authorized, admin), as user_db.UserDb.AuthorizeUser.
+        """
+        authorized, admin = self._users.AuthorizeUser(user, password)
+        self._log.Log(action='login', user=user, authorized=authorized)
+        return authorized, admin
+
+    def Unlock(self, user, door=None):
+        """Unlocks a door for a web user.
+
+        Returns:
+            bool, False if there is no such door.
+        """
+        door = door or self._hw.default_door
+        if door not in [d.name for d in self._hw.doors]:
+            return False
+        self._log.Log(action='remote_unlock', user=user, unlock=True, door=door)
+        msg = 'website user %s goes there' % user
+        self._speak_server.Send(msg)
+        self._hw.UnlockDoor(door)
+        return True
+
+    def _ClearUnknownTags(self):
+        """Forgets the unknown tags, so that tags just added are looked up."""
+        self._unknown_tags.Clear()
+        if self._args.door_socket:
+            self._hw.ClearUnknownTags()
+
+    def AddUser(self, rfid, name, admin_user):
+        self._users.AddUser(rfid, name, admin_user)
+        self._ClearUnknownTags()
+        self._SetLastRfid('')
+        self._log.Log(action='add_user', user=admin_user, rfid=rfid, name=name)
 
-    def _EditHandler(self):
-        if not session.get('admin') == 'yes':
-            return redirect(url_for('login'))
-        message = ''
-        users = self._users.GetUserDatabase()
-        if request.method == 'POST' and request.form.get('save'):
-            users = request.form['users']
-            if users:
-                try:
-                    self._users.ReplaceUserDatabase(users)
-                    message = 'Saved!'
-                except user_db.UserDbError, e:
-                    print(e)
-                    message = str(e)
-        return render_template('edit.html', users=users, message=message)
-
-    def _IndexHandler(self):
-        if not session.get('logged_in'):
-            return redirect(url_for('login', _external=True))
-        message = ''
-        if session.get('admin') == 'yes':
-            if request.method == 'POST' and request.form.get('add'):
-                rfid = request.form.get('rfid')
-                name = request.form.get('name')
-                try:
-                    self._users.AddUser(rfid, name, session.get('user'))
-                except user_db.UserDbError, e:
-                    print(e)
-                    message = 'Failed to add user: %s' % str(e)
-                else:
-                    message = 'User added!'
-                    self._last_rfid = ''
-                    self._log.Log(
-                            action='add_user',
-                            admin=session.get('user'),
-                            rfid=rfid,
-                            name=name)
-
-        return render_template(
-                'index.html',
-                admin=session.get('admin'),
-                last_lines=self._log.GetLastLines(),
-                rfid=self._last_rfid,
-                message=message)
-
-    def _QuitHandler(self):
-        func = request.environ.get('werkzeug.server.shutdown')
-        if func is None:
-            raise RuntimeError('Not running with the Werkzeug Server')
-        func()
-        return 'bye bye'
-
-    def _LoginHandler(self):
-        if request.method == 'POST':
-            user = request.form['user']
-            pwd = request.form['password']
-            if user and pwd:
-                authorized, admin = self._users.AuthorizeUser(user, pwd)
-                self._log.Log(user=user, authorized=authorized)
-                if authorized:
-                    session['logged_in'] = True
-                    session['admin'] = admin
-                    session['user'] = user
-                    return redirect(url_for('index', _external=True))
-        return self._app.send_static_file('login.html')
-
-    def _OpenHandler(self):
-        if request.method == 'POST':
-            if session.get('logged_in'):
-                user = session.get('user')
-                self._log.Log(user=user, unlock=True)
-                msg = 'website user %s goes there' % user
-                self._speak_server.Send(msg)
-                self._hw.UnlockDoor()
-        return redirect(url_for('index', _external=True))
-
-    def _LogoutHandler(self):
-        session.pop('logged_in', None)
-        return redirect(url_for('index', _external=True))
+    def ImportUsers(self, text, fmt, admin_user):
+        """Adds the users of an import file.
+
+        Returns:
+            int, number of users added.
+        """
+        rows = user_db.ParseImport(text, fmt)
+        count = self._users.AddUsers(rows, admin_user)
+        self._ClearUnknownTags()
+        self._log.Log(action='import_users', user=admin_user, count=count)
+        return count
+
+    def GetUserDatabase(self):
+        return self._users.GetUserDatabase()
+
+    def ReplaceUserDatabase(self, users):
+        self._users.ReplaceUserDatabase(users)
+        self._ClearUnknownTags()
+
+    def RestoreBackup(self, digest, admin_user):
+        self._users.RestoreBackup(digest)
+        self._ClearUnknownTags()
+        self._log.Log(action='restore_users', user=admin_user, backup=digest)
+
+    def ListBackups(self, count):
+        """Returns the [(timestamp, digest)] of the count most recent backups."""
+        return [(b.timestamp, b.digest) for b in self._users.ListBackups()[:count]]
+
+    def DiffBackup(self, digest):
+        return self._users.DiffBackup(digest)
+
+    def QueryEvents(self, **kwargs):
+        return self._events.Query(**kwargs)
+
+    def GetEvents(self, last):
+        return self._stream.Get(last)
+
+    def WaitEvents(self, last):
+        return self._stream.Wait(last)
+
+    def Quit(self):
+        """Stops the web workers of --serve=production, and so the server."""
+        if self._workers is not None:
+            self._workers.terminate()
+
+    def _ServeProduction(self, secret_key):
+        control = door_ipc.Server(os.path.expanduser(self._args.control_socket),
+                                  self, web_app.BACKEND_METHODS)
+        control.Start()
+        env = dict(os.environ)
+        env['LOVEPOTION_CONTROL_SOCKET'] = os.path.expanduser(self._args.control_socket)
+        env['LOVEPOTION_SECRET_KEY'] = binascii.hexlify(secret_key)
+        env['LOVEPOTION_MAX_STREAMS'] = str(self._args.max_streams)
+        self._workers = subprocess.Popen(
+                self._args.gunicorn.split() + [
+                        '--workers', str(self._args.workers),
+                        '--threads', str(self._args.threads),
+                        '--worker-class', 'gthread',
+                        '--bind', '127.0.0.1:%d' % self._args.port,
+                        'wsgi:app'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env)
+
+        def _Stop(signum, frame):
+            self._workers.terminate()
+        signal.signal(signal.SIGTERM, _Stop)
+        signal.signal(signal.SIGINT, _Stop)
+        self._workers.wait()
+        self._workers = None
+        control.Stop()
 
     def Serve(self):
         self._hw.Initialize()
-        self._hw.SetTagSeenHandler(self._TagSeenHandler)
+        if self._args.door_socket:
+            # door_daemon.py has unlocked the door already.
+            self._hw.SetTagSeenHandler(self._SwipeHandler)
+            self._hw.SetLogHandler(self._log.Log)
+        else:
+            self._hw.SetTagSeenHandler(self._TagSeenHandler)
+        self._hw.SetDoorbellHandler(self._DoorbellHandler)
 
-        self._app = Flask(__name__)
-        self._app.wsgi_app = reverse_proxy_hack.ReverseProxied(
-                self._app.wsgi_app)
         # We generate a new session key every time the server starts. This way,
         # old sessions are invalidated on server restart and users have to log
         # in again.
-        self._app.secret_key = os.urandom(24)
-        self._app.add_url_rule('/', 'index', self._IndexHandler, methods=['GET', 'POST'])
-        self._app.add_url_rule('/logout', 'logout', self._LogoutHandler, methods=['GET', 'POST'])
-        self._app.add_url_rule('/login', 'login', self._LoginHandler, methods=['GET', 'POST'])
-        self._app.add_url_rule('/open', 'open', self._OpenHandler, methods=['POST'])
-        self._app.add_url_rule('/edit', 'edit', self._EditHandler, methods=['GET', 'POST'])
-        self._app.add_url_rule('/quitquitquit', 'quitquitquit', self._QuitHandler)
-
-        # Run in debug mode if --mock was given.
-        # In either case, we run with the default non-threaded,
-        # non-multiprocess server. If we ever want to change that, we need to
-        # make the application watch the user database and re-read it.
-        self._app.run(port=self._args.port, debug=self._args.mock)
+        secret_key = os.urandom(24)
+        if self._args.serve == 'production':
+            # gunicorn workers in processes of their own, calling back into
+            # this one, which keeps the hardware.
+            self._ServeProduction(secret_key)
+        else:
+            # Run in debug mode if --mock was given.
+            # In either case, we run with the threaded server, so that a slow
+            # request doesn't hold up everybody else. The user database picks up
+            # changes to its file by itself, so nothing serves stale data.
+            app = web_app.WebApp(self, secret_key, debug=self._args.mock).app
+            app.run(port=self._args.port, debug=self._args.mock, threaded=True)
 
         self._hw.ShutDown()
+        self._log.Log(action='swipe_stats', **self._hw.GetSwipeStats())
+        self._speak_server.Close()
+        self._doorbell_server.Close()
+        # Log what the unknown tag filter counted so far.
+        self._unknown_tags.Clear()
+        self._log.Close()
+        self._events.Close()
+        self._stream.Close()
+        self._users.Close()
         exit(0)
 
 
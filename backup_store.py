@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# Content-addressed store for backups of the user database.
+#
+# Every version of the database is identified by the sha1 of its content.
+# Content is stored once, however often it is backed up, either as a full
+# compressed snapshot or, for versions that only appended to the previous
+# one, as a small compressed delta on top of it:
+#
+#   <backup_dir>/objects/<sha1>.gz   full content
+#   <backup_dir>/deltas/<sha1>.gz    "<parent sha1>\n" + appended text
+#   <backup_dir>/index               one "<unix time> <sha1>" line per backup
+#
+# Old backups are thinned out by a retention policy: everything from the last
+# few days is kept, then the newest backup of each day, then of each week.
+
+from __future__ import print_function
+
+import collections
+import difflib
+import gzip
+import hashlib
+import os
+import re
+import time
+import zlib
+
+# Local imports.
+import durable_io
+
+Backup = collections.namedtuple('Backup', 'timestamp digest')
+
+# File names of backups written before this store existed.
+_LEGACY_RE = re.compile(r'^(\d{8}_\d{6})\.db$')
+
+_DAY = 24 * 3600
+
+
+class BackupStoreError(Exception):
+    """Backup not found or unreadable."""
+    pass
+
+
+def _ReadCompressed(path):
+    """Returns the uncompressed content of path, or None if it doesn't exist."""
+    try:
+        fh = gzip.open(path)
+    except IOError:
+        return None
+    try:
+        with fh:
+            return fh.read()
+    except (IOError, EOFError, zlib.error), e:
+        raise BackupStoreError('Corrupt backup file %s: %s' % (path, e))
+
+
+class BackupStore(object):
+    """Deduplicating store of user database versions."""
+
+    def __init__(self, backup_dir, keep_all_days=7, keep_daily_days=90,
+                 keep_weekly_weeks=None, max_chain=50, durability=durable_io.FULL):
+        """Constructor.
+
+        Args:
+            backup_dir: str, directory to keep backups in. Must exist.
+            keep_all_days: int, keep every backup this many days.
+            keep_daily_days: int, then keep the newest backup of each day up
+                to this many days.
+            keep_weekly_weeks: int or None, then keep the newest backup of
+                each week up to this many weeks, or forever if None.
+            max_chain: int, write a full snapshot instead of a delta once this
+                many deltas are stacked on top of each other.
+            durability: str, one of durable_io.LEVELS, for all writes.
+        """
+        durable_io.CheckLevel(durability)
+        self._dir = backup_dir
+        self._objects = os.path.join(backup_dir, 'objects')
+        self._deltas = os.path.join(backup_dir, 'deltas')
+        self._index = os.path.join(backup_dir, 'index')
+        self._keep_all = keep_all_days * _DAY
+        self._keep_daily = keep_daily_days * _DAY
+        self._keep_weekly = (keep_weekly_weeks * 7 * _DAY
+                             if keep_weekly_weeks is not None else None)
+        self._max_chain = max_chain
+        self._durability = durability
+        # (digest, sha1 object, chain length) of the latest backup written by
+        # us, so Append() can hash just the new text.
+        self._head = None
+
+        new_store = not os.path.exists(self._index)
+        for path in (self._objects, self._deltas):
+            if not os.path.isdir(path):
+                os.mkdir(path)
+        if new_store:
+            self._ImportLegacyBackups()
+
+    def _ObjectPath(self, digest):
+        return os.path.join(self._objects, digest + '.gz')
+
+    def _DeltaPath(self, digest):
+        return os.path.join(self._deltas, digest + '.gz')
+
+    def _AddToIndex(self, timestamp, digest):
+        with open(self._index, 'a') as fh:
+            fh.write('%.3f %s\n' % (timestamp, digest))
+            durable_io.Sync(fh, self._durability)
+
+    def Save(self, blob, timestamp=None):
+        """Backs up blob as a full snapshot.
+
+        Returns:
+            str, digest of blob.
+        """
+        sha1 = hashlib.sha1(blob)
+        digest = sha1.hexdigest()
+        if not os.path.exists(self._ObjectPath(digest)):
+            durable_io.WriteAtomically(self._ObjectPath(digest), blob,
+                                       self._durability, compress=True)
+        self._AddToIndex(timestamp or time.time(), digest)
+        self._head = (digest, sha1, 0)
+        self.Prune()
+        return digest
+
+    def Append(self, parent, blob, text, timestamp=None):
+        """Backs up blob, which is backup parent with text appended.
+
+        Only text is stored, unless parent isn't the latest backup written by
+        this instance, or the chain of deltas got too long; then blob is saved
+        in full.
+
+        Args:
+            parent: str or None, digest of the backup text was appended to.
+            blob: str, the full new content, or a function returning it, for
+                callers that can't produce it cheaply. It is only called if
+                the content has to be saved in full.
+            text: str, the appended text.
+            timestamp: float, time of the backup, defaults to now.
+
+        Returns:
+            str, digest of blob.
+        """
+        if (self._head is None or self._head[0] != parent or
+                self._head[2] >= self._max_chain):
+            return self.Save(blob() if callable(blob) else blob, timestamp)
+        parent, parent_sha1, chain = self._head
+        sha1 = parent_sha1.copy()
+        sha1.update(text)
+        digest = sha1.hexdigest()
+        if not (os.path.exists(self._ObjectPath(digest)) or
+                os.path.exists(self._DeltaPath(digest))):
+            durable_io.WriteAtomically(self._DeltaPath(digest), parent + '\n' + text,
+                                       self._durability, compress=True)
+        self._AddToIndex(timestamp or time.time(), digest)
+        self._head = (digest, sha1, chain + 1)
+        return digest
+
+    def Get(self, digest):
+        """Returns the content of the backup with the given digest.
+
+        Raises:
+            BackupStoreError if the backup doesn't exist, or its content
+            doesn't match its digest.
+        """
+        wanted = digest
+        texts = []
+        while True:
+            if not re.match(r'^[0-9a-f]{40}$', digest):
+                raise BackupStoreError('Invalid backup: %s' % digest)
+            blob = _ReadCompressed(self._ObjectPath(digest))
+            if blob is not None:
+                texts.append(blob)
+                break
+            delta = _ReadCompressed(self._DeltaPath(digest))
+            if delta is None:
+                raise BackupStoreError('No such backup: %s' % digest)
+            digest, _, text = delta.partition('\n')
+            texts.append(text)
+        blob = ''.join(reversed(texts))
+        if hashlib.sha1(blob).hexdigest() != wanted:
+            raise BackupStoreError('Corrupt backup: %s' % wanted)
+        return blob
+
+    def List(self):
+        """Returns all backups as Backup tuples, newest first."""
+        if not os.path.exists(self._index):
+            return []
+        backups = []
+        with open(self._index) as fh:
+            for line in fh:
+                try:
+                    timestamp, digest = line.split()
+                    backups.append(Backup(float(timestamp), digest))
+                except ValueError:
+                    # Torn last line after a crash.
+                    continue
+        backups.reverse()
+        return backups
+
+    def Diff(self, old_digest, new_blob):
+        """Returns a unified diff from a backup to new_blob."""
+        old = self.Get(old_digest).splitlines(True)
+        return ''.join(difflib.unified_diff(
+                old, new_blob.splitlines(True), old_digest[:12], 'current'))
+
+    def Prune(self, now=None):
+        """Applies the retention policy and deletes unreferenced content."""
+        now = now or time.time()
+        backups = self.List()
+        kept = []
+        periods = set()
+        for backup in backups:
+            age = now - backup.timestamp
+            if age < self._keep_all:
+                kept.append(backup)
+                continue
+            if age < self._keep_daily:
+                period = ('day', time.strftime('%Y-%m-%d', time.localtime(backup.timestamp)))
+            elif self._keep_weekly is None or age < self._keep_weekly:
+                period = ('week', time.strftime('%Y-%W', time.localtime(backup.timestamp)))
+            else:
+                continue
+            # Backups are newest first, so the first one of a period wins.
+            if period not in periods:
+                periods.add(period)
+                kept.append(backup)
+        if len(kept) == len(backups):
+            return
+
+        durable_io.WriteAtomically(
+                self._index, ''.join('%.3f %s\n' % b for b in reversed(kept)),
+                self._durability)
+
+        # Everything kept backups need, following delta chains.
+        needed = set()
+        for backup in kept:
+            digest = backup.digest
+            while digest not in needed:
+                needed.add(digest)
+                if os.path.exists(self._ObjectPath(digest)):
+                    break
+                try:
+                    delta = _ReadCompressed(self._DeltaPath(digest))
+                except BackupStoreError:
+                    break
+                if delta is None:
+                    break
+                digest = delta.partition('\n')[0]
+        if self._head is not None:
+            needed.add(self._head[0])
+        for path in (self._objects, self._deltas):
+            for name in os.listdir(path):
+                if name.endswith('.gz') and name[:-3] not in needed:
+                    os.remove(os.path.join(path, name))
+
+    def _ImportLegacyBackups(self):
+        """Imports <timestamp>.db (+ .delta) backups of older versions.
+
+        The old files are left alone.
+        """
+        for name in sorted(os.listdir(self._dir)):
+            match = _LEGACY_RE.match(name)
+            if not match:
+                continue
+            timestamp = time.mktime(time.strptime(match.group(1), '%Y%m%d_%H%M%S'))
+            with open(os.path.join(self._dir, name)) as fh:
+                blob = fh.read()
+            digest = self.Save(blob, timestamp)
+            delta = os.path.join(self._dir, name + '.delta')
+            if os.path.exists(delta):
+                with open(delta) as fh:
+                    text = fh.read()
+                self.Append(digest, blob + text, text, timestamp + 1)
+        self._head = None
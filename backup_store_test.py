@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Local imports.
+import backup_store
+
+_DAY = 24 * 3600
+
+
+class TestBackupStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if os.path.isdir(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _Count(self, subdir):
+        return len(os.listdir(os.path.join(self.temp_dir, subdir)))
+
+    def testDeltas(self):
+        store = backup_store.BackupStore(self.temp_dir, max_chain=3)
+        blob = 'base\n'
+        digest = store.Save(blob)
+        digests = [digest]
+        for i in xrange(5):
+            text = 'record %d\n' % i
+            blob += text
+            digest = store.Append(digest, blob, text)
+            self.assertEqual(hashlib.sha1(blob).hexdigest(), digest)
+            digests.append(digest)
+        # Three deltas, then a full snapshot and another delta.
+        self.assertEqual(2, self._Count('objects'))
+        self.assertEqual(4, self._Count('deltas'))
+        self.assertEqual(digests[::-1], [b.digest for b in store.List()])
+        self.assertEqual('base\nrecord 0\nrecord 1\n', store.Get(digests[2]))
+        self.assertEqual(blob, store.Get(digests[-1]))
+
+        # Appending to something other than the latest backup saves in full.
+        store.Append(digests[0], 'other\n', 'other\n')
+        self.assertEqual(3, self._Count('objects'))
+
+    def testRetention(self):
+        store = backup_store.BackupStore(self.temp_dir, keep_all_days=7,
+                                         keep_daily_days=30, keep_weekly_weeks=10)
+        now = time.time()
+        # Four backups a day for 100 days, the newest three hours ago.
+        for hours in xrange(100 * 24 - 3, 0, -6):
+            store.Save('backup %d\n' % hours, now - hours * 3600)
+        store.Prune(now)
+        backups = store.List()
+        ages = [(now - b.timestamp) / _DAY for b in backups]
+        # Everything from the last week, one per day for the rest of the
+        # month, and one per week for the rest of ten weeks.
+        self.assertEqual(7 * 4, len([a for a in ages if a < 7]))
+        self.assertTrue(22 <= len([a for a in ages if 7 <= a < 30]) <= 24)
+        self.assertTrue(5 <= len([a for a in ages if 30 <= a < 70]) <= 7)
+        self.assertEqual([], [a for a in ages if a >= 70])
+        # Content of pruned backups is gone.
+        self.assertEqual(len(backups), self._Count('objects'))
+        for backup in backups:
+            store.Get(backup.digest)
+
+    def testCorruptBackup(self):
+        store = backup_store.BackupStore(self.temp_dir)
+        digest = store.Save('abcd:johnny\n' * 100)
+        path = os.path.join(self.temp_dir, 'objects', digest + '.gz')
+        with open(path) as fh:
+            data = fh.read()
+        with open(path, 'w') as fh:
+            fh.write(data[:len(data) // 2])
+        self.assertRaises(backup_store.BackupStoreError, store.Get, digest)
+        # A torn line at the end of the index is skipped.
+        with open(os.path.join(self.temp_dir, 'index'), 'a') as fh:
+            fh.write('1234.5')
+        self.assertEqual([digest], [b.digest for b in store.List()])
+
+    def testLegacyBackups(self):
+        with open(os.path.join(self.temp_dir, '20160101_120000.db'), 'w') as fh:
+            fh.write('abcd:johnny\n')
+        with open(os.path.join(self.temp_dir, '20160101_120000.db.delta'), 'w') as fh:
+            fh.write('1111:bobby\n')
+        store = backup_store.BackupStore(self.temp_dir, keep_weekly_weeks=None)
+        backups = store.List()
+        self.assertEqual(2, len(backups))
+        self.assertEqual('abcd:johnny\n1111:bobby\n', store.Get(backups[0].digest))
+        self.assertIn('+1111:bobby', store.Diff(backups[1].digest, store.Get(backups[0].digest)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# Door configuration, read from the pin configuration file (pins.cfg).
+#
+# Each door has a section of its own, door:<name>, with the BCM gpio numbers
+# of its reader, lock and outputs:
+#
+#   [door:front]
+#   data_low = 17
+#   data_high = 18
+#   lock = 23
+#   led = 27
+#   beep = 22
+#   doorbell = 24
+#
+#   [door:workshop]
+#   data_low = 5
+#   data_high = 6
+#   lock = 13
+#   open_time = 10
+#
+# data_low, data_high and lock are required, led, beep and doorbell are
+# optional. open_time overrides --open_time for the door. Users can be
+# restricted to some of the doors with doors=<name>[,<name>...] in the user
+# database.
+#
+# A file without door sections is read the way it always was: its [Pins]
+# section, with every pin defaulting to DEFAULT_PINS, is the only door,
+# called DEFAULT_DOOR. The doorbell has no default, since its pin may be
+# wired to something else; it is only watched if configured.
+
+import ConfigParser
+import collections
+import re
+
+# GPIO4 is NOT 4...
+# To know what number to use here see:
+# http://openmicros.org/index.php/articles/94-ciseco-product-documentation/raspberry-pi/217-getting-started-with-raspberry-pi-gpio-and-python
+DEFAULT_PINS = { 'data_low':17, 'data_high':18, 'led':27, 'beep':22, 'lock':23 }
+PIN_SECTION = 'Pins'
+DEFAULT_DOOR = 'front'
+
+_DOOR_SECTION_RE = re.compile(r'^door:([A-Za-z0-9_-]+)$')
+_REQUIRED_PINS = ('data_low', 'data_high', 'lock')
+_OPTIONAL_PINS = ('led', 'beep', 'doorbell')
+
+# Pins are None if the door doesn't have them. open_time is None for the
+# default.
+Door = collections.namedtuple(
+        'Door', 'name data_low data_high lock led beep doorbell open_time')
+
+
+class DoorConfigError(Exception):
+    """Invalid pin configuration file."""
+    pass
+
+
+def _ReadDoor(config_parser, section, name):
+    pins = {}
+    for pin in _REQUIRED_PINS + _OPTIONAL_PINS:
+        if config_parser.has_option(section, pin):
+            try:
+                pins[pin] = config_parser.getint(section, pin)
+            except ValueError:
+                raise DoorConfigError('Invalid %s pin of door %s' % (pin, name))
+        elif pin in _REQUIRED_PINS:
+            raise DoorConfigError('Door %s has no %s pin' % (name, pin))
+        else:
+            pins[pin] = None
+    open_time = None
+    if config_parser.has_option(section, 'open_time'):
+        try:
+            open_time = config_parser.getfloat(section, 'open_time')
+        except ValueError:
+            raise DoorConfigError('Invalid open_time of door %s' % name)
+    return Door(name=name, open_time=open_time, **pins)
+
+
+def Read(pin_config):
+    """Reads the doors from a pin configuration file.
+
+    Args:
+        pin_config: str or None, path of the file. If None or missing, there
+            is one door with the default pins.
+
+    Returns:
+        List of Door, in the order of the file.
+
+    Raises:
+        DoorConfigError: if the file is invalid.
+    """
+    config_parser = ConfigParser.RawConfigParser()
+    if pin_config:
+        try:
+            config_parser.read(pin_config)
+        except ConfigParser.Error, e:
+            raise DoorConfigError(str(e))
+    doors = []
+    for section in config_parser.sections():
+        match = _DOOR_SECTION_RE.match(section)
+        if match:
+            doors.append(_ReadDoor(config_parser, section, match.group(1)))
+    if not doors:
+        legacy = ConfigParser.RawConfigParser(DEFAULT_PINS)
+        legacy.add_section(PIN_SECTION)
+        if config_parser.has_section(PIN_SECTION):
+            for key, value in config_parser.items(PIN_SECTION):
+                legacy.set(PIN_SECTION, key, value)
+        doors.append(_ReadDoor(legacy, PIN_SECTION, DEFAULT_DOOR))
+
+    used = {}
+    for door in doors:
+        for pin in _REQUIRED_PINS + _OPTIONAL_PINS:
+            gpio = getattr(door, pin)
+            if gpio is None:
+                continue
+            if gpio in used:
+                raise DoorConfigError('Pin %d is used by both %s and %s %s' % (
+                        gpio, used[gpio], door.name, pin))
+            used[gpio] = '%s %s' % (door.name, pin)
+    return doors
+
+
+def WriteDefault(pin_config):
+    """Writes a configuration file with one door with the default pins."""
+    config_parser = ConfigParser.RawConfigParser(DEFAULT_PINS)
+    config_parser.add_section(PIN_SECTION)
+    with open(pin_config, 'w') as cfg_file:
+        config_parser.write(cfg_file)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local imports.
+import door_config
+
+
+class TestDoorConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pin_config = os.path.join(self.temp_dir, 'pins.cfg')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _Write(self, text):
+        with open(self.pin_config, 'w') as fh:
+            fh.write(text)
+
+    def testDefault(self):
+        doors = door_config.Read(None)
+        self.assertEqual(1, len(doors))
+        self.assertEqual(door_config.DEFAULT_DOOR, doors[0].name)
+        self.assertEqual(17, doors[0].data_low)
+        door_config.WriteDefault(self.pin_config)
+        self.assertEqual(doors, door_config.Read(self.pin_config))
+
+    def testLegacy(self):
+        self._Write('[Pins]\nlock = 5\n')
+        door, = door_config.Read(self.pin_config)
+        # No doorbell unless configured.
+        self.assertEqual(('front', 5, 18, None), (door.name, door.lock, door.data_high,
+                                                   door.doorbell))
+        self._Write('[Pins]\nlock = 5\ndoorbell = 24\n')
+        self.assertEqual(24, door_config.Read(self.pin_config)[0].doorbell)
+
+    def testDoors(self):
+        self._Write('[Pins]\nlock = 5\n'
+                    '[door:front]\ndata_low = 17\ndata_high = 18\nlock = 23\ndoorbell = 24\n'
+                    '[door:workshop]\ndata_low = 5\ndata_high = 6\nlock = 13\n'
+                    'open_time = 10\n')
+        front, workshop = door_config.Read(self.pin_config)
+        self.assertEqual(door_config.Door('front', 17, 18, 23, None, None, 24, None), front)
+        self.assertEqual(door_config.Door('workshop', 5, 6, 13, None, None, None, 10.0),
+                         workshop)
+
+    def testErrors(self):
+        for text in ('[door:a]\ndata_low = 1\ndata_high = 2\n',
+                     '[door:a]\ndata_low = 1\ndata_high = 2\nlock = x\n',
+                     '[door:a]\ndata_low = 1\ndata_high = 2\nlock = 3\nopen_time = y\n',
+                     '[door:a]\ndata_low = 1\ndata_high = 2\nlock = 3\n'
+                     '[door:b]\ndata_low = 4\ndata_high = 5\nlock = 1\n',
+                     'data_low = 1\n'):
+            self._Write(text)
+            self.assertRaises(door_config.DoorConfigError, door_config.Read, self.pin_config)
+
+
+if __name__ == '__main__':
+    unittest.main()
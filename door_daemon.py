@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Door controller daemon: owns the readers, locks and doorbells, and decides
+# who gets in, so that neither page renders nor restarts of the web interface
+# get in the way of the doors.
+#
+# Swipes are looked up in the user database (--user_db), which the daemon
+# only reads; the web interface edits it, and the daemon picks the changes
+# up. Repeated reads of unknown tags and the lockout are handled here too,
+# see unknown_tags.
+#
+# Clients talk to it over a Unix socket (--door_socket), see door_ipc:
+#
+#   Unlock(door=None) unlocks a door for its open time.
+#   GetStatus() returns the doors, which locks are open and the swipe stats.
+#   ClearUnknownTags() forgets the unknown tags, after users were added.
+#   Subscribe streams the events:
+#       swipe: {"rfid": ..., "door": ..., "authorized": ..., "name": ...,
+#               plus facility and card if known}
+#       doorbell: {"door": ...}
+#       log: a record of the unknown tag filter, e.g.
+#            {"action": "unknown_tag_lockout", ...}
+#
+# Authorized swipes have unlocked the door by the time they are sent.
+# RFIDLovePotion.py --door_socket logs and shows them, through
+# remote_hardware. doorbell.py --door_socket and doorctl.py are other clients.
+
+from __future__ import print_function
+
+import argparse
+import os
+import signal
+
+# Local imports.
+import door_ipc
+import hardware
+import swipe_filter
+import unknown_tags
+import user_db
+
+DEFAULT_SOCKET = '~/.config/lovepotion/door.sock'
+
+# Methods clients may call.
+METHODS = ('ClearUnknownTags', 'GetStatus', 'Unlock')
+
+
+def ParseFlags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mock', action='store_true', help='Use mock hardware')
+    parser.add_argument('--door_socket', default=DEFAULT_SOCKET, type=str,
+                        help='Unix socket to serve clients on')
+    parser.add_argument('--open_time', type=int, default=3,
+                        help='Time in seconds to keep lock open, for doors without '
+                        'an open_time of their own')
+    parser.add_argument('--pin_config', default='~/.config/lovepotion/pins.cfg',
+                        type=str, help='Location of the pin configuration file, with a '
+                        '[door:<name>] section per door, see door_config.py')
+    parser.add_argument('--swipe_window', default=1.0, type=float,
+                        help='Seconds during which repeated reads of the same card by '
+                        'a reader are ignored')
+    parser.add_argument('--wiegand_lengths', default='', type=str,
+                        help='Comma separated frame lengths in bits to accept from the '
+                        'reader, e.g. 26,34,37. By default all are accepted. 26, 34 '
+                        'and 37 bit frames are parity checked')
+    parser.add_argument('--doorbell_debounce', default=1.0, type=float,
+                        help='Seconds during which further doorbell presses are ignored')
+    parser.add_argument('--user_db', default='~/.config/lovepotion/users.db', type=str,
+                        help='User database to authorize tags with: a text file, or '
+                        'sqlite:<path> for an SQLite database. Only read')
+    parser.add_argument('--unknown_tag_ttl', default=30, type=float,
+                        help='Seconds to remember an unknown tag. Repeated reads of it '
+                        'are counted instead of looked up and reported')
+    parser.add_argument('--unknown_tag_limit', default=0, type=int,
+                        help='Lock the reader out once more than this many different '
+                        'unknown tags were read within a minute. During the lockout '
+                        'known tags are ignored too, so this trades brute-force '
+                        'protection for a way to lock members out. 0 (the default) '
+                        'disables this')
+    parser.add_argument('--unknown_tag_lockout', default=60, type=float,
+                        help='Seconds to ignore all tags for after too many unknown tags')
+    return parser.parse_args()
+
+
+class DoorDaemon(object):
+    """Unlocks doors for authorized tags, and serves the hardware to door_ipc clients."""
+
+    def __init__(self, hw, path, users, **tag_filter):
+        """Constructor.
+
+        Args:
+            hw: hardware.Hardware, not initialized yet.
+            path: str, path of the Unix socket.
+            users: user database to authorize tags with, e.g. a read-only
+                user_db.UserDb.
+            tag_filter: passed on to unknown_tags.UnknownTagFilter.
+        """
+        self._hw = hw
+        self._users = users
+        self._server = door_ipc.Server(path, self, METHODS)
+        self._unknown_tags = unknown_tags.UnknownTagFilter(self._Report, **tag_filter)
+
+    def Start(self):
+        """Initializes the hardware, and starts serving clients."""
+        self._hw.SetTagSeenHandler(self._TagSeen)
+        self._hw.SetDoorbellHandler(self._DoorbellPressed)
+        self._hw.Initialize()
+        self._server.Start()
+
+    def Stop(self):
+        """Stops serving clients, and shuts the hardware down."""
+        self._server.Stop()
+        self._hw.ShutDown()
+
+    def _TagSeen(self, rfid, door=None, **details):
+        # Called from the thread of the door's reader.
+        if self._unknown_tags.Check(rfid) != unknown_tags.LOOKUP:
+            return
+        authorized, name = self._users.AuthorizeRfidTag(rfid, door=door)
+        if name is None:
+            self._unknown_tags.AddUnknown(rfid)
+        if authorized:
+            self._hw.UnlockDoor(door)
+        details.update(rfid=rfid, door=door, authorized=authorized, name=name)
+        self._server.Publish('swipe', details)
+
+    def _Report(self, **record):
+        self._server.Publish('log', record)
+
+    def _DoorbellPressed(self, door):
+        self._server.Publish('doorbell', dict(door=door))
+
+    def GetStatus(self):
+        """Returns the state of the doors, as a dict.
+
+        Returns:
+            dict with doors, a list of the door_config.Door of each door as
+            dicts, default_door, open, the names of the doors whose lock is
+            open, and swipes, the swipe_filter stats.
+        """
+        return dict(
+                doors=[door._asdict() for door in self._hw.doors],
+                default_door=self._hw.default_door,
+                open=sorted(name for name, actuator in self._hw.actuators.iteritems()
+                            if actuator.is_open),
+                swipes=self._hw.GetSwipeStats())
+
+    def ClearUnknownTags(self):
+        """Forgets the unknown tags, so that tags just added are looked up."""
+        self._unknown_tags.Clear()
+
+    def Unlock(self, door=None):
+        """Unlocks a door for its open time.
+
+        Returns:
+            str, name of the door.
+
+        Raises:
+            KeyError: if there is no such door.
+        """
+        door = door or self._hw.default_door
+        self._hw.UnlockDoor(door)
+        return door
+
+
+def Main():
+    args = ParseFlags()
+    hw = hardware.Instantiate(
+            args.mock, args.open_time, os.path.expanduser(args.pin_config),
+            swipe_window=args.swipe_window,
+            wiegand_lengths=swipe_filter.ParseLengths(args.wiegand_lengths),
+            doorbell_debounce=args.doorbell_debounce)
+    users = user_db.Instantiate(args.user_db, None, read_only=True)
+    daemon = DoorDaemon(hw, os.path.expanduser(args.door_socket), users,
+                        ttl=args.unknown_tag_ttl, limit=args.unknown_tag_limit,
+                        lockout=args.unknown_tag_lockout)
+    daemon.Start()
+
+    def _Stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, _Stop)
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    daemon.Stop()
+    users.Close()
+    print('swipe stats: %s' % hw.GetSwipeStats())
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import os
+import Queue
+import shutil
+import tempfile
+import time
+import unittest
+
+# Local imports.
+import door_daemon
+import door_ipc
+import mock_hardware
+import remote_hardware
+import user_db
+
+
+class TestDoorDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        pin_config = os.path.join(self.temp_dir, 'pins.cfg')
+        with open(pin_config, 'w') as fh:
+            fh.write('[door:front]\ndata_low = 17\ndata_high = 18\nlock = 23\n'
+                     '[door:back]\ndata_low = 5\ndata_high = 6\nlock = 13\n'
+                     'open_time = 0.1\n')
+        self.path = os.path.join(self.temp_dir, 'door.sock')
+        self.user_db = os.path.join(self.temp_dir, 'users.db')
+        with open(self.user_db, 'w') as fh:
+            fh.write('1234:johnny\nabcd:bobby:doors=front\n')
+        self.users = user_db.UserDb(self.user_db, None, reload_interval=0, read_only=True)
+        self.hw = mock_hardware.MockHardware(0.2, pin_config, doorbell_debounce=1.0)
+        self.daemon = door_daemon.DoorDaemon(self.hw, self.path, self.users)
+        self.daemon.Start()
+        self.remote = remote_hardware.RemoteHardware(self.path)
+        self.swipes = Queue.Queue()
+        self.presses = Queue.Queue()
+        self.records = Queue.Queue()
+        self.remote.SetTagSeenHandler(
+                lambda rfid, **details: self.swipes.put((rfid, details)))
+        self.remote.SetDoorbellHandler(self.presses.put)
+        self.remote.SetLogHandler(lambda **record: self.records.put(record))
+        self.remote.Initialize()
+        self.assertTrue(self.remote._subscription.connected.wait(5))
+
+    def tearDown(self):
+        self.remote.ShutDown()
+        self.daemon.Stop()
+        shutil.rmtree(self.temp_dir)
+
+    def _WaitLocked(self, door):
+        deadline = time.time() + 5
+        while not self.hw.door_events[door] or not self.hw.door_events[door][-1][1]:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def testDoors(self):
+        self.assertEqual(['front', 'back'], [door.name for door in self.remote.doors])
+        self.assertEqual(self.hw.doors, self.remote.doors)
+        self.assertEqual('front', self.remote.default_door)
+
+    def testSwipe(self):
+        self.hw.ScanTag('1234', door='back')
+        self.hw.ScanFrame(26, (1 << 25) | (42 << 17) | (1000 << 1) | 1)
+        self.assertEqual(('1234', dict(door='back', authorized=True, name='johnny')),
+                         self.swipes.get(timeout=5))
+        rfid, details = self.swipes.get(timeout=5)
+        self.assertEqual(dict(door='front', facility=42, card=1000, authorized=False,
+                              name=None), details)
+        self.assertEqual(2, self.remote.GetSwipeStats()['forwarded'])
+        # The daemon unlocked the door by itself.
+        self._WaitLocked('back')
+        self.assertEqual([], self.hw.door_events['front'])
+
+    def testAuthorizeWithoutClients(self):
+        # Doors open while the web interface restarts.
+        self.remote.ShutDown()
+        self.hw.ScanTag('abcd', door='back')
+        self.hw.ScanTag('abcd', door='front')
+        self._WaitLocked('front')
+        self.assertEqual([], self.hw.door_events['back'])
+        # Changes to the user database are picked up.
+        with open(self.user_db, 'a') as fh:
+            fh.write('5678:jimmy\n')
+        self.hw.ScanTag('5678', door='back')
+        self._WaitLocked('back')
+        self.remote = remote_hardware.RemoteHardware(self.path)
+
+    def testUnknownTags(self):
+        for _ in xrange(2):
+            self.hw.ScanTag('ffff', door='back')
+            self.hw.ScanTag('1234', door='back')
+        # Only the first read of the unknown tag was looked up.
+        self.assertEqual(['ffff', '1234', '1234'],
+                         [self.swipes.get(timeout=5)[0] for _ in xrange(3)])
+        client = door_ipc.Client(self.path)
+        client.ClearUnknownTags()
+        record = self.records.get(timeout=5)
+        self.assertEqual(('unknown_tag_repeat', 'ffff'), (record['action'], record['rfid']))
+        self.hw.ScanTag('ffff', door='back')
+        self.assertEqual('ffff', self.swipes.get(timeout=5)[0])
+        client.Close()
+
+    def testDoorbell(self):
+        self.assertTrue(self.hw.PressDoorbell('back'))
+        self.assertFalse(self.hw.PressDoorbell('back'))
+        self.assertEqual('back', self.presses.get(timeout=5))
+
+    def testUnlock(self):
+        self.remote.UnlockDoor('back')
+        self._WaitLocked('back')
+        self.assertEqual([False, True], [locked for _, locked in self.hw.door_events['back']])
+        self.assertEqual([], self.hw.door_events['front'])
+        self.assertRaises(door_ipc.IpcError, self.remote.UnlockDoor, 'side')
+
+    def testStatus(self):
+        client = door_ipc.Client(self.path)
+        self.assertEqual('front', client.Unlock())
+        deadline = time.time() + 5
+        while 'front' not in client.GetStatus()['open']:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self._WaitLocked('front')
+        self.assertEqual([], client.GetStatus()['open'])
+        client.Close()
+
+    def testRestartClient(self):
+        # The doors don't care about their clients coming and going.
+        self.remote.UnlockDoor('front')
+        self.remote.ShutDown()
+        self._WaitLocked('front')
+        self.assertEqual(2, len(self.hw.door_events['front']))
+        self.remote = remote_hardware.RemoteHardware(self.path)
+        self.remote.Initialize()
+        self.assertEqual(['front', 'back'], [door.name for door in self.remote.doors])
+
+
+if __name__ == '__main__':
+    unittest.main()
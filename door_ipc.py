@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+#
+# Local RPC and event stream over a Unix socket: between RFIDLovePotion.py
+# and its web workers (--serve=production), and between door_daemon.py and
+# its clients.
+#
+# Requests and responses are JSON objects, one per line:
+#
+#   -> {"method": "Unlock", "args": ["bob"], "kwargs": {"door": "front"}}
+#   <- {"result": true}
+#   <- {"error": {"type": "UserDbError", "message": "...", "diagnostics": []}}
+#
+# A connection carries one call at a time. The client keeps a connection per
+# thread, so calls of different threads (and long calls, like waiting for
+# events) don't queue up behind each other. JSON turns tuples into lists and
+# strings into unicode, so methods exposed this way take and return plain
+# data.
+#
+# A client calling Subscribe turns its connection into an event stream, on
+# which the server sends what it publishes, plus heartbeats. The first
+# heartbeat confirms the subscription:
+#
+#   -> {"method": "Subscribe"}
+#   <- {"event": "swipe", "data": {"rfid": "1234", "door": "front"}}
+#   <- {"event": "heartbeat"}
+#
+# Events are sent from the connection's thread, so a slow subscriber never
+# holds up the publisher. One that falls more than SUBSCRIBER_QUEUE events
+# behind is disconnected.
+
+import functools
+import json
+import os
+import Queue
+import socket
+import threading
+import traceback
+
+# Number of events queued per subscriber before it is dropped.
+SUBSCRIBER_QUEUE = 1000
+# Seconds between heartbeats on idle event streams.
+HEARTBEAT = 15
+
+
+class IpcError(Exception):
+    """Failed call, or an error without a local exception type."""
+
+    def __init__(self, message, diagnostics=None):
+        super(IpcError, self).__init__(message)
+        self.diagnostics = diagnostics or []
+
+
+class Server(object):
+    """Serves calls to some methods of an object, one thread per connection."""
+
+    def __init__(self, path, target, methods):
+        """Constructor.
+
+        Args:
+            path: str, path of the Unix socket. A stale socket is replaced.
+            target: object whose methods are called.
+            methods: names of the methods that may be called.
+        """
+        self._path = path
+        self._target = target
+        self._methods = frozenset(methods)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(path)
+        # Only our own user (the web workers) may call us.
+        os.chmod(path, 0600)
+        self._sock.listen(64)
+        self._thread = None
+        # Threads serving the open connections, by connection.
+        self._connections = {}
+        # Event queues of the subscribed connections, by connection.
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def Start(self):
+        """Starts accepting connections."""
+        self._thread = threading.Thread(target=self._Accept, name='ipc-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Stop(self):
+        """Stops accepting connections, closes the open ones and removes the socket.
+
+        Returns once calls in progress are done, so the target is not called
+        after this.
+        """
+        self._sock.shutdown(socket.SHUT_RDWR)
+        self._sock.close()
+        self._thread.join()
+        with self._lock:
+            connections = self._connections.items()
+            subscribers = self._subscribers.values()
+        # Wake up event streams waiting for the next event or heartbeat.
+        for queue in subscribers:
+            try:
+                queue.put_nowait(None)
+            except Queue.Full:
+                pass
+        for conn, thread in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # Already closed by its thread.
+                pass
+        for conn, thread in connections:
+            thread.join()
+        os.unlink(self._path)
+
+    def Publish(self, kind, data=None):
+        """Sends an event to all subscribers. Never blocks.
+
+        Args:
+            kind: str, type of the event.
+            data: plain data that goes with it.
+        """
+        line = json.dumps(dict(event=kind, data=data)) + '\n'
+        with self._lock:
+            subscribers = self._subscribers.items()
+        for conn, queue in subscribers:
+            try:
+                queue.put_nowait(line)
+            except Queue.Full:
+                self._Drop(conn)
+
+    def _Drop(self, conn):
+        """Ends an event stream; its thread notices on its next send."""
+        with self._lock:
+            self._subscribers.pop(conn, None)
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _Accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.error:
+                # Stop() closed the socket.
+                return
+            thread = threading.Thread(target=self._Serve, args=(conn,),
+                                      name='ipc-connection')
+            thread.daemon = True
+            with self._lock:
+                self._connections[conn] = thread
+            thread.start()
+
+    def _Serve(self, conn):
+        rfile = conn.makefile('rb')
+        try:
+            for line in rfile:
+                if self._IsSubscribe(line):
+                    self._Stream(conn)
+                    break
+                conn.sendall(json.dumps(self._Call(line)) + '\n')
+        except socket.error:
+            # Client went away.
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.pop(conn, None)
+                self._connections.pop(conn, None)
+            rfile.close()
+            conn.close()
+
+    @staticmethod
+    def _IsSubscribe(line):
+        try:
+            return json.loads(line).get('method') == 'Subscribe'
+        except (ValueError, AttributeError):
+            # _Call() reports the error.
+            return False
+
+    def _Stream(self, conn):
+        queue = Queue.Queue(SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers[conn] = queue
+        heartbeat = json.dumps(dict(event='heartbeat')) + '\n'
+        conn.sendall(heartbeat)
+        while True:
+            try:
+                line = queue.get(timeout=HEARTBEAT)
+            except Queue.Empty:
+                line = heartbeat
+            if line is None:
+                # Stop() ends the stream.
+                return
+            # Raises socket.error once dropped, or if the client went away.
+            conn.sendall(line)
+
+    def _Call(self, line):
+        try:
+            request = json.loads(line)
+            method = request['method']
+            if method not in self._methods:
+                raise IpcError('Unknown method: %s' % method)
+            kwargs = dict((str(k), v) for k, v in request.get('kwargs', {}).iteritems())
+            return dict(result=getattr(self._target, method)(*request.get('args', []),
+                                                             **kwargs))
+        except Exception, e:
+            return dict(error=dict(type=type(e).__name__, message=str(e),
+                                   diagnostics=getattr(e, 'diagnostics', None)))
+
+
+class Client(object):
+    """Calls methods of a Server: client.Unlock('bob', door='front').
+
+    Errors of the types given to the constructor are raised as such, all
+    others as IpcError.
+    """
+
+    def __init__(self, path, errors=()):
+        """Constructor.
+
+        Args:
+            path: str, path of the Unix socket.
+            errors: exception classes to re-raise, taking a message and a
+                list of diagnostics, like user_db.UserDbError.
+        """
+        self._path = path
+        self._errors = dict((cls.__name__, cls) for cls in errors)
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return functools.partial(self.Call, name)
+
+    def _Connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.connect(self._path)
+            self._local.conn = conn
+            self._local.rfile = conn.makefile('rb')
+        return conn
+
+    def _Disconnect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.rfile.close()
+            conn.close()
+            self._local.conn = None
+
+    def Call(self, method, *args, **kwargs):
+        """Calls a method, and returns its result."""
+        request = json.dumps(dict(method=method, args=args, kwargs=kwargs)) + '\n'
+        try:
+            self._Connect().sendall(request)
+            line = self._local.rfile.readline()
+        except socket.error, e:
+            self._Disconnect()
+            raise IpcError('Calling %s failed: %s' % (method, e))
+        if not line:
+            self._Disconnect()
+            raise IpcError('Calling %s failed: connection closed' % method)
+        response = json.loads(line)
+        error = response.get('error')
+        if error is not None:
+            cls = self._errors.get(error['type'], IpcError)
+            raise cls(error['message'], error['diagnostics'])
+        return response['result']
+
+    def Close(self):
+        """Closes the calling thread's connection."""
+        self._Disconnect()
+
+    def Subscribe(self, callback, retry=1.0):
+        """Receives the server's events, on a thread of their own.
+
+        The subscription reconnects by itself when the server goes away, e.g.
+        when it restarts. Events published in between are lost.
+
+        Args:
+            callback: function, called with the type and the data of each
+                event, from the subscription's thread.
+            retry: float, seconds to wait before reconnecting.
+
+        Returns:
+            Subscription.
+        """
+        return Subscription(self._path, callback, retry)
+
+
+class Subscription(object):
+    """Event stream of a Server, see Client.Subscribe()."""
+
+    def __init__(self, path, callback, retry):
+        self._path = path
+        self._callback = callback
+        self._retry = retry
+        # Socket of the current stream, if connected.
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Set while subscribed to the server.
+        self.connected = threading.Event()
+        self._thread = threading.Thread(target=self._Run, name='ipc-subscription')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _Run(self):
+        while not self._stopped.is_set():
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with self._lock:
+                self._conn = conn
+            try:
+                if not self._stopped.is_set():
+                    conn.connect(self._path)
+                    conn.sendall(json.dumps(dict(method='Subscribe')) + '\n')
+                    self._Receive(conn)
+            except socket.error:
+                pass
+            finally:
+                self.connected.clear()
+                with self._lock:
+                    self._conn = None
+                conn.close()
+            self._stopped.wait(self._retry)
+
+    def _Receive(self, conn):
+        rfile = conn.makefile('rb')
+        try:
+            for line in rfile:
+                event = json.loads(line)
+                if event['event'] == 'heartbeat':
+                    self.connected.set()
+                    continue
+                try:
+                    self._callback(event['event'], event['data'])
+                except Exception:
+                    # Keep receiving; a bad event shouldn't end the stream.
+                    traceback.print_exc()
+        finally:
+            rfile.close()
+
+    def Close(self):
+        """Ends the subscription, and waits for its thread to finish."""
+        self._stopped.set()
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        self._thread.join()
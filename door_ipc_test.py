@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Local imports.
+import door_ipc
+import user_db
+
+
+class _Target(object):
+
+    def __init__(self):
+        self.unlocked = []
+        self.release = threading.Event()
+
+    def Unlock(self, user, door=None):
+        self.unlocked.append((user, door))
+        return True
+
+    def GetStatus(self):
+        return dict(doors=['front', 'back'], rfid='')
+
+    def Replace(self, text):
+        raise user_db.UserDbError('Not saved', [(3, 'bad line')])
+
+    def Crash(self):
+        raise ValueError('oops')
+
+    def Wait(self):
+        self.release.wait()
+        return 'released'
+
+    def Secret(self):
+        return 'not exposed'
+
+
+class TestDoorIpc(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'control.sock')
+        self.target = _Target()
+        self.server = door_ipc.Server(
+                self.path, self.target, ('Unlock', 'GetStatus', 'Replace', 'Crash', 'Wait'))
+        self.server.Start()
+        self.client = door_ipc.Client(self.path, errors=(user_db.UserDbError,))
+
+    def tearDown(self):
+        self.client.Close()
+        self.server.Stop()
+        shutil.rmtree(self.temp_dir)
+
+    def testCall(self):
+        self.assertTrue(self.client.Unlock('bob', door='back'))
+        self.assertEqual([('bob', 'back')], self.target.unlocked)
+        self.assertEqual({'doors': ['front', 'back'], 'rfid': ''},
+                         self.client.GetStatus())
+        # Only the owner may connect.
+        self.assertEqual(0600, os.stat(self.path).st_mode & 0777)
+
+    def testErrors(self):
+        with self.assertRaises(user_db.UserDbError) as cm:
+            self.client.Replace('users')
+        self.assertEqual('Not saved', str(cm.exception))
+        self.assertEqual([[3, 'bad line']], cm.exception.diagnostics)
+        with self.assertRaises(door_ipc.IpcError) as cm:
+            self.client.Crash()
+        self.assertEqual('oops', str(cm.exception))
+        self.assertRaises(door_ipc.IpcError, self.client.Secret)
+        # The connection is still usable.
+        self.assertTrue(self.client.Unlock('bob'))
+
+    def testServerDown(self):
+        self.client.Close()
+        self.server.Stop()
+        self.assertRaises(door_ipc.IpcError, self.client.Unlock, 'bob')
+        # Comes back on a new socket.
+        self.server = door_ipc.Server(self.path, self.target, ('Unlock',))
+        self.server.Start()
+        self.assertTrue(self.client.Unlock('bob'))
+
+    def testThreads(self):
+        # A blocked call of one thread doesn't hold up the others.
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.client.Wait()))
+        waiter.start()
+        self.assertTrue(self.client.Unlock('bob'))
+        self.assertEqual([], results)
+        self.target.release.set()
+        waiter.join()
+        self.assertEqual(['released'], results)
+
+    def testStop(self):
+        # Stop() closes idle connections and streams, and waits for calls in
+        # progress, so none of them calls the target afterwards.
+        self.assertTrue(self.client.Unlock('bob'))
+        subscription = door_ipc.Client(self.path).Subscribe(lambda kind, data: None)
+        self.assertTrue(subscription.connected.wait(5))
+        waiter = threading.Thread(target=self.client.Wait)
+        waiter.start()
+        while len(self.server._connections) < 3:
+            time.sleep(0.01)
+        stopper = threading.Thread(target=self.server.Stop)
+        start = time.time()
+        stopper.start()
+        stopper.join(0.2)
+        self.assertTrue(stopper.is_alive())
+        self.target.release.set()
+        stopper.join(5)
+        self.assertFalse(stopper.is_alive())
+        self.assertLess(time.time() - start, door_ipc.HEARTBEAT)
+        self.assertEqual({}, self.server._connections)
+        self.assertEqual([], [thread for thread in threading.enumerate()
+                              if thread.name == 'ipc-connection'])
+        subscription.Close()
+        waiter.join()
+        self.server = door_ipc.Server(self.path, self.target, ('Unlock',))
+        self.server.Start()
+
+
+class TestSubscribe(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'door.sock')
+        self.server = door_ipc.Server(self.path, _Target(), ('Unlock',))
+        self.server.Start()
+        self.events = Queue.Queue()
+        self.subscription = door_ipc.Client(self.path).Subscribe(
+                lambda kind, data: self.events.put((kind, data)), retry=0.05)
+        self.assertTrue(self.subscription.connected.wait(5))
+
+    def tearDown(self):
+        self.subscription.Close()
+        self.server.Stop()
+        shutil.rmtree(self.temp_dir)
+
+    def testEvents(self):
+        self.server.Publish('swipe', dict(rfid='1234', door='front'))
+        self.server.Publish('doorbell', dict(door='back'))
+        self.assertEqual(('swipe', {'rfid': '1234', 'door': 'front'}),
+                         self.events.get(timeout=5))
+        self.assertEqual(('doorbell', {'door': 'back'}), self.events.get(timeout=5))
+        # Calls go over connections of their own.
+        self.assertTrue(door_ipc.Client(self.path).Unlock('bob'))
+
+    def testReconnect(self):
+        self.server.Stop()
+        self.server = door_ipc.Server(self.path, _Target(), ('Unlock',))
+        self.server.Start()
+        deadline = time.time() + 5
+        while not self.subscription.connected.is_set() or not self.server._subscribers:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.server.Publish('doorbell', dict(door='front'))
+        self.assertEqual(('doorbell', {'door': 'front'}), self.events.get(timeout=5))
+
+    def testSlowSubscriber(self):
+        # A subscriber that doesn't keep up is dropped, without blocking the
+        # publisher.
+        path = os.path.join(self.temp_dir, 'slow.sock')
+        server = door_ipc.Server(path, _Target(), ())
+        server.Start()
+        release = threading.Event()
+        slow = door_ipc.Client(path).Subscribe(lambda kind, data: release.wait(),
+                                               retry=0.05)
+        self.assertTrue(slow.connected.wait(5))
+        start = time.time()
+        for i in xrange(door_ipc.SUBSCRIBER_QUEUE * 3):
+            server.Publish('swipe', dict(rfid='%d' % i, door='x' * 1000))
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual({}, server._subscribers)
+        # It subscribes again once it catches up.
+        release.set()
+        deadline = time.time() + 5
+        while not server._subscribers:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        slow.Close()
+        server.Stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,84 @@
 #!/usr/bin/python
+#
+# Standalone doorbell announcer, for a Pi that doesn't run RFIDLovePotion.py.
+# RFIDLovePotion.py watches the doorbell itself (see --doorbell_port); don't
+# run both on the same Pi.
+#
+# pigpio calls back on the falling edge of the button, so nothing polls, and
+# announcements are sent in the background.
+#
+# With --door_socket, the doorbells are those of a door_daemon.py, which
+# owns the gpios; presses of all its doors are announced.
 
-import RPi.GPIO as GPIO  
-import time
+import argparse
+import os
+import signal
 
+# Local imports.
+import door_config
+import door_ipc
+import hardware
 import send_string
 
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(18, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+DOORBELL_GPIO = door_config.DEFAULT_PINS['doorbell']
 
-s = send_string.SendString('192.168.1.17', 4002)
-while True:
-  bell = GPIO.input(18)
-  if not bell:
-    s.Send('foo')
-    time.sleep(1)
-  else:
-    time.sleep(0.2)
 
+def ParseFlags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--door_socket', default='', type=str,
+                        help='Socket of a door_daemon.py to get the presses from, '
+                        'instead of watching the gpio')
+    return parser.parse_args()
+
+
+def _WatchGpio(announcer):
+    # Only needed, and installed, on the Pi with the doorbell.
+    import pigpio
+    import real_hardware
+    debouncer = hardware.Debouncer(1.0)
+
+    def Pressed(gpio, level, tick):
+        if debouncer.Accept():
+            announcer.Send('foo')
+
+    pi = pigpio.pi()
+    pi.set_mode(DOORBELL_GPIO, pigpio.INPUT)
+    pi.set_pull_up_down(DOORBELL_GPIO, pigpio.PUD_UP)
+    pi.set_glitch_filter(DOORBELL_GPIO, real_hardware.DOORBELL_STEADY_US)
+    cb = pi.callback(DOORBELL_GPIO, pigpio.FALLING_EDGE, Pressed)
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    cb.cancel()
+    pi.stop()
+
+
+def _WatchDaemon(announcer, door_socket):
+    def Event(kind, data):
+        # The daemon already debounced the press.
+        if kind == 'doorbell':
+            announcer.Send('foo')
+
+    subscription = door_ipc.Client(os.path.expanduser(door_socket)).Subscribe(Event)
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    subscription.Close()
+
+
+def Main():
+    args = ParseFlags()
+    announcer = send_string.SendString('192.168.1.17', 4002)
+    if args.door_socket:
+        _WatchDaemon(announcer, args.door_socket)
+    else:
+        _WatchGpio(announcer)
+    announcer.Close()
+
+
+if __name__ == '__main__':
+    Main()
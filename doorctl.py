@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Command line client of door_daemon.py.
+#
+# Usage:
+#   doorctl.py status          doors, open locks and swipe counters
+#   doorctl.py unlock [door]   unlocks a door (default: the first one)
+#   doorctl.py watch           prints swipes, whether they were authorized, and
+#                              doorbell presses as they happen
+
+from __future__ import print_function
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+# Local imports.
+import door_daemon
+import door_ipc
+
+
+def ParseFlags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--door_socket', default=door_daemon.DEFAULT_SOCKET, type=str,
+                        help='Socket of the door daemon')
+    parser.add_argument('command', choices=('status', 'unlock', 'watch'))
+    parser.add_argument('door', nargs='?', help='Door to unlock')
+    return parser.parse_args()
+
+
+def Status(client):
+    status = client.GetStatus()
+    for door in status['doors']:
+        print('%-12s %-8s reader %s/%s, lock %s%s' % (
+                door['name'],
+                'open' if door['name'] in status['open'] else 'locked',
+                door['data_low'], door['data_high'], door['lock'],
+                ' (default)' if door['name'] == status['default_door'] else ''))
+    print('swipes: %s' % ', '.join(
+            '%s=%d' % item for item in sorted(status['swipes'].items())))
+
+
+def Watch(client):
+    def Event(kind, data):
+        details = ' '.join('%s=%s' % item for item in sorted(data.items()))
+        print('%s %s %s' % (time.strftime('%Y-%m-%d %H:%M:%S'), kind, details))
+        sys.stdout.flush()
+
+    subscription = client.Subscribe(Event)
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    subscription.Close()
+
+
+def Main():
+    args = ParseFlags()
+    client = door_ipc.Client(os.path.expanduser(args.door_socket))
+    try:
+        if args.command == 'status':
+            Status(client)
+        elif args.command == 'unlock':
+            print('Unlocked %s' % client.Unlock(args.door))
+        else:
+            Watch(client)
+    except door_ipc.IpcError, e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+# Writing files so that they survive a crash or power cut.
+#
+# Replacing a file by writing a temp file and renaming it over the original is
+# atomic, but not durable: without fsync() the rename may reach the disk
+# before the data does, and a power cut then leaves an empty or truncated
+# file behind. That is a real risk on the Pi's SD card.
+#
+# Durability levels, from fastest to safest:
+#
+#   none: write and rename. Atomic while the system stays up.
+#   data: fsync the temp file before renaming it. The file is either the old
+#         or the complete new version, but the rename itself may be lost.
+#   full: also fsync the directory after the rename, so that the new version
+#         is on disk when the write returns.
+
+import gzip
+import os
+
+NONE = 'none'
+DATA = 'data'
+FULL = 'full'
+LEVELS = (NONE, DATA, FULL)
+
+
+def CheckLevel(durability):
+    """Raises ValueError if durability isn't one of LEVELS."""
+    if durability not in LEVELS:
+        raise ValueError('Unknown durability level "%s", must be one of %s' %
+                         (durability, ', '.join(LEVELS)))
+
+
+def FsyncDirectory(path):
+    """Flushes the entries of a directory, e.g. after a rename, to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def Sync(fh, durability):
+    """Flushes an open file, and fsyncs it unless durability is NONE."""
+    fh.flush()
+    if durability != NONE:
+        os.fsync(fh.fileno())
+
+
+def WriteAtomically(path, data, durability=FULL, compress=False):
+    """Replaces the file at path with data.
+
+    The data is written to path + '.tmp' first and then renamed, so readers
+    see either the old or the new version, never a partial one.
+
+    Args:
+        path: str, file to write.
+        data: str, new contents.
+        durability: str, one of LEVELS.
+        compress: bool, if True, gzip data.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        if compress:
+            with gzip.GzipFile(fileobj=fh, mode='wb') as gz:
+                gz.write(data)
+        else:
+            fh.write(data)
+        Sync(fh, durability)
+    os.rename(tmp, path)
+    if durability == FULL:
+        FsyncDirectory(os.path.dirname(os.path.abspath(path)))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local imports.
+import durable_io
+
+
+class TestDurableIo(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'file')
+
+    def tearDown(self):
+        if os.path.isdir(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def testWriteAtomically(self):
+        for durability in durable_io.LEVELS:
+            durable_io.WriteAtomically(self.path, durability, durability)
+            with open(self.path) as fh:
+                self.assertEqual(durability, fh.read())
+        self.assertEqual(['file'], os.listdir(self.temp_dir))
+
+    def testCompress(self):
+        durable_io.WriteAtomically(self.path, 'hello', compress=True)
+        with gzip.open(self.path) as fh:
+            self.assertEqual('hello', fh.read())
+
+    def testCheckLevel(self):
+        self.assertRaises(ValueError, durable_io.CheckLevel, 'sometimes')
+
+
+if __name__ == '__main__':
+    unittest.main()
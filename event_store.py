@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Structured store of access events (swipes, logins, remote unlocks, ...).
+#
+# Events are kept in an SQLite database in WAL mode, with indexes on rfid,
+# user, name, action and timestamp, so that questions like "when did tag X
+# last open the door" don't need a scan of the whole history.
+
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Columns with their own index. Other fields of an event go to 'details'.
+INDEXED_FIELDS = ('action', 'rfid', 'user', 'name')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    action TEXT,
+    rfid TEXT,
+    user TEXT,
+    name TEXT,
+    authorized INTEGER,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_action ON events (action, timestamp);
+CREATE INDEX IF NOT EXISTS events_rfid ON events (rfid, timestamp);
+CREATE INDEX IF NOT EXISTS events_user ON events (user, timestamp);
+CREATE INDEX IF NOT EXISTS events_name ON events (name, timestamp);
+"""
+
+
+class EventStore(object):
+    """Indexed store of access events."""
+
+    def __init__(self, db_file):
+        self._db_file = os.path.expanduser(db_file)
+        # The connection is shared by all threads, one at a time.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_file, check_same_thread=False)
+        self._conn.text_factory = str
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, NORMAL only risks the last transactions on power loss,
+        # never the consistency of the database.
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def _ToRow(timestamp, fields):
+        """Splits event fields into a row of the events table."""
+        details = dict((k, v) for k, v in fields.iteritems()
+                       if v is not None and k not in INDEXED_FIELDS and k != 'authorized')
+        authorized = fields.get('authorized')
+        if authorized is not None:
+            authorized = int(bool(authorized))
+        return (timestamp,
+                fields.get('action'),
+                fields.get('rfid'),
+                fields.get('user'),
+                fields.get('name'),
+                authorized,
+                json.dumps(details) if details else None)
+
+    def Add(self, timestamp=None, **fields):
+        """Stores one event.
+
+        Args:
+            timestamp: float, seconds since the epoch, defaults to now.
+            fields: event fields. action, rfid, user, name and authorized get
+                columns of their own, anything else is kept as JSON.
+        """
+        self.AddMany([(timestamp or time.time(), fields)])
+
+    def AddMany(self, events):
+        """Stores (timestamp, fields) tuples in a single transaction."""
+        rows = [self._ToRow(timestamp, fields) for timestamp, fields in events]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                        'INSERT INTO events (timestamp, action, rfid, user, name, '
+                        'authorized, details) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def Query(self, rfid=None, user=None, action=None, since=None, until=None,
+              before=None, limit=50):
+        """Returns matching events, newest first.
+
+        Args:
+            rfid: str, only events for this tag.
+            user: str, only events where this is the username or the name of
+                the tag's owner.
+            action: str, only events with this action.
+            since: float, only events at or after this time.
+            until: float, only events before this time.
+            before: int, id of the last event of the previous page; only
+                events after it in this order are returned. Ids needn't
+                follow timestamps, e.g. if the clock was stepped back.
+            limit: int, max number of events to return.
+
+        Returns:
+            List of dicts with id, timestamp and the event's fields.
+        """
+        where = []
+        args = []
+        if rfid:
+            where.append('rfid = ?')
+            args.append(rfid)
+        if user:
+            where.append('(user = ? OR name = ?)')
+            args.extend([user, user])
+        if action:
+            where.append('action = ?')
+            args.append(action)
+        if since is not None:
+            where.append('timestamp >= ?')
+            args.append(since)
+        if until is not None:
+            where.append('timestamp < ?')
+            args.append(until)
+        if before is not None:
+            # Continue after the (timestamp, id) of the cursor, so that pages
+            # follow the sort order. The first condition uses the indexes.
+            with self._lock:
+                row = self._conn.execute(
+                        'SELECT timestamp FROM events WHERE id = ?', (before,)).fetchone()
+            if row is None:
+                where.append('id < ?')
+                args.append(before)
+            else:
+                where.append('timestamp <= ? AND (timestamp < ? OR id < ?)')
+                args.extend([row[0], row[0], before])
+        sql = 'SELECT * FROM events'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        args.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        events = []
+        for row in rows:
+            event = dict((k, row[k]) for k in row.keys() if k != 'details'
+                         and row[k] is not None)
+            if 'authorized' in event:
+                event['authorized'] = bool(event['authorized'])
+            if row['details']:
+                event.update(json.loads(row['details']))
+            events.append(event)
+        return events
+
+    def Close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == '__main__':
+    # Hacky little test.
+    store = EventStore('/tmp/events.db')
+    store.Add(action='swipe', rfid='abcd', authorized=True, name='jimmy')
+    print(store.Query(rfid='abcd', limit=5))
+    store.Close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Benchmark for queries against a big event store.
+#
+# Usage: event_store_benchmark.py [number of events]
+
+from __future__ import print_function
+
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Local imports.
+import event_store
+
+
+def Main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    temp_dir = tempfile.mkdtemp()
+    try:
+        store = event_store.EventStore(temp_dir + '/events.db')
+        rand = random.Random(42)
+        start_time = time.time() - 365 * 24 * 3600
+        start = time.time()
+        batch = []
+        for i in xrange(count):
+            timestamp = start_time + i * (365 * 24 * 3600.0 / count)
+            if rand.random() < 0.02:
+                fields = {'action': 'remote_unlock', 'user': 'user%d' % rand.randint(0, 50),
+                          'unlock': True}
+            else:
+                tag = rand.randint(0, 2000)
+                fields = {'action': 'swipe', 'rfid': '%08x' % tag,
+                          'name': 'user %d' % tag, 'authorized': True}
+            batch.append((timestamp, fields))
+            if len(batch) == 10000:
+                store.AddMany(batch)
+                batch = []
+        store.AddMany(batch)
+        print('Inserted %d events in %.1fs' % (count, time.time() - start))
+
+        month = 30 * 24 * 3600
+        queries = [
+            ('last swipe of a tag', dict(rfid='%08x' % 1234, limit=1)),
+            ('tag history page', dict(rfid='%08x' % 1234, limit=50)),
+            ('remote unlocks last month', dict(action='remote_unlock',
+                                               since=time.time() - month, limit=1000)),
+            ('events of a user', dict(user='user 42', limit=50)),
+            ('time range page', dict(since=start_time + month, until=start_time + 2 * month,
+                                     limit=50)),
+        ]
+        print('%-30s %10s %10s' % ('query', 'results', 'ms'))
+        for name, kwargs in queries:
+            start = time.time()
+            for _ in xrange(10):
+                results = store.Query(**kwargs)
+            print('%-30s %10d %10.2f' % (name, len(results), (time.time() - start) * 100))
+        store.Close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    Main()
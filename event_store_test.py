@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local imports.
+import event_store
+
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = event_store.EventStore(os.path.join(self.temp_dir, 'events.db'))
+
+    def tearDown(self):
+        self.store.Close()
+        if os.path.isdir(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def testQuery(self):
+        self.store.Add(100, action='swipe', rfid='abcd', authorized=True, name='johnny')
+        self.store.Add(200, action='swipe', rfid='1111', authorized=False, name=None)
+        self.store.Add(300, action='login', user='johnny', authorized=True)
+        self.store.Add(400, action='remote_unlock', user='bob', unlock=True)
+        self.store.Add(500, action='swipe', rfid='abcd', authorized=True, name='johnny')
+
+        def _Times(**kwargs):
+            return [e['timestamp'] for e in self.store.Query(**kwargs)]
+
+        self.assertEqual([500, 400, 300, 200, 100], _Times())
+        self.assertEqual([500, 100], _Times(rfid='abcd'))
+        self.assertEqual([500, 300, 100], _Times(user='johnny'))
+        self.assertEqual([400], _Times(action='remote_unlock'))
+        self.assertEqual([400, 300, 200], _Times(since=200, until=500))
+        self.assertEqual([200], _Times(action='swipe', since=150, until=400))
+
+        event = self.store.Query(action='remote_unlock')[0]
+        self.assertEqual('bob', event['user'])
+        self.assertEqual(True, event['unlock'])
+        self.assertNotIn('rfid', event)
+        self.assertEqual(False, self.store.Query(rfid='1111')[0]['authorized'])
+
+    def testPagination(self):
+        self.store.AddMany([(i, {'action': 'swipe', 'rfid': 'abcd'}) for i in xrange(25)])
+        seen = []
+        before = None
+        while True:
+            page = self.store.Query(rfid='abcd', before=before, limit=10)
+            seen.extend(e['timestamp'] for e in page)
+            if len(page) < 10:
+                break
+            before = page[-1]['id']
+        self.assertEqual(range(24, -1, -1), seen)
+
+    def testPaginationWithClockStep(self):
+        # The clock was stepped back, so ids and timestamps disagree.
+        self.store.AddMany([(t, {'action': 'swipe', 'count': i}) for i, t in
+                            enumerate([10, 20, 30, 15, 25, 25, 35, 5])])
+        seen = []
+        before = None
+        while True:
+            page = self.store.Query(before=before, limit=3)
+            seen.extend(e['count'] for e in page)
+            if len(page) < 3:
+                break
+            before = page[-1]['id']
+        self.assertEqual([6, 2, 5, 4, 1, 3, 0, 7], seen)
+
+
+if __name__ == '__main__':
+    unittest.main()
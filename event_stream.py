@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Fans out live events (new log lines, unknown tags) to any number of
+# subscribers, e.g. Server-Sent Events connections of the dashboard.
+
+import collections
+import threading
+
+# Number of recent events kept for subscribers that fall behind.
+SIZE = 100
+
+
+class EventStream(object):
+    """Publishes numbered events to waiting subscribers.
+
+    Recent events are kept in a ring buffer, numbered in order. Subscribers
+    don't get a queue of their own: they remember the number of the last event
+    they saw and wait on a shared condition. An idle subscriber thus costs a
+    blocked thread and no memory. A heartbeat thread wakes all subscribers
+    every heartbeat seconds, so that they can notice closed connections.
+    """
+
+    def __init__(self, size=SIZE, heartbeat=15):
+        self._cond = threading.Condition()
+        # (number, kind, data) tuples.
+        self._events = collections.deque(maxlen=size)
+        # Number of the last published event.
+        self._last = 0
+        # Incremented on every heartbeat.
+        self._beats = 0
+        self._heartbeat = heartbeat
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._Beat, name='event-stream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Publish(self, kind, data):
+        """Publishes an event of the given kind, e.g. 'log' or 'rfid'."""
+        with self._cond:
+            self._last += 1
+            self._events.append((self._last, kind, data))
+            self._cond.notify_all()
+
+    def GetLast(self):
+        """Returns the number of the last published event."""
+        with self._cond:
+            return self._last
+
+    def Get(self, last):
+        """Returns the events after number last, without waiting.
+
+        Returns:
+          List of (number, kind, data) tuples, see Wait().
+        """
+        with self._cond:
+            return [event for event in self._events if event[0] > last]
+
+    def Wait(self, last):
+        """Waits for events after number last.
+
+        Returns:
+          List of (number, kind, data) tuples. Empty if the heartbeat woke
+          us up first. If the subscriber fell behind by more than the ring
+          buffer holds, the oldest events are missing.
+        """
+        with self._cond:
+            beats = self._beats
+            while self._last <= last and self._beats == beats:
+                self._cond.wait()
+            return [event for event in self._events if event[0] > last]
+
+    def Close(self):
+        """Stops the heartbeat thread and wakes everyone up."""
+        self._stop.set()
+        self._thread.join()
+
+    def _Beat(self):
+        while True:
+            self._stop.wait(self._heartbeat)
+            with self._cond:
+                self._beats += 1
+                self._cond.notify_all()
+            if self._stop.is_set():
+                return
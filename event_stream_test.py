@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+# Local imports.
+import event_stream
+
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = event_stream.EventStream(size=5, heartbeat=0.2)
+
+    def tearDown(self):
+        self.stream.Close()
+
+    def testPublishAndResume(self):
+        self.assertEqual(0, self.stream.GetLast())
+        self.stream.Publish('log', 'one')
+        self.stream.Publish('rfid', 'abcd')
+        self.assertEqual([(1, 'log', 'one'), (2, 'rfid', 'abcd')], self.stream.Wait(0))
+        self.assertEqual([(2, 'rfid', 'abcd')], self.stream.Wait(1))
+
+        # Fell behind: only the newest events are kept.
+        for i in xrange(10):
+            self.stream.Publish('log', i)
+        self.assertEqual([8, 9, 10, 11, 12], [n for n, _, _ in self.stream.Wait(2)])
+        # Polling doesn't wait for new events.
+        self.assertEqual([(12, 'log', 9)], self.stream.Get(11))
+        self.assertEqual([], self.stream.Get(12))
+
+    def testSubscribersWakeUp(self):
+        results = []
+
+        def _Subscriber():
+            results.append(self.stream.Wait(0))
+
+        threads = [threading.Thread(target=_Subscriber) for _ in xrange(50)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.stream.Publish('log', 'hello')
+        for thread in threads:
+            thread.join()
+        self.assertEqual([[(1, 'log', 'hello')]] * 50, results)
+
+    def testHeartbeat(self):
+        start = time.time()
+        self.assertEqual([], self.stream.Wait(0))
+        self.assertLess(time.time() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+# Stand-in for the pigpio module, to run the reader code off the Pi.
+#
+# pi() records what is written to its outputs, and feeds the decoder the
+# same way the pigpio daemon does: notifications are FIFOs in a temporary
+# directory, and Replay() writes 12 byte level reports into them. Edge traces
+# are lists of (tick, gpio, level) tuples, tick being in microseconds. They
+# can be synthetic (see FrameEdges() and Glitch()), or recorded on the Pi
+# with the pigpio tools, as a raw dump of a notification pipe:
+#
+#   h=$(pigs no); pigs nb $h 0x60000; cat /dev/pigpio$h > trace.bin
+#
+# which pi.ReplayReports() replays as it is.
+#
+# Usage:
+#
+#   restore = fake_pigpio.Install()
+#   hw = real_hardware.RealHardware(...)  # Uses fake_pigpio.
+#   hw.Initialize()
+#   hw.pi.Replay(fake_pigpio.FrameEdges(17, 18, 26, value, 0)[0])
+#   ...
+#   restore()
+
+import atexit
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+INPUT = 0
+OUTPUT = 1
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+TIMEOUT = 2
+
+# Directory holding the notification FIFOs, and their path.
+_PIPE_DIR = tempfile.mkdtemp(prefix='fake_pigpio')
+NOTIFY_PIPE = os.path.join(_PIPE_DIR, 'pigpio%d')
+
+_REPORT = struct.Struct('HHII')
+
+# Next notification handle, unique across all pi() instances.
+_next_handle = [0]
+
+
+def Install():
+    """Makes 'import pigpio' and wiegand_decoder use this module.
+
+    Returns:
+        function, restoring the previous state.
+    """
+    import wiegand_decoder
+    saved = (sys.modules.get('pigpio'), wiegand_decoder.NOTIFY_PIPE)
+    sys.modules['pigpio'] = sys.modules[__name__]
+    wiegand_decoder.NOTIFY_PIPE = NOTIFY_PIPE
+
+    def Restore():
+        if saved[0] is None:
+            del sys.modules['pigpio']
+        else:
+            sys.modules['pigpio'] = saved[0]
+        wiegand_decoder.NOTIFY_PIPE = saved[1]
+    return Restore
+
+
+def FrameEdges(gpio_0, gpio_1, bits, value, tick, period=2000, width=50):
+    """Returns the edges of a Wiegand frame.
+
+    Args:
+        gpio_0: int, gpio of the data 0 line.
+        gpio_1: int, gpio of the data 1 line.
+        bits: int, frame length.
+        value: int, frame, most significant bit first.
+        tick: int, tick of the first edge.
+        period: int, microseconds from one bit to the next.
+        width: int, microseconds a line is pulled low for a bit.
+
+    Returns:
+        (edges, tick), tick being when the last bit is over.
+    """
+    edges = []
+    for i in reversed(xrange(bits)):
+        gpio = gpio_1 if value >> i & 1 else gpio_0
+        edges.append((tick, gpio, 0))
+        edges.append((tick + width, gpio, 1))
+        tick += period
+    return edges, tick
+
+
+def Glitch(gpios, tick, width):
+    """Returns the edges of a spike pulling gpios low for width microseconds."""
+    return ([(tick, gpio, 0) for gpio in gpios] +
+            [(tick + width, gpio, 1) for gpio in gpios])
+
+
+def _Transitions(edges):
+    """Returns the level changes of edges.
+
+    Edges come from open collector drivers: a line is low while any of them
+    pulls it low, so overlapping pulses merge.
+    """
+    pulling = {}
+    transitions = []
+    for tick, gpio, level in sorted(edges):
+        count = pulling.get(gpio, 0)
+        pulling[gpio] = count + 1 if level == 0 else max(0, count - 1)
+        if (count == 0) != (pulling[gpio] == 0):
+            transitions.append((tick, gpio, 0 if pulling[gpio] else 1))
+    return transitions
+
+
+def _Filter(transitions, steady):
+    """Drops pulses shorter than their gpio's steady microseconds, like
+    pigpio's glitch filter does."""
+    by_gpio = {}
+    for transition in transitions:
+        by_gpio.setdefault(transition[1], []).append(transition)
+    kept = []
+    for gpio, gpio_transitions in by_gpio.iteritems():
+        i = 0
+        while i < len(gpio_transitions):
+            if (i + 1 < len(gpio_transitions) and
+                    gpio_transitions[i + 1][0] - gpio_transitions[i][0] < steady.get(gpio, 0)):
+                i += 2
+                continue
+            kept.append(gpio_transitions[i])
+            i += 1
+    kept.sort()
+    return kept
+
+
+class _Callback(object):
+
+    def __init__(self, pi, gpio, edge, func):
+        self._pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+        self._pi._callbacks.remove(self)
+
+
+class _Notification(object):
+
+    def __init__(self, handle):
+        self.path = NOTIFY_PIPE % handle
+        os.mkfifo(self.path)
+        # Opened for reading too, so opening it doesn't wait for the reader,
+        # and the reader sees end of file once we close it.
+        self.fd = os.open(self.path, os.O_RDWR)
+        self.mask = 0
+        self.seqno = 0
+
+    def Close(self):
+        os.close(self.fd)
+        os.unlink(self.path)
+
+
+class pi(object):
+    """Fake connection to the pigpio daemon."""
+
+    def __init__(self, host='localhost', port=8888):
+        self.connected = True
+        self._lock = threading.Lock()
+        # Maps gpios to modes, pulls and glitch filters.
+        self.modes = {}
+        self.pulls = {}
+        self.glitch_filters = {}
+        # List of (time, gpio, level) tuples, one per write().
+        self.writes = []
+        # Levels of all gpios, as in notification reports.
+        self._levels = 0
+        # Maps handles to _Notification.
+        self._notifications = {}
+        # List of _Callback.
+        self._callbacks = []
+
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+
+    def set_pull_up_down(self, gpio, pud):
+        self.pulls[gpio] = pud
+        if pud == PUD_UP:
+            self._levels |= 1 << gpio
+        else:
+            self._levels &= ~(1 << gpio)
+
+    def set_glitch_filter(self, gpio, steady):
+        self.glitch_filters[gpio] = steady
+
+    def set_watchdog(self, gpio, timeout):
+        pass
+
+    def write(self, gpio, level):
+        with self._lock:
+            self.writes.append((time.time(), gpio, int(bool(level))))
+            self._levels = (self._levels & ~(1 << gpio)) | (int(bool(level)) << gpio)
+
+    def read(self, gpio):
+        return self._levels >> gpio & 1
+
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+        cb = _Callback(self, user_gpio, edge, func)
+        self._callbacks.append(cb)
+        return cb
+
+    def notify_open(self):
+        with self._lock:
+            handle = _next_handle[0]
+            _next_handle[0] += 1
+            self._notifications[handle] = _Notification(handle)
+        return handle
+
+    def notify_begin(self, handle, bits):
+        self._notifications[handle].mask = bits
+
+    def notify_pause(self, handle):
+        self._notifications[handle].mask = 0
+
+    def notify_close(self, handle):
+        with self._lock:
+            self._notifications.pop(handle).Close()
+
+    def stop(self):
+        with self._lock:
+            for notification in self._notifications.itervalues():
+                notification.Close()
+            self._notifications.clear()
+        self.connected = False
+
+    def Replay(self, edges, realtime=False, start=None):
+        """Feeds edges to the notifications and callbacks, through the
+        glitch filters. Callbacks are called from the calling thread.
+
+        Args:
+            edges: list of (tick, gpio, level) tuples. Level 0 pulls the line
+                low, level 1 lets go of it.
+            realtime: bool, whether to pace the reports by their ticks,
+                instead of writing them all at once.
+            start: float, time.time() at which the first tick is due, when
+                realtime. Defaults to now.
+
+        Returns:
+            List of (tick, time.time() at which it was written), one per
+            report, i.e. per edge that made it through the glitch filter.
+        """
+        edges = _Filter(_Transitions(edges), self.glitch_filters)
+        # Changes at the same tick are sampled together, into one report.
+        reports = []
+        for tick, gpio, level in edges:
+            levels = (self._levels & ~(1 << gpio)) | (level << gpio)
+            if levels == self._levels:
+                continue
+            self._levels = levels
+            tick &= 0xffffffff
+            if reports and reports[-1][0] == tick:
+                reports[-1] = (tick, reports[-1][1] | 1 << gpio, levels)
+            else:
+                reports.append((tick, 1 << gpio, levels))
+        if not reports:
+            return []
+        start = start or time.time()
+        first_tick = reports[0][0]
+        written = []
+        for tick, changed, levels in reports:
+            if realtime:
+                delay = start + ((tick - first_tick) & 0xffffffff) / 1e6 - time.time()
+                if delay > 0.0005:
+                    time.sleep(delay)
+            self._Send(changed, tick, levels)
+            self._CallBack(changed, tick, levels)
+            written.append((tick, time.time()))
+        return written
+
+    def _CallBack(self, changed, tick, levels):
+        for cb in list(self._callbacks):
+            if not changed & (1 << cb.gpio):
+                continue
+            level = levels >> cb.gpio & 1
+            if cb.edge == EITHER_EDGE or cb.edge == (RISING_EDGE if level else FALLING_EDGE):
+                cb.func(cb.gpio, level, tick)
+
+    def ReplayReports(self, data):
+        """Writes a raw dump of a notification pipe to the notifications."""
+        with self._lock:
+            for notification in self._notifications.values():
+                os.write(notification.fd, data)
+
+    def _Send(self, changed, tick, levels):
+        with self._lock:
+            for notification in self._notifications.itervalues():
+                if notification.mask & changed:
+                    os.write(notification.fd, _REPORT.pack(
+                            notification.seqno, 0, tick, levels))
+                    notification.seqno = (notification.seqno + 1) & 0xffff
+
+
+def _Cleanup():
+    shutil.rmtree(_PIPE_DIR, ignore_errors=True)
+
+
+atexit.register(_Cleanup)
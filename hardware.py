@@ -1,16 +1,223 @@
 # Abstraction layer for interacting with hardware.
 
+import functools
+import Queue
+import threading
+import time
+
+# Local imports.
+import door_config
+import swipe_filter
+
+
+class DoorScheduler(object):
+    """Drives the locks of any number of doors from one worker thread.
+
+    Callers post commands to a queue and return immediately. The worker opens
+    locks, keeps them open until their deadlines and relocks them, waking up
+    for whichever deadline comes first. Opening and closing a lock is a quick
+    GPIO write, so a door held open never holds up another one.
+    """
+
+    _STOP = 'stop'
+
+    def __init__(self):
+        self._commands = Queue.Queue()
+        self._thread = None
+        # DoorActuator of each door.
+        self._actuators = []
+
+    def AddDoor(self, open_lock, close_lock, open_time):
+        """Adds a door. See DoorActuator.
+
+        Returns:
+          DoorActuator for the door.
+        """
+        return DoorActuator(open_lock, close_lock, open_time, scheduler=self)
+
+    def Start(self):
+        """Starts the worker thread."""
+        self._thread = threading.Thread(target=self._Run, name='door-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Stop(self):
+        """Relocks all doors and stops the worker thread."""
+        if self._thread is None:
+            return
+        self._commands.put((None, self._STOP, None))
+        self._thread.join()
+        self._thread = None
+
+    def _Post(self, actuator, command, arg):
+        self._commands.put((actuator, command, arg))
+
+    def _Run(self):
+        while True:
+            # Relock doors whose open window is over.
+            now = time.time()
+            timeout = None
+            for actuator in self._actuators:
+                if actuator._deadline is None:
+                    continue
+                if actuator._deadline <= now:
+                    actuator._Close()
+                elif timeout is None or actuator._deadline - now < timeout:
+                    timeout = actuator._deadline - now
+            try:
+                actuator, command, arg = self._commands.get(timeout=timeout)
+            except Queue.Empty:
+                continue
+            if command == self._STOP:
+                for actuator in self._actuators:
+                    actuator._Close()
+                return
+            actuator._Handle(command, arg)
+
+
+class DoorActuator(object):
+    """Drives a door lock from the worker thread of a DoorScheduler.
+
+    Callers post commands and return immediately. Unlocking a door that is
+    already open extends the deadline instead of stacking up sleeps.
+    """
+
+    UNLOCK = 'unlock'
+    HOLD = 'hold'
+    RELOCK = 'relock'
+
+    def __init__(self, open_lock, close_lock, open_time, scheduler=None):
+        """Constructor.
+
+        Args:
+          open_lock: function, called without arguments to open the lock.
+          close_lock: function, called without arguments to close the lock.
+          open_time: float, default time in seconds to keep the lock open.
+          scheduler: DoorScheduler to run on. Defaults to one of its own.
+        """
+        self._open_lock = open_lock
+        self._close_lock = close_lock
+        self._open_time = open_time
+        self._scheduler = scheduler or DoorScheduler()
+        self._scheduler._actuators.append(self)
+        # Whether the lock is currently open. Only written by the worker.
+        self.is_open = False
+        # time.time() at which to relock, or None if closed or held open.
+        self._deadline = None
+
+    def Start(self):
+        """Starts the scheduler's worker thread."""
+        self._scheduler.Start()
+
+    def Stop(self):
+        """Relocks the doors of the scheduler and stops its worker thread."""
+        self._scheduler.Stop()
+
+    def Unlock(self, open_time=None):
+        """Opens the lock for open_time seconds (or the default)."""
+        if open_time is None:
+            open_time = self._open_time
+        self._scheduler._Post(self, self.UNLOCK, open_time)
+
+    def Hold(self):
+        """Opens the lock until Relock() is called."""
+        self._scheduler._Post(self, self.HOLD, None)
+
+    def Relock(self):
+        """Closes the lock right away."""
+        self._scheduler._Post(self, self.RELOCK, None)
+
+    def _Open(self):
+        if not self.is_open:
+            self._open_lock()
+            self.is_open = True
+
+    def _Close(self):
+        self._deadline = None
+        if self.is_open:
+            self._close_lock()
+            self.is_open = False
+
+    def _Handle(self, command, arg):
+        """Carries out a command. Called from the worker thread."""
+        if command == self.UNLOCK:
+            deadline = time.time() + arg
+            if not self.is_open:
+                self._Open()
+                self._deadline = deadline
+            elif self._deadline is not None:
+                # Coalesce with the current open window.
+                self._deadline = max(self._deadline, deadline)
+            # Otherwise the door is held open; leave it that way.
+        elif command == self.HOLD:
+            self._Open()
+            self._deadline = None
+        elif command == self.RELOCK:
+            self._Close()
+
+
+class Debouncer(object):
+    """Passes on at most one event per interval.
+
+    Events within interval seconds of the last one passed on are dropped, so
+    a button pressed several times in a row only counts once.
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._lock = threading.Lock()
+        # time.time() of the last event passed on.
+        self._last = None
+
+    def Accept(self, now=None):
+        """Returns whether an event happening now should be passed on."""
+        now = now or time.time()
+        with self._lock:
+            if self._last is not None and 0 <= now - self._last < self._interval:
+                return False
+            self._last = now
+            return True
+
+
 class Hardware(object):
     """Interface for the hardware abstraction.
 
-    Extend and implement the methods.
+    Extend and implement the methods. There is a reader, a lock and possibly
+    a doorbell per door, see door_config.
     """
 
-    def __init__(self, open_time, pin_config):
+    def __init__(self, open_time, pin_config, swipe_window=1.0,
+                 wiegand_lengths=None, doorbell_debounce=1.0):
         # Handler to call when a tag is seen.
         self.tag_seen_handler = None
+        # Handler to call when the doorbell is pressed.
+        self.doorbell_handler = None
         self.open_time = open_time
         self.pin_config = pin_config
+        # door_config.Door of each door, in the order of the configuration.
+        self.doors = door_config.Read(pin_config)
+        # Name of the door to use when none is given.
+        self.default_door = self.doors[0].name
+        # Lock actuation happens on its own thread, so UnlockDoor() never
+        # blocks the caller (e.g. the tag decoder). One thread serves all
+        # doors.
+        self.scheduler = DoorScheduler()
+        # Maps door names to their DoorActuator.
+        self.actuators = {}
+        # Maps door names to the Debouncer of their doorbell.
+        self._doorbells = {}
+        for door in self.doors:
+            self.actuators[door.name] = self.scheduler.AddDoor(
+                    functools.partial(self._OpenLock, door),
+                    functools.partial(self._CloseLock, door),
+                    door.open_time if door.open_time is not None else open_time)
+            self._doorbells[door.name] = Debouncer(doorbell_debounce)
+        # The default door's actuator.
+        self.actuator = self.actuators[self.default_door]
+        # Reads go through here before they reach tag_seen_handler. Each door
+        # is a reader of its own.
+        self.swipes = swipe_filter.SwipeFilter(
+                self._ForwardTag, window=swipe_window, lengths=wiegand_lengths)
 
     def Initialize(self):
         """Initializes the hardware."""
@@ -19,24 +226,85 @@ class Hardware(object):
     def SetTagSeenHandler(self, handler):
         """Sets up handler for when RFID event is seen.
 
+        Repeated reads of a card and malformed frames are filtered out before
+        the handler is called, see swipe_filter. The handler is called from
+        the reader's own thread.
+
         Args:
           handler: function, called with one string argument - RFID tag serial number.
+            The name of the door is passed as the door keyword argument.
+            Reads of known Wiegand formats also pass facility and card (int)
+            keyword arguments.
         """
         self.tag_seen_handler = handler
 
+    def _TagRead(self, door, bits, value):
+        """Passes a frame read at door (name) on to the swipe filter."""
+        self.swipes.ReadFrame(bits, value, reader=door, door=door)
+
+    def GetSwipeStats(self):
+        """Returns the counters of the swipe filter, as a dict."""
+        return self.swipes.GetStats()
+
+    def _ForwardTag(self, rfid, **details):
+        if self.tag_seen_handler is not None:
+            self.tag_seen_handler(rfid, **details)
+
+    def SetDoorbellHandler(self, handler):
+        """Sets up handler for when a doorbell is pressed.
+
+        Presses within doorbell_debounce seconds of the last one are ignored.
+        The handler is called from the thread watching the button, and
+        shouldn't block.
+
+        Args:
+          handler: function, called with the name of the door.
+        """
+        self.doorbell_handler = handler
+
+    def _DoorbellPressed(self, door=None, now=None):
+        """Passes a press on to doorbell_handler, unless it is a bounce.
+
+        Returns:
+          bool, whether the press was passed on.
+        """
+        door = door or self.default_door
+        if not self._doorbells[door].Accept(now):
+            return False
+        if self.doorbell_handler is not None:
+            self.doorbell_handler(door)
+        return True
+
     def ShutDown(self):
         """Cleans up, closes open devices."""
         raise NotImplementedError('subclass and implement me!')
 
-    def UnlockDoor(self):
-        """Unlocks the door."""
+    def UnlockDoor(self, door=None):
+        """Unlocks a door for its open time.
+
+        Returns immediately; the door is relocked by the scheduler thread.
+
+        Args:
+          door: str, name of the door. Defaults to default_door.
+
+        Raises:
+          KeyError: if there is no such door.
+        """
+        self.actuators[door or self.default_door].Unlock()
+
+    def _OpenLock(self, door):
+        """Energizes the lock of a door_config.Door. Called from the scheduler thread."""
+        raise NotImplementedError('subclass and implement me!')
+
+    def _CloseLock(self, door):
+        """Releases the lock of a door_config.Door. Called from the scheduler thread."""
         raise NotImplementedError('subclass and implement me!')
 
 
-def Instantiate(use_mock, open_time, pin_config):
+def Instantiate(use_mock, open_time, pin_config, **kwargs):
     if use_mock:
         import mock_hardware
-        return mock_hardware.MockHardware(open_time, pin_config)
+        return mock_hardware.MockHardware(open_time, pin_config, **kwargs)
     else:
         import real_hardware
-        return real_hardware.RealHardware(open_time, pin_config)
+        return real_hardware.RealHardware(open_time, pin_config, **kwargs)
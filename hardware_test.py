@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Local imports.
+import mock_hardware
+
+
+class TestDoorActuator(unittest.TestCase):
+
+    def setUp(self):
+        self.hw = mock_hardware.MockHardware(0.2, None)
+        self.hw.Initialize()
+
+    def tearDown(self):
+        self.hw.ShutDown()
+
+    def _WaitForEvents(self, count, timeout=2):
+        deadline = time.time() + timeout
+        while len(self.hw.lock_events) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return self.hw.lock_events
+
+    def testUnlockRelocks(self):
+        start = time.time()
+        self.hw.UnlockDoor()
+        events = self._WaitForEvents(2)
+        self.assertEqual([False, True], [locked for _, locked in events])
+        self.assertGreaterEqual(events[1][0] - start, 0.19)
+
+    def testRepeatedUnlocksCoalesce(self):
+        start = time.time()
+        self.hw.UnlockDoor()
+        time.sleep(0.1)
+        self.hw.UnlockDoor()
+        events = self._WaitForEvents(2)
+        time.sleep(0.1)
+        # Only one open/close cycle, extended by the second unlock.
+        self.assertEqual([False, True], [locked for _, locked in events])
+        self.assertGreaterEqual(events[1][0] - start, 0.29)
+
+    def testHoldAndRelock(self):
+        self.hw.actuator.Hold()
+        self.hw.UnlockDoor()
+        time.sleep(0.4)
+        self.assertEqual([False], [locked for _, locked in self.hw.lock_events])
+        self.hw.actuator.Relock()
+        events = self._WaitForEvents(2)
+        self.assertEqual([False, True], [locked for _, locked in events])
+
+    def testShutDownRelocks(self):
+        self.hw.actuator.Hold()
+        self._WaitForEvents(1)
+        self.hw.actuator.Stop()
+        self.assertEqual([False, True], [locked for _, locked in self.hw.lock_events])
+
+    def testSwipeLatency(self):
+        self.hw.SetTagSeenHandler(lambda rfid, door: self.hw.UnlockDoor(door))
+        latencies = sorted(self.hw.ScanTag('abcd') for _ in xrange(100))
+        # The handler must not wait for the door to relock.
+        self.assertLess(latencies[-1], 0.05)
+        self._WaitForEvents(2)
+        self.assertFalse(self.hw.actuator.is_open)
+
+
+class TestDoors(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        pin_config = os.path.join(self.temp_dir, 'pins.cfg')
+        with open(pin_config, 'w') as fh:
+            fh.write('[door:front]\ndata_low = 17\ndata_high = 18\nlock = 23\n'
+                     '[door:back]\ndata_low = 5\ndata_high = 6\nlock = 13\n'
+                     'open_time = 0.1\n')
+        self.hw = mock_hardware.MockHardware(0.3, pin_config)
+        self.hw.Initialize()
+
+    def tearDown(self):
+        self.hw.ShutDown()
+        shutil.rmtree(self.temp_dir)
+
+    def _WaitForEvents(self, door, count, timeout=2):
+        events = self.hw.door_events[door]
+        deadline = time.time() + timeout
+        while len(events) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return events
+
+    def testIndependentDoors(self):
+        swipes = []
+        self.hw.SetTagSeenHandler(lambda rfid, door: swipes.append((rfid, door)))
+        start = time.time()
+        self.hw.actuators['front'].Hold()
+        self.hw.ScanTag('abcd', door='back')
+        self.hw.ScanTag('abcd', door='front')
+        self.assertEqual([('abcd', 'back'), ('abcd', 'front')], swipes)
+        self.hw.UnlockDoor('back')
+        # The back door relocks after its own open time, while the front
+        # door is held open.
+        events = self._WaitForEvents('back', 2)
+        self.assertEqual([False, True], [locked for _, locked in events])
+        self.assertLess(events[1][0] - start, 0.25)
+        self.assertEqual([False], [locked for _, locked in self.hw.door_events['front']])
+        self.assertRaises(KeyError, self.hw.UnlockDoor, 'side')
+
+
+class TestDoorbell(unittest.TestCase):
+
+    def setUp(self):
+        self.hw = mock_hardware.MockHardware(0.2, None, doorbell_debounce=1.0)
+        self.presses = []
+        self.hw.SetDoorbellHandler(self.presses.append)
+
+    def testDebounce(self):
+        self.assertTrue(self.hw.PressDoorbell())
+        self.assertFalse(self.hw.PressDoorbell())
+        self.assertTrue(self.hw._DoorbellPressed(now=time.time() + 1.5))
+        self.assertEqual(2, len(self.presses))
+
+    def testDebouncer(self):
+        debouncer = mock_hardware.hardware.Debouncer(1.0)
+        self.assertTrue(debouncer.Accept(100))
+        self.assertFalse(debouncer.Accept(100.9))
+        self.assertTrue(debouncer.Accept(101.0))
+        # A clock going backwards doesn't block presses.
+        self.assertTrue(debouncer.Accept(50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Load test of the web interface: requests/s and latency of / and /login,
+# with several clients at once. Run it against --serve=dev and
+# --serve=production to compare them, e.g.:
+#
+#   ./RFIDLovePotion.py --mock --serve=production &
+#   ./load_test.py --url=http://127.0.0.1:8000 --user=bob --password=secret
+#
+# Without --user, / only redirects to /login, which measures the routing
+# alone. With it, each client logs in first, and / renders the dashboard.
+# --streams keeps that many dashboards' live update streams (/events) open
+# during the test, as open browser tabs do.
+
+from __future__ import print_function
+
+import argparse
+import cookielib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+
+
+def ParseFlags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000', type=str,
+                        help='Base URL of the web interface')
+    parser.add_argument('--user', type=str, help='Web user to log in as')
+    parser.add_argument('--password', default='', type=str,
+                        help='Password of --user')
+    parser.add_argument('--clients', default=16, type=int,
+                        help='Number of clients sending requests at once')
+    parser.add_argument('--duration', default=10.0, type=float,
+                        help='Seconds to load each page for')
+    parser.add_argument('--streams', default=0, type=int,
+                        help='Number of /events streams to keep open, needs --user')
+    parser.add_argument('--timeout', default=10.0, type=float,
+                        help='Seconds after which a request counts as failed')
+    return parser.parse_args()
+
+
+def _Percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+class _Client(threading.Thread):
+
+    def __init__(self, args, path, data):
+        super(_Client, self).__init__()
+        self.daemon = True
+        self._args = args
+        self._path = path
+        self._data = data
+        # Time to stop at, set once all clients are logged in.
+        self.deadline = None
+        # Seconds each request took.
+        self.latencies = []
+        self.errors = 0
+        self._opener = urllib2.build_opener(
+                urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+        if args.user:
+            try:
+                self._Fetch('/login', urllib.urlencode(
+                        dict(user=args.user, password=args.password)))
+            except (urllib2.URLError, IOError):
+                self.errors += 1
+
+    def _Fetch(self, path, data=None):
+        response = self._opener.open(self._args.url + path, data, self._args.timeout)
+        response.read()
+        response.close()
+
+    def run(self):
+        while time.time() < self.deadline:
+            start = time.time()
+            try:
+                self._Fetch(self._path, self._data)
+            except (urllib2.URLError, IOError):
+                self.errors += 1
+                continue
+            self.latencies.append(time.time() - start)
+
+
+class _Stream(threading.Thread):
+    """A dashboard's /events stream, kept open and read until the end."""
+
+    def __init__(self, args):
+        super(_Stream, self).__init__()
+        self.daemon = True
+        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+        opener.open(args.url + '/login', urllib.urlencode(
+                dict(user=args.user, password=args.password)), args.timeout).read()
+        self._response = opener.open(args.url + '/events', None, args.timeout)
+
+    def run(self):
+        while True:
+            try:
+                if not self._response.readline():
+                    return
+            except socket.timeout:
+                # Nothing happened for a while, the stream is still open.
+                continue
+            except (urllib2.URLError, IOError):
+                return
+
+
+def LoadPage(args, path, data=None):
+    """Loads a page from all clients for --duration, and prints the results."""
+    clients = [_Client(args, path, data) for _ in xrange(args.clients)]
+    start = time.time()
+    for client in clients:
+        client.deadline = start + args.duration
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - start
+    latencies = sorted(sum((client.latencies for client in clients), []))
+    errors = sum(client.errors for client in clients)
+    if not latencies:
+        print('%-8s all %d requests failed' % (path, errors))
+        return
+    print('%-8s %8d %8d %8.1f %8.1f %8.1f' % (
+            path, len(latencies), errors, len(latencies) / elapsed,
+            _Percentile(latencies, 0.5) * 1000, _Percentile(latencies, 0.99) * 1000))
+
+
+def Main():
+    args = ParseFlags()
+    streams = 0
+    for _ in xrange(args.streams):
+        try:
+            _Stream(args).start()
+            streams += 1
+        except (urllib2.URLError, IOError):
+            pass
+    print('%d clients, %.0fs per page, %d of %d streams open' % (
+            args.clients, args.duration, streams, args.streams))
+    print('%-8s %8s %8s %8s %8s %8s' % ('page', 'requests', 'errors', 'req/s',
+                                        'p50 ms', 'p99 ms'))
+    LoadPage(args, '/')
+    # Posting the login form runs the password check, like a real login.
+    LoadPage(args, '/login', urllib.urlencode(
+            dict(user=args.user or 'nobody', password=args.password or 'x')))
+
+
+if __name__ == '__main__':
+    Main()
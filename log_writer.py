@@ -1,39 +1,311 @@
 #!/usr/bin/env python
 
+import collections
+import gzip
 import os
+import Queue
+import shutil
+import threading
 import time
 
 LINES = 100
 
+# Size of the chunks read from the end of the log file at startup.
+_TAIL_CHUNK = 8192
+
+# Sync policies, see LogWriter.
+SYNC_NONE = 'none'
+SYNC_FLUSH = 'flush'
+SYNC_FSYNC = 'fsync'
+SYNC_POLICIES = (SYNC_NONE, SYNC_FLUSH, SYNC_FSYNC)
+
+
+def _ReadLastLines(filename, count):
+    """Returns the last count lines of filename, reading from the end.
+
+    Only reads as much of the file as it takes to find count lines.
+    """
+    with open(filename, 'rb') as fh:
+        fh.seek(0, os.SEEK_END)
+        pos = fh.tell()
+        data = ''
+        # One newline more than lines wanted, so the first line is complete.
+        while pos > 0 and data.count('\n') <= count:
+            step = min(_TAIL_CHUNK, pos)
+            pos -= step
+            fh.seek(pos)
+            data = fh.read(step) + data
+    return data.splitlines(True)[-count:]
+
+
+def _ReadAllLastLines(filename, count):
+    """Like _ReadLastLines, but also reads gzip-compressed files."""
+    if not filename.endswith('.gz'):
+        return _ReadLastLines(filename, count)
+    # Rotated segments are bounded in size, so reading one through is fine.
+    with gzip.open(filename, 'rb') as fh:
+        return list(collections.deque(fh, maxlen=count))
+
+
+def _ListSegments(log_file):
+    """Returns rotated segments of log_file, oldest first."""
+    log_dir, prefix = os.path.split(log_file)
+    prefix += '.'
+    segments = [os.path.join(log_dir, name) for name in os.listdir(log_dir or '.')
+                if name.startswith(prefix) and not name.endswith('.tmp')]
+    # Compressed or not, segments sort by their timestamp.
+    return sorted(segments, key=lambda s: s[:-3] if s.endswith('.gz') else s)
+
+
 class LogWriter(object):
-    """Class to write a log of all RFID swipes."""
+    """Class to write a log of all RFID swipes.
+
+    The log can be rotated when it grows past a size or when the day changes.
+    A rotated log is renamed to <log_file>.<timestamp>, then compressed to
+    <log_file>.<timestamp>.gz by a background thread, which also deletes the
+    oldest compressed segments beyond the retention count. Segments still
+    waiting to be compressed are never deleted.
+
+    With max_latency set, Log() only queues the line. A writer thread commits
+    queued lines in groups of up to batch_size, at most max_latency seconds
+    after the first line of the group was logged, with one flush (or fsync)
+    and one event store transaction per group. A crash loses at most the
+    lines of one such window.
+    """
 
-    def __init__(self, log_file):
+    def __init__(self, log_file, sync=SYNC_FLUSH, max_bytes=None,
+                 rotate_daily=False, keep=10, event_store=None,
+                 max_latency=None, batch_size=100):
+        """Constructor.
+
+        Args:
+          log_file: str, path of the log file.
+          sync: str, what to do after each line is written: SYNC_NONE leaves
+              it in the buffer, SYNC_FLUSH hands it to the OS and SYNC_FSYNC
+              also waits until it is on disk.
+          max_bytes: int or None, rotate the log before it grows past this.
+          rotate_daily: bool, rotate the log when the day changes.
+          keep: int, number of rotated segments to keep. With 0, rotated
+              segments are deleted instead of kept.
+          event_store: event_store.EventStore or None, also store every
+              logged event there.
+          max_latency: float or None, if set, commit lines in groups from a
+              background thread, waiting at most this many seconds.
+          batch_size: int, max number of lines per group.
+        """
+        if sync not in SYNC_POLICIES:
+            raise ValueError('Invalid sync policy: %s' % sync)
+        if keep < 0:
+            raise ValueError('Invalid number of segments to keep: %d' % keep)
         self._log_file = os.path.expanduser(log_file)
-        # Read last lines if file exists.
+        self._sync = sync
+        self._max_bytes = max_bytes
+        self._rotate_daily = rotate_daily
+        self._keep = keep
+        self._event_store = event_store
+        self._max_latency = max_latency
+        self._batch_size = batch_size
+        # Functions called with every new line.
+        self._listeners = []
+        # Log() is called from several threads. Held while a line goes to
+        # _last_lines, the listeners and the file (or its queue), so that they
+        # all see lines in the same order.
+        self._lock = threading.Lock()
+        # Protects _fh and the rotation state.
+        self._file_lock = threading.Lock()
+        # Read last lines if file exists. If it was rotated recently, the rest
+        # of the lines come from the newest rotated segment.
+        self._last_lines = collections.deque(maxlen=LINES)
         if os.path.exists(self._log_file):
-            with open(self._log_file) as fh:
-                self._last_lines = fh.readlines()[-LINES:]
+            self._last_lines.extend(_ReadLastLines(self._log_file, LINES))
+        segments = _ListSegments(self._log_file)
+        if len(self._last_lines) < LINES and segments:
+            missing = LINES - len(self._last_lines)
+            self._last_lines.extendleft(
+                    reversed(_ReadAllLastLines(segments[-1], missing)))
+        self._fh = open(self._log_file, 'a')
+        self._size = self._fh.tell()
+        # Day the current log file was last written to.
+        if self._size:
+            self._day = time.strftime(
+                    '%Y-%m-%d', time.localtime(os.path.getmtime(self._log_file)))
         else:
-            self._last_lines = []
+            self._day = time.strftime('%Y-%m-%d')
+
+        # Timestamp of the last rotation, and how many happened within it.
+        self._last_stamp = None
+        self._stamp_suffix = 0
+
+        # Rotated segments waiting to be compressed, None to stop.
+        self._to_compress = Queue.Queue()
+        self._compressor = threading.Thread(target=self._Compress, name='log-compressor')
+        self._compressor.daemon = True
+        self._compressor.start()
+        # Finish the job if we crashed while compressing.
+        for segment in segments:
+            if not segment.endswith('.gz'):
+                self._to_compress.put(segment)
+
+        # Lines waiting to be committed by the writer thread, None to stop.
+        self._to_write = Queue.Queue()
+        self._writer = None
+        if max_latency is not None:
+            self._writer = threading.Thread(target=self._WriteBatches, name='log-writer')
+            self._writer.daemon = True
+            self._writer.start()
+
+    def AddListener(self, listener):
+        """Calls listener with every line logged from now on.
+
+        The listener runs on the thread calling Log(), with the log's lock
+        held. It must not block, nor log.
+        """
+        self._listeners.append(listener)
 
     def GetLastLines(self):
         """Returns last LINES lines as a string."""
-        return ''.join(self._last_lines)
+        with self._lock:
+            return ''.join(self._last_lines)
+
+    def GetLastLinesAt(self, position):
+        """Returns the last lines, and how far the listeners got.
+
+        Args:
+            position: function, called without arguments with the log's lock
+                held, e.g. GetLast() of the event_stream.EventStream a
+                listener publishes to.
+
+        Returns:
+            (last LINES lines as a string, result of position()). No line can
+            be logged in between, so the two match.
+        """
+        with self._lock:
+            return ''.join(self._last_lines), position()
 
     def Log(self, **kwargs):
         """Logs kwargs to log."""
-        with open(self._log_file, 'a') as fh:
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-            line = '[%s]' % timestamp
-            for k, v in kwargs.iteritems():
-                if v is not None:
-                    line += ' %s:%s' % (k, v)
-            line += '\n'
+        seconds = time.time()
+        now = time.localtime(seconds)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', now)
+        line = '[%s]' % timestamp
+        for k, v in kwargs.iteritems():
+            if v is not None:
+                line += ' %s:%s' % (k, v)
+        line += '\n'
+        entry = (seconds, now, line, kwargs)
+        with self._lock:
+            # The deque keeps the last N lines.
             self._last_lines.append(line)
-            # Keep last N lines.
-            self._last_lines = self._last_lines[-LINES:]
-            fh.write(line)
+            for listener in self._listeners:
+                listener(line)
+            if self._writer is not None:
+                self._to_write.put(entry)
+            else:
+                self._Write([entry])
+
+    def Close(self):
+        """Commits queued lines, flushes and closes the log file.
+
+        Waits for rotated segments to be compressed.
+        """
+        if self._writer is not None:
+            self._to_write.put(None)
+            self._writer.join()
+        with self._file_lock:
+            self._fh.close()
+        self._to_compress.put(None)
+        self._compressor.join()
+
+    def _Write(self, entries):
+        """Writes (seconds, struct_time, line, kwargs) entries as one group."""
+        with self._file_lock:
+            for _, now, line, _ in entries:
+                day = time.strftime('%Y-%m-%d', now)
+                if self._size and (
+                        (self._rotate_daily and day != self._day) or
+                        (self._max_bytes and self._size + len(line) > self._max_bytes)):
+                    self._Rotate(now)
+                self._day = day
+                self._fh.write(line)
+                self._size += len(line)
+            if self._sync != SYNC_NONE:
+                self._fh.flush()
+                if self._sync == SYNC_FSYNC:
+                    os.fsync(self._fh.fileno())
+        if self._event_store is not None:
+            self._event_store.AddMany(
+                    [(seconds, kwargs) for seconds, _, _, kwargs in entries])
+
+    def _WriteBatches(self):
+        """Commits queued lines in groups. Runs in a thread."""
+        stopping = False
+        while not stopping:
+            entry = self._to_write.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = time.time() + self._max_latency
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        entry = self._to_write.get(timeout=timeout)
+                    else:
+                        entry = self._to_write.get_nowait()
+                except Queue.Empty:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            try:
+                self._Write(batch)
+            except Exception, e:
+                # Keep the writer alive; the lines are still in _last_lines.
+                print 'Failed to write %d log lines: %s' % (len(batch), e)
+
+    def _Rotate(self, now):
+        """Moves the current log aside and starts a new one.
+
+        Only renames and reopens; compression happens in the background.
+        Needs the file lock.
+        """
+        self._fh.close()
+        stamp = time.strftime('%Y%m%d-%H%M%S', now)
+        # Several rotations within a second get numbered. Don't reuse a name
+        # even if retention already deleted it, so names keep sorting by age.
+        if stamp == self._last_stamp:
+            self._stamp_suffix += 1
+        else:
+            self._last_stamp = stamp
+            self._stamp_suffix = 0
+        segment = '%s.%s' % (self._log_file, stamp)
+        if self._stamp_suffix:
+            segment += '-%02d' % self._stamp_suffix
+        os.rename(self._log_file, segment)
+        self._fh = open(self._log_file, 'a')
+        self._size = 0
+        self._to_compress.put(segment)
+
+    def _Compress(self):
+        """Compresses rotated segments and applies retention. Runs in a thread."""
+        while True:
+            segment = self._to_compress.get()
+            if segment is None:
+                return
+            try:
+                with open(segment, 'rb') as src:
+                    with gzip.open(segment + '.gz.tmp', 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+                os.rename(segment + '.gz.tmp', segment + '.gz')
+                os.remove(segment)
+                # Segments queued behind this one are left alone until they
+                # are compressed too.
+                done = [s for s in _ListSegments(self._log_file) if s.endswith('.gz')]
+                for old in done[:max(0, len(done) - self._keep)]:
+                    os.remove(old)
+            except (IOError, OSError), e:
+                print 'Failed to compress %s: %s' % (segment, e)
 
 
 if __name__ == '__main__':
@@ -43,3 +315,4 @@ if __name__ == '__main__':
     log.Log(rfid='abcd', authorized=True, name='jimmy')
     log.Log(rfid='abcd', authorized=False, name=None)
     print log.GetLastLines()
+    log.Close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Benchmark for logging a burst of swipes.
+#
+# Compares the old open/append/close per event with LogWriter writing each
+# line right away and LogWriter committing in groups, with and without the
+# event store.
+#
+# Usage: log_writer_benchmark.py [number of events]
+
+from __future__ import print_function
+
+import shutil
+import sys
+import tempfile
+import time
+
+# Local imports.
+import event_store
+import log_writer
+
+
+class _LegacyLogWriter(object):
+    """What LogWriter.Log used to do: open, append and close per event."""
+
+    def __init__(self, log_file):
+        self._log_file = log_file
+        self._last_lines = []
+
+    def Log(self, **kwargs):
+        with open(self._log_file, 'a') as fh:
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            line = '[%s]' % timestamp
+            for k, v in kwargs.iteritems():
+                if v is not None:
+                    line += ' %s:%s' % (k, v)
+            line += '\n'
+            self._last_lines.append(line)
+            self._last_lines = self._last_lines[-log_writer.LINES:]
+            fh.write(line)
+
+    def Close(self):
+        pass
+
+
+def _Run(name, make_writer, count):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        writer = make_writer(temp_dir)
+        latencies = []
+        start = time.time()
+        for i in xrange(count):
+            before = time.time()
+            writer.Log(action='swipe', rfid='%08x' % i, authorized=True, name='user %d' % i)
+            latencies.append(time.time() - before)
+        writer.Close()
+        elapsed = time.time() - start
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print('%-32s %12.0f %14.1f' % (name, count / elapsed, p99 * 1e6))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def Main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    def _Events(temp_dir):
+        return event_store.EventStore(temp_dir + '/events.db')
+
+    print('%-32s %12s %14s' % ('writer', 'events/s', 'p99 Log (us)'))
+    _Run('open/append per event',
+         lambda d: _LegacyLogWriter(d + '/log.txt'), count)
+    _Run('LogWriter, flush per line',
+         lambda d: log_writer.LogWriter(d + '/log.txt'), count)
+    _Run('LogWriter, group commit',
+         lambda d: log_writer.LogWriter(d + '/log.txt', max_latency=0.1), count)
+    _Run('LogWriter+events, per line',
+         lambda d: log_writer.LogWriter(d + '/log.txt', event_store=_Events(d)), count)
+    _Run('LogWriter+events, group commit',
+         lambda d: log_writer.LogWriter(d + '/log.txt', event_store=_Events(d),
+                                        max_latency=0.1), count)
+    _Run('fsync, per line',
+         lambda d: log_writer.LogWriter(d + '/log.txt', sync=log_writer.SYNC_FSYNC),
+         count / 10)
+    _Run('fsync, group commit',
+         lambda d: log_writer.LogWriter(d + '/log.txt', sync=log_writer.SYNC_FSYNC,
+                                        max_latency=0.1), count / 10)
+
+
+if __name__ == '__main__':
+    Main()
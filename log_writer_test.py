@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Local imports.
+import log_writer
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.temp_dir, 'log.txt')
+
+    def tearDown(self):
+        if os.path.isdir(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def testTailOfBigFile(self):
+        lines = ['line %d %s\n' % (i, 'x' * (i % 50)) for i in xrange(10000)]
+        with open(self.log_file, 'w') as fh:
+            fh.writelines(lines)
+        log = log_writer.LogWriter(self.log_file)
+        self.assertEqual(''.join(lines[-log_writer.LINES:]), log.GetLastLines())
+        log.Close()
+
+    def testShortFile(self):
+        with open(self.log_file, 'w') as fh:
+            fh.write('one\ntwo\nthree')
+        log = log_writer.LogWriter(self.log_file)
+        self.assertEqual('one\ntwo\nthree', log.GetLastLines())
+        log.Close()
+
+    def testLog(self):
+        log = log_writer.LogWriter(self.log_file)
+        self.assertEqual('', log.GetLastLines())
+        for i in xrange(log_writer.LINES + 10):
+            log.Log(rfid='abcd', count=i, name=None)
+        last_lines = log.GetLastLines().splitlines()
+        self.assertEqual(log_writer.LINES, len(last_lines))
+        self.assertIn('count:%d' % (log_writer.LINES + 9), last_lines[-1])
+        self.assertNotIn('name:', last_lines[-1])
+
+        # Lines are flushed right away by default.
+        with open(self.log_file) as fh:
+            self.assertEqual(log_writer.LINES + 10, len(fh.readlines()))
+        log.Close()
+
+        # And read back by the next writer.
+        log = log_writer.LogWriter(self.log_file, sync=log_writer.SYNC_FSYNC)
+        self.assertEqual('\n'.join(last_lines) + '\n', log.GetLastLines())
+        log.Close()
+
+    def testInvalidSyncPolicy(self):
+        self.assertRaises(ValueError, log_writer.LogWriter, self.log_file, 'sometimes')
+
+    def _Segments(self):
+        return [os.path.basename(f) for f in log_writer._ListSegments(self.log_file)]
+
+    def testRotateBySize(self):
+        log = log_writer.LogWriter(self.log_file, max_bytes=1000, keep=3)
+        for i in xrange(200):
+            log.Log(rfid='abcd', count=i)
+        self.assertLessEqual(os.path.getsize(self.log_file), 1000)
+        last_lines = log.GetLastLines()
+        log.Close()
+
+        # Old segments were compressed, and only the newest ones kept.
+        segments = self._Segments()
+        self.assertEqual(3, len(segments))
+        self.assertTrue(all(f.endswith('.gz') for f in segments))
+        with gzip.open(os.path.join(self.temp_dir, segments[-1])) as fh:
+            lines = fh.readlines()
+        with open(self.log_file) as fh:
+            lines += fh.readlines()
+        self.assertIn('count:199', lines[-1])
+        # Sorted by age.
+        self.assertTrue(all('count:%d' % i in line for i, line in
+                            enumerate(lines, 200 - len(lines))))
+
+        # The tail spans the rotation boundary.
+        log = log_writer.LogWriter(self.log_file, max_bytes=1000, keep=3)
+        self.assertEqual(''.join(lines[-log_writer.LINES:]), log.GetLastLines())
+        self.assertEqual(last_lines[-500:], log.GetLastLines()[-500:])
+        log.Close()
+
+    def testRotateKeepNone(self):
+        self.assertRaises(ValueError, log_writer.LogWriter, self.log_file, keep=-1)
+        log = log_writer.LogWriter(self.log_file, max_bytes=1000, keep=0)
+        for i in xrange(200):
+            log.Log(rfid='abcd', count=i)
+        log.Close()
+        self.assertEqual([], self._Segments())
+        self.assertTrue(os.path.exists(self.log_file))
+
+    def testRotateWhileCompressing(self):
+        # Retention doesn't delete segments before they are compressed.
+        compressed = []
+        release = threading.Event()
+        copy = log_writer.shutil.copyfileobj
+
+        def _SlowCopy(src, dst):
+            release.wait()
+            compressed.append(src.name)
+            copy(src, dst)
+
+        log_writer.shutil.copyfileobj = _SlowCopy
+        self.addCleanup(setattr, log_writer.shutil, 'copyfileobj', copy)
+        log = log_writer.LogWriter(self.log_file, max_bytes=1000, keep=1)
+        for i in xrange(200):
+            log.Log(rfid='abcd', count=i)
+        rotated = self._Segments()
+        self.assertLess(2, len(rotated))
+        release.set()
+        log.Close()
+        self.assertEqual(len(rotated), len(compressed))
+        self.assertEqual([rotated[-1] + '.gz'], self._Segments())
+
+    def testRotateDaily(self):
+        log = log_writer.LogWriter(self.log_file, rotate_daily=True)
+        log.Log(rfid='abcd')
+        log.Log(rfid='abcd')
+        self.assertEqual([], self._Segments())
+        # Pretend the last line was written yesterday.
+        log._day = '1999-12-31'
+        log.Log(rfid='efgh')
+        log.Close()
+        self.assertEqual(1, len(self._Segments()))
+        with open(self.log_file) as fh:
+            self.assertIn('efgh', fh.read())
+
+    def testConcurrentOrder(self):
+        heard = []
+        log = log_writer.LogWriter(self.log_file, max_latency=0.01)
+        log.AddListener(heard.append)
+
+        def _Log(thread):
+            for i in xrange(200):
+                log.Log(thread=thread, count=i)
+
+        threads = [threading.Thread(target=_Log, args=(t,)) for t in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tail = log.GetLastLines()
+        log.Close()
+        with open(self.log_file) as fh:
+            written = fh.readlines()
+        # The file, the listeners and the tail agree on the order.
+        self.assertEqual(800, len(written))
+        self.assertEqual(written, heard)
+        self.assertEqual(''.join(written[-log_writer.LINES:]), tail)
+
+    def testLastLinesAt(self):
+        heard = []
+        log = log_writer.LogWriter(self.log_file, max_latency=0.01)
+        log.AddListener(heard.append)
+        stop = threading.Event()
+
+        def _Log():
+            while not stop.is_set():
+                log.Log(action='swipe')
+
+        thread = threading.Thread(target=_Log)
+        thread.start()
+        for _ in xrange(100):
+            tail, count = log.GetLastLinesAt(lambda: len(heard))
+            # The tail ends with the last line the listener heard.
+            self.assertEqual(min(count, log_writer.LINES), len(tail.splitlines(True)))
+            if count:
+                self.assertTrue(tail.endswith(heard[count - 1]))
+        stop.set()
+        thread.join()
+        log.Close()
+
+    def testGroupCommit(self):
+        groups = []
+
+        class _FakeEventStore(object):
+            def AddMany(self, events):
+                groups.append(events)
+
+        log = log_writer.LogWriter(self.log_file, event_store=_FakeEventStore(),
+                                   max_latency=0.05, batch_size=10)
+        log.Log(rfid='first')
+        # Visible in the tail right away, on disk within the latency window.
+        self.assertIn('rfid:first', log.GetLastLines())
+        time.sleep(0.3)
+        with open(self.log_file) as fh:
+            self.assertIn('rfid:first', fh.read())
+        self.assertEqual(1, len(groups))
+
+        for i in xrange(25):
+            log.Log(rfid='abcd', count=i)
+        log.Close()
+        with open(self.log_file) as fh:
+            lines = fh.readlines()
+        self.assertEqual(26, len(lines))
+        self.assertIn('count:24', lines[-1])
+        self.assertEqual(26, sum(len(group) for group in groups))
+        self.assertTrue(all(len(group) <= 10 for group in groups))
+        self.assertLess(len(groups), 26)
+        self.assertEqual({'rfid': 'abcd', 'count': 24}, groups[-1][-1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,59 @@
 # Mock hardware implementation.
 
+import time
+
 import hardware
 
 class MockHardware(hardware.Hardware):
 
+    def __init__(self, *args, **kwargs):
+        super(MockHardware, self).__init__(*args, **kwargs)
+        # Maps door names to lists of (time, locked) tuples, one per lock
+        # state change.
+        self.door_events = dict((door.name, []) for door in self.doors)
+        # Lock state changes of the default door.
+        self.lock_events = self.door_events[self.default_door]
+
     def Initialize(self):
         print 'Initialize()'
+        self.scheduler.Start()
+
+    def ScanTag(self, rfid, door=None):
+        """Simulates a tag swipe.
+
+        Returns:
+          float, seconds it took the tag seen handler to return.
+        """
+        door = door or self.default_door
+        start = time.time()
+        self.swipes.ReadCode(rfid, reader=door, door=door)
+        return time.time() - start
+
+    def ScanFrame(self, bits, value, door=None):
+        """Simulates a raw Wiegand frame from a reader.
+
+        Returns:
+          bool, whether the frame reached the tag seen handler.
+        """
+        door = door or self.default_door
+        return self.swipes.ReadFrame(bits, value, reader=door, door=door)
+
+    def PressDoorbell(self, door=None):
+        """Simulates a press of a doorbell button.
+
+        Returns:
+          bool, whether the press reached the doorbell handler.
+        """
+        return self._DoorbellPressed(door)
+
+    def _OpenLock(self, door):
+        print 'OpenLock(%s)' % door.name
+        self.door_events[door.name].append((time.time(), False))
 
-    def UnlockDoor(self):
-        print 'UnlockDoor()'
+    def _CloseLock(self, door):
+        print 'CloseLock(%s)' % door.name
+        self.door_events[door.name].append((time.time(), True))
 
     def ShutDown(self):
         print 'ShutDown()'
+        self.scheduler.Stop()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import os
+import Queue
+import shutil
+import tempfile
+import time
+import unittest
+
+# Local imports.
+import fake_pigpio
+import wiegand
+
+# real_hardware imports pigpio.
+_restore = fake_pigpio.Install()
+import real_hardware
+_restore()
+
+
+class TestRealHardware(unittest.TestCase):
+
+    def setUp(self):
+        self.restore = fake_pigpio.Install()
+        self.tmpdir = tempfile.mkdtemp()
+        self.pin_config = os.path.join(self.tmpdir, 'pins.cfg')
+        self.hw = real_hardware.RealHardware(0.1, self.pin_config)
+        self.swipes = Queue.Queue()
+        self.hw.SetTagSeenHandler(lambda rfid, **details: self.swipes.put((rfid, details)))
+        self.hw.Initialize()
+
+    def tearDown(self):
+        self.hw.ShutDown()
+        self.restore()
+        shutil.rmtree(self.tmpdir)
+
+    def testSwipe(self):
+        # The default configuration is written out.
+        self.assertTrue(os.path.isfile(self.pin_config))
+        door = self.hw.doors[0]
+        value = wiegand.Encode(26, 12, 3456)
+        edges, _ = fake_pigpio.FrameEdges(door.data_low, door.data_high, 26, value, 0)
+        self.hw.pi.Replay(edges)
+        self.assertEqual((str(value), dict(door='front', facility=12, card=3456)),
+                         self.swipes.get(timeout=2))
+
+    def testDoorbell(self):
+        # The default configuration has none.
+        self.assertIsNone(self.hw.doors[0].doorbell)
+        self.hw.ShutDown()
+        with open(self.pin_config, 'w') as fh:
+            fh.write('[Pins]\ndoorbell = 24\n')
+        self.hw = real_hardware.RealHardware(0.1, self.pin_config)
+        self.hw.Initialize()
+        presses = Queue.Queue()
+        self.hw.SetDoorbellHandler(lambda door: presses.put(door))
+        bell = self.hw.doors[0].doorbell
+        # A press, with contact bounce on both ends.
+        edges = (fake_pigpio.Glitch([bell], 0, 200) +
+                 fake_pigpio.Glitch([bell], 1000, 300000) +
+                 fake_pigpio.Glitch([bell], 301500, 500))
+        self.hw.pi.Replay(edges)
+        self.assertEqual('front', presses.get(timeout=2))
+        self.assertTrue(presses.empty())
+
+    def testDoors(self):
+        self.hw.ShutDown()
+        with open(self.pin_config, 'w') as fh:
+            fh.write('[door:front]\ndata_low = 17\ndata_high = 18\nlock = 23\n'
+                     '[door:back]\ndata_low = 5\ndata_high = 6\nlock = 13\nled = 12\n')
+        self.hw = real_hardware.RealHardware(0.1, self.pin_config)
+        self.hw.SetTagSeenHandler(lambda rfid, **details: self.swipes.put((rfid, details)))
+        self.hw.Initialize()
+        value = wiegand.Encode(34, 1, 2)
+        edges, _ = fake_pigpio.FrameEdges(5, 6, 34, value, 0)
+        self.hw.pi.Replay(edges)
+        self.assertEqual((str(value), dict(door='back', facility=1, card=2)),
+                         self.swipes.get(timeout=2))
+        self.hw.UnlockDoor('back')
+        deadline = time.time() + 2
+        while len(self.hw.pi.writes) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([(13, 1), (12, 0), (13, 0), (12, 1)],
+                         [(gpio, level) for _, gpio, level in self.hw.pi.writes])
+
+    def testUnlock(self):
+        self.hw.UnlockDoor()
+        deadline = time.time() + 2
+        while len(self.hw.pi.writes) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        lock = self.hw.doors[0].lock
+        self.assertEqual([1, 0], [level for _, gpio, level in self.hw.pi.writes
+                                  if gpio == lock])
+
+
+if __name__ == '__main__':
+    unittest.main()
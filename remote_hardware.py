@@ -0,0 +1,113 @@
+# Hardware of a door_daemon.py, reached over its socket.
+
+import door_config
+import door_ipc
+
+
+class RemoteHardware(object):
+    """Client of door_daemon.py, with the interface of hardware.Hardware.
+
+    The daemon keeps the doors and decides who gets in, so restarting this
+    side leaves them as they are. Swipes come with the daemon's decision,
+    and authorized ones have already unlocked the door. Handlers are called
+    from the thread receiving the daemon's events.
+    """
+
+    def __init__(self, path):
+        """Constructor.
+
+        Args:
+            path: str, path of the daemon's Unix socket.
+        """
+        self._client = door_ipc.Client(path)
+        self._subscription = None
+        # Handler to call when a tag is seen.
+        self.tag_seen_handler = None
+        # Handler to call when the doorbell is pressed.
+        self.doorbell_handler = None
+        # Handler to call with the records the daemon reports.
+        self.log_handler = None
+        # door_config.Door of each door, as configured in the daemon. Read by
+        # Initialize().
+        self.doors = []
+        # Name of the door to use when none is given.
+        self.default_door = None
+
+    def Initialize(self):
+        """Reads the doors from the daemon, and subscribes to its events.
+
+        Raises:
+            door_ipc.IpcError: if the daemon isn't running.
+        """
+        status = self._client.GetStatus()
+        self.doors = [door_config.Door(**dict((str(k), v) for k, v in door.iteritems()))
+                      for door in status['doors']]
+        self.default_door = status['default_door']
+        self._subscription = self._client.Subscribe(self._Event)
+
+    def _Event(self, kind, data):
+        if kind == 'swipe' and self.tag_seen_handler is not None:
+            data = dict((str(k), v) for k, v in data.iteritems())
+            self.tag_seen_handler(data.pop('rfid'), **data)
+        elif kind == 'doorbell' and self.doorbell_handler is not None:
+            self.doorbell_handler(data['door'])
+        elif kind == 'log' and self.log_handler is not None:
+            self.log_handler(**dict((str(k), v) for k, v in data.iteritems()))
+
+    def SetTagSeenHandler(self, handler):
+        """See hardware.Hardware.SetTagSeenHandler().
+
+        The handler is also passed the authorized (bool) and name (str or
+        None) keyword arguments, as user_db.UserDb.AuthorizeRfidTag()
+        returned them in the daemon.
+        """
+        self.tag_seen_handler = handler
+
+    def SetLogHandler(self, handler):
+        """Sets up handler for the records the daemon reports.
+
+        Args:
+            handler: function, called with the keyword arguments of a log
+                record, e.g. log_writer.LogWriter.Log.
+        """
+        self.log_handler = handler
+
+    def SetDoorbellHandler(self, handler):
+        """See hardware.Hardware.SetDoorbellHandler()."""
+        self.doorbell_handler = handler
+
+    def GetSwipeStats(self):
+        """Returns the counters of the daemon's swipe filter, as a dict.
+
+        The dict is empty if the daemon can't be reached.
+        """
+        try:
+            return self._client.GetStatus()['swipes']
+        except door_ipc.IpcError:
+            return {}
+
+    def UnlockDoor(self, door=None):
+        """Unlocks a door for its open time.
+
+        Raises:
+            door_ipc.IpcError: if there is no such door, or the daemon
+                can't be reached.
+        """
+        self._client.Unlock(door)
+
+    def ClearUnknownTags(self):
+        """Makes the daemon forget the unknown tags, e.g. after adding users.
+
+        Does nothing if the daemon can't be reached; it forgets them after
+        a while anyway.
+        """
+        try:
+            self._client.ClearUnknownTags()
+        except door_ipc.IpcError:
+            pass
+
+    def ShutDown(self):
+        """Unsubscribes from the daemon. Leaves the doors alone."""
+        if self._subscription is not None:
+            self._subscription.Close()
+        self._client.Close()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Weekly time windows for access control.
+#
+# Schedules are defined in the [times] section of the user database, one per
+# line, as a name followed by one or more colon-separated windows:
+#
+#   [times]
+#   workday:wed 1830-2300
+#   weekend:sat,sun 0000-2400
+#   evenings:mon-fri 1800-2200:sat 1000-1400 1600-2000
+#   night:fri 2200-0200
+#
+# A window is a list of days (mon..sun, ranges like mon-fri, or * for every
+# day) followed by one or more HHMM-HHMM ranges. A range whose end is before
+# its start runs past midnight into the next day. Several lines with the same
+# name add up.
+#
+# Users refer to schedules with time=<name>[,<name>...] and may then only get
+# in during one of the windows of any of them.
+#
+# Every distinct time= value is compiled once into a bitset with one bit per
+# minute of the week (1260 bytes), so checking a swipe is a single index and
+# shift, without any string parsing.
+
+from __future__ import print_function
+
+import binascii
+import re
+import time
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Valid schedule name.
+_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+# HHMM-HHMM.
+_RANGE_RE = re.compile(r'^(\d\d)(\d\d)-(\d\d)(\d\d)$')
+
+
+class ScheduleError(Exception):
+    """Invalid schedule definition or reference."""
+    pass
+
+
+def MinuteOfWeek(now=None):
+    """Returns the local minute of the week, 0 being Monday 00:00."""
+    t = time.localtime(now)
+    return t.tm_wday * MINUTES_PER_DAY + t.tm_hour * 60 + t.tm_min
+
+
+def _ParseDay(day):
+    try:
+        return DAYS.index(day[:3].lower())
+    except ValueError:
+        raise ScheduleError('Invalid day: %s' % day)
+
+
+def _ParseDays(spec):
+    """Parses e.g. 'mon-wed,fri' into a list of day numbers, Monday being 0."""
+    if spec == '*':
+        return range(7)
+    days = []
+    for item in spec.split(','):
+        first, sep, last = item.partition('-')
+        first = _ParseDay(first)
+        if not sep:
+            days.append(first)
+            continue
+        last = _ParseDay(last)
+        days.extend(d % 7 for d in xrange(first, first + (last - first) % 7 + 1))
+    return days
+
+
+def _ParseRange(spec):
+    """Parses HHMM-HHMM into (start, end) minutes of the day.
+
+    If end <= start, the range runs into the next day and end is > 1440.
+    """
+    match = _RANGE_RE.match(spec)
+    if not match:
+        raise ScheduleError('Invalid time range: %s' % spec)
+    h1, m1, h2, m2 = [int(g) for g in match.groups()]
+    if h1 > 23 or h2 > 24 or m1 > 59 or m2 > 59 or (h2 == 24 and m2):
+        raise ScheduleError('Invalid time range: %s' % spec)
+    start = h1 * 60 + m1
+    end = h2 * 60 + m2
+    if end == start:
+        raise ScheduleError('Empty time range: %s' % spec)
+    if end < start:
+        end += MINUTES_PER_DAY
+    return start, end
+
+
+def ParseWindow(spec):
+    """Parses a window like 'mon-fri 0900-1700' into minute-of-week ranges.
+
+    Returns:
+        List of (start, end) minutes of the week. end may be past the end of
+        the week for windows that run into Monday.
+    """
+    tokens = spec.split()
+    if len(tokens) < 2:
+        raise ScheduleError('Invalid time window: %s' % spec)
+    ranges = [_ParseRange(token) for token in tokens[1:]]
+    return [(day * MINUTES_PER_DAY + start, day * MINUTES_PER_DAY + end)
+            for day in _ParseDays(tokens[0]) for start, end in ranges]
+
+
+class Schedules(object):
+    """Named schedules, and a compiled table for each combination in use.
+
+    Compile() is called while the database is parsed; IsAllowed() then only
+    looks the table up. Once published to readers, a Schedules is never
+    modified: to compile more values, compile them into a Copy().
+    """
+
+    def __init__(self):
+        # Maps names to lists of window specs.
+        self._specs = {}
+        # Maps names to lists of (start, end) minute-of-week ranges.
+        self._ranges = {}
+        # Maps time= values to bitsets, see Compile().
+        self._compiled = {}
+
+    def Add(self, name, windows):
+        """Adds windows (list of str) to the schedule called name."""
+        if not _NAME_RE.match(name):
+            raise ScheduleError('Invalid schedule name: %s' % name)
+        ranges = []
+        for window in windows:
+            ranges.extend(ParseWindow(window.strip()))
+        self._specs.setdefault(name, []).extend(w.strip() for w in windows)
+        self._ranges.setdefault(name, []).extend(ranges)
+        # Tables compiled so far may include this schedule.
+        self._compiled.clear()
+
+    def Copy(self):
+        """Returns a copy, sharing the (unmodifiable) compiled tables."""
+        other = Schedules()
+        other._specs = dict((name, list(specs)) for name, specs in self._specs.iteritems())
+        other._ranges = dict((name, list(ranges)) for name, ranges in self._ranges.iteritems())
+        other._compiled = dict(self._compiled)
+        return other
+
+    def Items(self):
+        """Returns (name, list of window specs) tuples, sorted by name."""
+        return sorted(self._specs.iteritems())
+
+    def Compile(self, value):
+        """Compiles a time= value, e.g. 'workday,weekend'.
+
+        Returns:
+            bytearray with a bit set for each minute of the week in one of
+            the windows of one of the schedules. Minute m is bit m & 7 of
+            byte m >> 3.
+
+        Raises:
+            ScheduleError: if a schedule isn't defined.
+        """
+        table = self._compiled.get(value)
+        if table is None:
+            table = self._Build(value)
+            self._compiled[value] = table
+        return table
+
+    def _Build(self, value):
+        """Returns the table of a time= value, see Compile()."""
+        mask = 0
+        for name in value.split(','):
+            name = name.strip()
+            if name not in self._ranges:
+                raise ScheduleError('Unknown schedule: %s' % name)
+            for start, end in self._ranges[name]:
+                mask |= ((1 << (end - start)) - 1) << start
+        # Fold windows running past Sunday midnight back to Monday.
+        mask = (mask | mask >> MINUTES_PER_WEEK) & ((1 << MINUTES_PER_WEEK) - 1)
+        # Big-endian bytes, reversed so that byte i holds minutes 8i..8i+7.
+        table = bytearray(binascii.unhexlify('%0*x' % (MINUTES_PER_WEEK // 4, mask)))
+        table.reverse()
+        return table
+
+    def IsAllowed(self, value, minute):
+        """Returns whether time= value allows access at the minute of the week."""
+        table = self._compiled.get(value)
+        if table is None:
+            # Not compiled in advance; don't modify a published instance.
+            table = self._Build(value)
+        return (table[minute >> 3] >> (minute & 7)) & 1 == 1
+
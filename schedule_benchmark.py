@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Benchmark for time window checks with many users and overlapping windows.
+#
+# Usage: schedule_benchmark.py [number of users]
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+# Local imports.
+import schedule
+import user_db
+
+
+def _MakeDatabase(count, rand):
+    """Returns a database with 100 overlapping schedules and count users."""
+    lines = ['[times]']
+    for i in xrange(100):
+        windows = []
+        for _ in xrange(rand.randint(1, 4)):
+            first = rand.choice(schedule.DAYS)
+            last = rand.choice(schedule.DAYS)
+            start = rand.randint(0, 23)
+            end = (start + rand.randint(1, 10)) % 24
+            windows.append('%s-%s %02d00-%02d30' % (first, last, start, end))
+        lines.append('s%d:%s' % (i, ':'.join(windows)))
+    lines.append('[users]')
+    for i in xrange(count):
+        names = ','.join('s%d' % n for n in rand.sample(xrange(100), rand.randint(1, 3)))
+        lines.append('%08x:user %d:time=%s' % (i, i, names))
+    return '\n'.join(lines) + '\n'
+
+
+def _NaiveIsAllowed(specs, value, minute):
+    """Checks a swipe by parsing the windows of the user's schedules."""
+    for name in value.split(','):
+        for window in specs[name]:
+            for start, end in schedule.ParseWindow(window):
+                if start <= minute < end or start <= minute + schedule.MINUTES_PER_WEEK < end:
+                    return True
+    return False
+
+
+def Main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rand = random.Random(42)
+    blob = _MakeDatabase(count, rand)
+
+    start = time.time()
+    db = user_db._ParseDatabase(blob)
+    print('Parsed and compiled %d users in %.3fs' % (count, time.time() - start))
+    tables = len(db.schedules._compiled)
+    print('%d distinct time= values, %d KB of tables' % (
+            tables, tables * schedule.MINUTES_PER_WEEK // 8 // 1024))
+    specs = dict(db.schedules.Items())
+    users = db.users.values()
+    swipes = [(rand.choice(users).time, rand.randint(0, schedule.MINUTES_PER_WEEK - 1))
+              for _ in xrange(100000)]
+
+    start = time.time()
+    compiled = [db.schedules.IsAllowed(value, minute) for value, minute in swipes]
+    compiled_time = time.time() - start
+    start = time.time()
+    naive = [_NaiveIsAllowed(specs, value, minute) for value, minute in swipes[:10000]]
+    naive_time = (time.time() - start) * 10
+    assert naive == compiled[:10000]
+
+    print('%-30s %12s' % ('evaluator', 'us / swipe'))
+    print('%-30s %12.2f' % ('compiled table', compiled_time * 10))
+    print('%-30s %12.2f' % ('parse windows per swipe', naive_time * 10))
+    print('%d%% of swipes allowed' % (100 * sum(compiled) // len(compiled)))
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import time
+import unittest
+
+# Local imports.
+import schedule
+
+# Minute of the week of a day and HHMM time.
+def _At(day, hhmm):
+    return (schedule.DAYS.index(day) * schedule.MINUTES_PER_DAY +
+            hhmm // 100 * 60 + hhmm % 100)
+
+
+class TestSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.schedules = schedule.Schedules()
+        self.schedules.Add('workday', ['wed 1830-2300'])
+        self.schedules.Add('weekend', ['sat,sun 0000-2400'])
+        self.schedules.Add('evenings', ['mon-fri 1800-2200', 'sat 1000-1400 1600-2000'])
+        self.schedules.Add('night', ['sun 2200-0200'])
+
+    def _Allowed(self, value, day, hhmm):
+        return self.schedules.IsAllowed(value, _At(day, hhmm))
+
+    def testWindows(self):
+        self.assertFalse(self._Allowed('workday', 'wed', 1829))
+        self.assertTrue(self._Allowed('workday', 'wed', 1830))
+        self.assertTrue(self._Allowed('workday', 'wed', 2259))
+        self.assertFalse(self._Allowed('workday', 'wed', 2300))
+        self.assertFalse(self._Allowed('workday', 'thu', 1900))
+
+        self.assertTrue(self._Allowed('weekend', 'sun', 2359))
+        self.assertFalse(self._Allowed('weekend', 'mon', 0))
+        self.assertTrue(self._Allowed('evenings', 'tue', 1900))
+        self.assertTrue(self._Allowed('evenings', 'sat', 1700))
+        self.assertFalse(self._Allowed('evenings', 'sat', 1500))
+
+        # Past midnight, and past the end of the week.
+        self.assertTrue(self._Allowed('night', 'sun', 2300))
+        self.assertTrue(self._Allowed('night', 'mon', 159))
+        self.assertFalse(self._Allowed('night', 'mon', 200))
+
+    def testCombinations(self):
+        self.assertTrue(self._Allowed('workday,weekend', 'wed', 1900))
+        self.assertTrue(self._Allowed('workday, weekend', 'sat', 900))
+        self.assertFalse(self._Allowed('workday,weekend', 'fri', 1900))
+        # Adding windows later recompiles.
+        self.schedules.Add('workday', ['fri 1800-2000'])
+        self.assertTrue(self._Allowed('workday,weekend', 'fri', 1900))
+
+    def testCopy(self):
+        table = self.schedules.Compile('workday')
+        copy = self.schedules.Copy()
+        copy.Compile('workday,night')
+        copy.Add('workday', ['fri 1800-2000'])
+        self.assertTrue(copy.IsAllowed('workday', _At('fri', 1900)))
+        # The original is untouched, and so are its tables.
+        self.assertEqual({'workday': table}, self.schedules._compiled)
+        self.assertFalse(self._Allowed('workday', 'fri', 1900))
+        # Looking up a value that wasn't compiled doesn't cache it either.
+        self.assertTrue(self._Allowed('weekend', 'sat', 1200))
+        self.assertEqual(['workday'], self.schedules._compiled.keys())
+
+    def testDayRanges(self):
+        self.schedules.Add('wrap', ['fri-mon 1200-1300'])
+        self.schedules.Add('always', ['* 0000-2400'])
+        for day in schedule.DAYS:
+            self.assertEqual(day in ('fri', 'sat', 'sun', 'mon'),
+                             self._Allowed('wrap', day, 1230))
+            self.assertTrue(self._Allowed('always', day, 1230))
+
+    def testErrors(self):
+        for windows in (['wed'], ['xyz 1000-1100'], ['wed 1000-1000'],
+                        ['wed 10:00-11:00'], ['wed 2500-2600'], ['wed 2300-2401']):
+            self.assertRaises(schedule.ScheduleError, self.schedules.Add, 'bad', windows)
+        self.assertRaises(schedule.ScheduleError, self.schedules.Add, 'bad name', ['wed 1000-1100'])
+        self.assertRaises(schedule.ScheduleError, self.schedules.Compile, 'workday,nope')
+
+    def testMinuteOfWeek(self):
+        # Monday, January 4th 2016, 01:02 local time.
+        now = time.mktime((2016, 1, 4, 1, 2, 0, 0, 0, -1))
+        self.assertEqual(62, schedule.MinuteOfWeek(now))
+
+
+if __name__ == '__main__':
+    unittest.main()
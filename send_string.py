@@ -1,27 +1,153 @@
 #!/usr/bin/env python
-# Sends a string over TCP connection.
+# Sends strings over a TCP connection, in the background.
 
 from __future__ import print_function
 
+import collections
+import select
 import socket
+import threading
+import time
 
 class SendString(object):
-    """Class that sends strings over a TCP connection."""
+    """Class that sends strings over a TCP connection.
 
-    def __init__(self, host, port):
+    Send() only queues the string and returns right away. A background thread
+    delivers queued strings, newline-terminated, over one persistent
+    connection that is re-established when it breaks. If the queue is full,
+    the oldest queued string is dropped to make room for the new one.
+    """
+
+    def __init__(self, host, port, queue_size=16, connect_timeout=2,
+                 send_timeout=2, retry_delay=5):
+        """Constructor.
+
+        Args:
+          host: str, host to connect to.
+          port: int, port to connect to.
+          queue_size: int, max number of strings waiting to be sent.
+          connect_timeout: float, seconds to wait for the connection.
+          send_timeout: float, seconds to wait for a send to complete.
+          retry_delay: float, seconds to wait before reconnecting after a
+              failed connection attempt. Strings sent meanwhile are counted as
+              failed.
+        """
         self._host = host
         self._port = port
+        self._queue_size = queue_size
+        self._connect_timeout = connect_timeout
+        self._send_timeout = send_timeout
+        self._retry_delay = retry_delay
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._sock = None
+        # time.time() before which we don't try to reconnect.
+        self._next_connect = 0
+
+        # Counters, see GetStats().
+        self._sent = 0
+        self._dropped = 0
+        self._failed = 0
+
+        self._thread = threading.Thread(target=self._Run, name='send-string')
+        self._thread.daemon = True
+        self._thread.start()
 
     def Send(self, what):
+        """Queues a string for sending. Never blocks on the network."""
+        with self._cond:
+            if len(self._queue) >= self._queue_size:
+                self._queue.popleft()
+                self._dropped += 1
+            self._queue.append(what)
+            self._cond.notify()
+
+    def GetStats(self):
+        """Returns a dict with sent, dropped, failed and queued counts."""
+        with self._cond:
+            return {
+                'sent': self._sent,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'queued': len(self._queue),
+            }
+
+    def Close(self):
+        """Sends what is still queued, then closes the connection."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _Run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if not self._queue:
+                    break
+                what = self._queue.popleft()
+            delivered = self._Deliver(what)
+            with self._cond:
+                if delivered:
+                    self._sent += 1
+                else:
+                    self._failed += 1
+        self._Disconnect()
+
+    def _Deliver(self, what):
+        """Sends one string, reconnecting once if the connection went stale."""
+        self._CheckConnection()
+        for _ in xrange(2):
+            if self._sock is None and not self._Connect():
+                return False
+            try:
+                self._sock.sendall(what + '\n')
+                return True
+            except socket.error, e:
+                print('Socket comms failed: %s' % e)
+                self._Disconnect()
+        return False
+
+    def _Connect(self):
+        if time.time() < self._next_connect:
+            return False
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((self._host, self._port))
-            s.send(what)
-            s.close()
+            self._sock = socket.create_connection(
+                    (self._host, self._port), self._connect_timeout)
+            self._sock.settimeout(self._send_timeout)
+            return True
         except socket.error, e:
             print('Socket comms failed: %s' % e)
+            self._sock = None
+            self._next_connect = time.time() + self._retry_delay
+            return False
+
+    def _Disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+            self._sock = None
+
+    def _CheckConnection(self):
+        """Drops the connection if the peer has closed it."""
+        if self._sock is None:
+            return
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if readable:
+            try:
+                if not self._sock.recv(4096):
+                    self._Disconnect()
+            except socket.error:
+                self._Disconnect()
 
 
 if __name__ == '__main__':
     s = SendString('192.168.1.17', 4000)
     s.Send('foo')
+    s.Close()
+    print(s.GetStats())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import socket
+import threading
+import time
+import unittest
+
+# Local imports.
+import send_string
+
+
+class TestSendString(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def testPersistentConnection(self):
+        sender = send_string.SendString('127.0.0.1', self.port)
+        sender.Send('one')
+        sender.Send('two')
+        conn, _ = self.listener.accept()
+        sender.Close()
+        received = ''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            received += data
+        conn.close()
+        # Both strings went over the same connection.
+        self.assertEqual('one\ntwo\n', received)
+        self.assertEqual(2, sender.GetStats()['sent'])
+
+    def testServerDown(self):
+        self.listener.close()
+        sender = send_string.SendString('127.0.0.1', self.port, retry_delay=60)
+        start = time.time()
+        for _ in xrange(10):
+            sender.Send('hello')
+        self.assertLess(time.time() - start, 0.05)
+        sender.Close()
+        stats = sender.GetStats()
+        self.assertEqual(0, stats['sent'])
+        self.assertEqual(10, stats['failed'] + stats['dropped'])
+
+    def testDropOldest(self):
+        sender = send_string.SendString('127.0.0.1', self.port, queue_size=2)
+        delivered = []
+        unblock = threading.Event()
+
+        def _SlowDeliver(what):
+            unblock.wait()
+            delivered.append(what)
+            return True
+        sender._Deliver = _SlowDeliver
+
+        sender.Send('first')
+        # Give the worker time to pick up the first string.
+        time.sleep(0.1)
+        for what in ('a', 'b', 'c', 'd'):
+            sender.Send(what)
+        unblock.set()
+        sender.Close()
+        self.assertEqual(['first', 'c', 'd'], delivered)
+        stats = sender.GetStats()
+        self.assertEqual(2, stats['dropped'])
+        self.assertEqual(3, stats['sent'])
+
+
+if __name__ == '__main__':
+    unittest.main()
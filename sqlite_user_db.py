@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+#
+# User database kept in SQLite, with the same interface as user_db.UserDb.
+#
+# Users are rows of an indexed table, so lookups don't need the whole
+# database in memory, and adding a user is one small transaction instead of a
+# rewrite of the whole file. The text format stays the way to view and edit
+# the database: the text itself is kept as a sequence of chunks (what
+# ReplaceUserDatabase saved, plus one record per AddUser call), so comments
+# and formatting survive a round trip through /edit. The schedules of the
+# [times] section are kept in a table of their own, and compiled when the
+# database is opened.
+#
+# Select it with --user_db=sqlite:<path>. To migrate an existing database,
+# paste it into /edit, or run
+#
+#   sqlite_user_db.py --backup_dir <dir> import <sqlite file> <text file>
+
+from __future__ import print_function
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+
+# Local imports.
+import backup_store
+import durable_io
+import schedule
+import user_db
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    rfid TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    user TEXT,
+    password TEXT,
+    admin TEXT,
+    time TEXT,
+    -- Lowercase username, only set for users that can log in.
+    login TEXT,
+    doors TEXT
+);
+CREATE INDEX IF NOT EXISTS users_login ON users (login);
+CREATE TABLE IF NOT EXISTS schedules (
+    name TEXT PRIMARY KEY,
+    -- Window specs, one per line.
+    windows TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS text (
+    id INTEGER PRIMARY KEY,
+    chunk TEXT NOT NULL,
+    -- Whether the text ends in the [users] section after this chunk.
+    in_users INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+_INSERT_USER = 'INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+# PRAGMA synchronous for each durability level. In WAL mode, NORMAL only
+# risks the last transactions on power loss, never the consistency of the
+# database.
+_SYNCHRONOUS = {
+    durable_io.NONE: 'OFF',
+    durable_io.DATA: 'NORMAL',
+    durable_io.FULL: 'FULL',
+}
+
+
+def _ToRow(user):
+    """Returns a row of the users table for a user_db.User."""
+    login = user.user.lower() if user.user and user.password else None
+    return (user.rfid, user.name, user.user, user.password, user.admin, user.time, login,
+            user.doors)
+
+
+class SqliteUserDb(object):
+    """Class keeping track of users, in an SQLite database."""
+
+    def __init__(self, db_file, backup_dir, durability=durable_io.FULL, read_only=False):
+        """Constructor.
+
+        Args:
+            db_file: str, path of the SQLite database. Created if missing.
+            backup_dir: str, directory to keep backups in. Must exist, unless
+                read_only.
+            durability: str, one of durable_io.LEVELS.
+            read_only: bool, if True, only look users up. Changes raise
+                UserDbError. See user_db.UserDb.
+        """
+        # Expand '~/'.
+        self._db_file = os.path.expanduser(db_file)
+        self._read_only = read_only
+
+        durable_io.CheckLevel(durability)
+        if read_only:
+            self._backup_dir = None
+            self._backups = None
+        else:
+            # Expand '~/'.
+            self._backup_dir = os.path.expanduser(backup_dir)
+            if not os.path.isdir(self._backup_dir):
+                raise ValueError('Backup directory "%s" does not exist!' % self._backup_dir)
+            self._backups = backup_store.BackupStore(self._backup_dir,
+                                                     durability=durability)
+        # Digest of the backup of the current content, if we wrote it.
+        # Additions are backed up as deltas on top of it.
+        self._backup_digest = None
+
+        # The connection is shared by all threads, one at a time.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_file, check_same_thread=False)
+        self._conn.text_factory = str
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=%s' % _SYNCHRONOUS[durability])
+        self._conn.executescript(_SCHEMA)
+        self._Migrate()
+        with self._conn:
+            if (not read_only and
+                self._conn.execute('SELECT COUNT(*) FROM text').fetchone()[0] == 0):
+                self._conn.execute('INSERT INTO text (chunk) VALUES (?)',
+                                   ('# User database.\n',))
+        # Changes whenever another connection commits. If it did, our last
+        # backup and schedules no longer match the database.
+        self._data_version = self._DataVersion()
+        # schedule.Schedules, with every time= value in use compiled.
+        self._schedules = self._LoadSchedules()
+
+    def _Migrate(self):
+        """Adds columns that databases created by older versions lack."""
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(users)')]
+        if 'doors' not in columns:
+            with self._conn:
+                self._conn.execute('ALTER TABLE users ADD COLUMN doors TEXT')
+
+    def _CheckWritable(self):
+        if self._read_only:
+            raise user_db.UserDbError('User database is read-only')
+
+    def _DataVersion(self):
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _LoadSchedules(self):
+        """Reads and compiles the schedules. Needs the lock."""
+        schedules = schedule.Schedules()
+        for name, windows in self._conn.execute('SELECT name, windows FROM schedules'):
+            schedules.Add(name, windows.splitlines())
+        for value, in self._conn.execute(
+                'SELECT DISTINCT time FROM users WHERE time IS NOT NULL'):
+            schedules.Compile(value)
+        return schedules
+
+    def _SaveSchedules(self, schedules):
+        """Replaces the schedules table. Needs the lock, within a transaction."""
+        self._conn.execute('DELETE FROM schedules')
+        self._conn.executemany('INSERT INTO schedules VALUES (?, ?)',
+                               [(name, '\n'.join(windows))
+                                for name, windows in schedules.Items()])
+
+    def _Export(self):
+        """Returns the database in the text format. Needs the lock."""
+        return ''.join(chunk for chunk, in self._conn.execute(
+                'SELECT chunk FROM text ORDER BY id'))
+
+    def _LastChunk(self):
+        """Returns (chunk, in_users) for the end of the text. Needs the lock."""
+        row = self._conn.execute(
+                'SELECT chunk, in_users FROM text ORDER BY id DESC LIMIT 1').fetchone()
+        return (row[0], bool(row[1])) if row else ('', True)
+
+    def _CheckExternalChanges(self):
+        """Catches up if someone else changed the database. Needs the lock."""
+        data_version = self._DataVersion()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._backup_digest = None
+            self._schedules = self._LoadSchedules()
+
+    def AuthorizeUser(self, user, password):
+        """Checks whether given user/password combo is valid.
+
+        Args:
+            user: str, user name
+            password: str, raw password (before sha1-ing)
+
+        Returns:
+            (authorized, admin), where:
+                authorized: bool, whether the user is authorized
+                admin: str or None. If str, contents of 'admin' value
+        """
+        if not user or not password:
+            return (False, None)
+        with self._lock:
+            rows = self._conn.execute(
+                    'SELECT password, admin FROM users WHERE login = ? '
+                    'ORDER BY rowid', (user.lower(),)).fetchall()
+        # Any of the passwords of a login used more than once is fine.
+        for password_digest, admin in rows:
+            if user_db._CheckPassword(password_digest, password):
+                return (True, admin)
+        return (False, None)
+
+    def AuthorizeRfidTag(self, rfid, now=None, door=None):
+        """Checks whether given RFID tag is authorized.
+
+        Args:
+            rfid: string, RFID serial number.
+            now: float, time of the swipe, defaults to now.
+            door: str, name of the door the tag was read at, if known.
+
+        Returns:
+           (authorized, name) tuple, where:
+             authorized: bool, whether the user is authorized. False for
+               known users outside of their time windows, or at a door
+               they don't have access to.
+             name: str or None. If str, name associated with RFID tag.
+        """
+        with self._lock:
+            self._CheckExternalChanges()
+            row = self._conn.execute('SELECT name, time, doors FROM users WHERE rfid = ?',
+                                     (rfid.lower(),)).fetchone()
+            schedules = self._schedules
+        if row is None:
+            return (False, None)
+        name, time_value, doors = row
+        if not user_db._DoorAllowed(doors, door):
+            return (False, name)
+        if time_value and not schedules.IsAllowed(
+                time_value, schedule.MinuteOfWeek(now)):
+            return (False, name)
+        return (True, name)
+
+    def AddUser(self, rfid, name, admin_user):
+        """Adds a new user to the database, in a single transaction."""
+        self._CheckWritable()
+        line, user = user_db._MakeUserLine(rfid, name)
+        with self._lock:
+            self._CheckExternalChanges()
+            with self._conn:
+                if self._conn.execute('SELECT 1 FROM users WHERE rfid = ?',
+                                      (user.rfid,)).fetchone():
+                    raise user_db.UserDbError('RFID tag already exists in database')
+                tail, in_users = self._LastChunk()
+                record = user_db._FormatRecord(tail, in_users, 'Added', admin_user, [line])
+                self._conn.execute(_INSERT_USER, _ToRow(user))
+                self._conn.execute('INSERT INTO text (chunk) VALUES (?)', (record,))
+            self._backup_digest = self._backups.Append(
+                    self._backup_digest, self._Export, record)
+
+    def AddUsers(self, rows, admin_user):
+        """Adds many users to the database in a single transaction.
+
+        See user_db.UserDb.AddUsers.
+        """
+        self._CheckWritable()
+        with self._lock:
+            self._CheckExternalChanges()
+            with self._conn:
+                known = set(rfid for rfid, in self._conn.execute('SELECT rfid FROM users'))
+                new_users, schedules = user_db._MakeImportLines(
+                        rows, known, self._schedules)
+                tail, in_users = self._LastChunk()
+                records = user_db._FormatRecord(tail, in_users, 'Imported', admin_user,
+                                                [line for line, _ in new_users])
+                self._conn.executemany(_INSERT_USER,
+                                       [_ToRow(user) for _, user in new_users])
+                self._conn.execute('INSERT INTO text (chunk) VALUES (?)', (records,))
+            self._schedules = schedules
+            self._backup_digest = self._backups.Save(self._Export())
+        return len(new_users)
+
+    def GetUserDatabase(self):
+        """Returns the user database in the text format."""
+        with self._lock:
+            return self._Export()
+
+    def ReplaceUserDatabase(self, new_users_raw):
+        """Replaces the user database with a new one, in the text format."""
+        self._CheckWritable()
+        # First, make sure we can parse the new database. If we can't, this will raise.
+        db = user_db._ParseDatabase(new_users_raw)
+        # As a sanity check, make sure there is at least one user in the new parsed data.
+        if not db.users:
+            raise user_db.UserDbError('New user database should include at least one record')
+
+        with self._lock:
+            self._CheckExternalChanges()
+            self._backup_digest = self._backups.Save(new_users_raw)
+            with self._conn:
+                self._conn.execute('DELETE FROM users')
+                self._conn.execute('DELETE FROM text')
+                self._conn.executemany(
+                        _INSERT_USER, [_ToRow(user) for user in db.users.itervalues()])
+                self._SaveSchedules(db.schedules)
+                self._conn.execute('INSERT INTO text (chunk, in_users) VALUES (?, ?)',
+                                   (new_users_raw, db.in_users))
+            self._schedules = db.schedules
+
+    def ListBackups(self):
+        """Returns backups as backup_store.Backup tuples, newest first."""
+        self._CheckWritable()
+        return self._backups.List()
+
+    def DiffBackup(self, digest):
+        """Returns a unified diff from a backup to the current database."""
+        self._CheckWritable()
+        try:
+            return self._backups.Diff(digest, self.GetUserDatabase())
+        except backup_store.BackupStoreError, e:
+            raise user_db.UserDbError(str(e))
+
+    def RestoreBackup(self, digest):
+        """Replaces the user database with a backup."""
+        self._CheckWritable()
+        try:
+            blob = self._backups.Get(digest)
+        except backup_store.BackupStoreError, e:
+            raise user_db.UserDbError(str(e))
+        self.ReplaceUserDatabase(blob)
+
+    def Close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def Main():
+    parser = argparse.ArgumentParser(
+            description='Copies a user database between the text format and SQLite.')
+    parser.add_argument('--backup_dir', required=True,
+                        help='User database backup directory')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('db_file', help='SQLite database')
+    parser.add_argument('text_file', nargs='?', default='-',
+                        help='Text database to import from or export to (default: stdio)')
+    args = parser.parse_args()
+
+    users = SqliteUserDb(args.db_file, args.backup_dir)
+    if args.command == 'import':
+        if args.text_file == '-':
+            users.ReplaceUserDatabase(sys.stdin.read())
+        else:
+            with open(args.text_file) as fh:
+                users.ReplaceUserDatabase(fh.read())
+    elif args.text_file == '-':
+        sys.stdout.write(users.GetUserDatabase())
+    else:
+        durable_io.WriteAtomically(args.text_file, users.GetUserDatabase())
+    users.Close()
+
+
+if __name__ == '__main__':
+    Main()
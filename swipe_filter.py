@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# Filtering stage between the tag decoder and the tag seen handler.
+#
+# Wiegand readers send a card's code several times while it is held in
+# front of them. Without a filter, every copy means an unlock, an
+# announcement and a log line. SwipeFilter drops frames that fail validation,
+# and repeats of the last code read by the same reader within a short window.
+#
+# Frames of the lengths in wiegand.FORMATS are parity checked, all others are
+# passed on as they are, whatever reader is installed. Restricting the lengths
+# is opt-in; rejected lengths are counted per length and printed.
+
+from __future__ import print_function
+
+import threading
+import time
+
+# Local imports.
+import wiegand
+
+
+def ParseLengths(value):
+    """Parses a --wiegand_lengths flag.
+
+    Args:
+        value: str, comma separated frame lengths in bits, or '' for all.
+
+    Returns:
+        tuple of ints, or None for all lengths.
+    """
+    if not value.strip():
+        return None
+    return tuple(int(n) for n in value.split(','))
+
+
+class SwipeFilter(object):
+    """Validates and deduplicates reads before passing them on."""
+
+    def __init__(self, handler, window=1.0, lengths=None):
+        """Constructor.
+
+        Args:
+            handler: function called with the code of each accepted read, and
+                the facility and card numbers as keyword arguments for
+                frames of wiegand.FORMATS.
+            window: float, seconds during which repeats of the last code of a
+                reader are dropped. The window restarts with every repeat, so
+                a card held in front of the reader is only accepted once.
+            lengths: accepted frame lengths in bits, or None for all of them.
+                Lengths of wiegand.FORMATS are parity checked, others are
+                passed on as they are.
+        """
+        self._handler = handler
+        self._window = window
+        self._lengths = frozenset(lengths) if lengths is not None else None
+        self._lock = threading.Lock()
+        # Maps readers to (last code, time of last read).
+        self._last = {}
+        self._stats = dict(forwarded=0, duplicate=0, bad_length=0, bad_parity=0)
+
+    def ReadFrame(self, bits, value, reader=None, now=None, **details):
+        """Handles a raw Wiegand frame.
+
+        Args:
+            bits: int, frame length.
+            value: int, the frame.
+            reader, now, details: see ReadCode().
+
+        Returns:
+            bool, whether the read was passed on.
+        """
+        if self._lengths is not None and bits not in self._lengths:
+            self._RejectLength(bits)
+            return False
+        if bits in wiegand.FORMATS:
+            try:
+                card = wiegand.Decode(bits, value)
+            except wiegand.WiegandError:
+                self._Count('bad_parity')
+                return False
+            details.update(facility=card.facility, card=card.card)
+        return self.ReadCode('%s' % value, reader, now, **details)
+
+    def ReadCode(self, rfid, reader=None, now=None, **details):
+        """Handles an already decoded code.
+
+        Args:
+            rfid: str, the code.
+            reader: the reader it was read by, for deduplication.
+            now: float, time of the read, defaults to now.
+            details: passed on to the handler as keyword arguments, e.g.
+                facility and card of a Wiegand frame.
+
+        Returns:
+            bool, whether the read was passed on.
+        """
+        now = now or time.time()
+        with self._lock:
+            last = self._last.get(reader)
+            self._last[reader] = (rfid, now)
+            if last is not None and last[0] == rfid and now - last[1] < self._window:
+                self._stats['duplicate'] += 1
+                return False
+            self._stats['forwarded'] += 1
+        self._handler(rfid, **details)
+        return True
+
+    def _Count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _RejectLength(self, bits):
+        counter = 'bad_length_%d' % bits
+        with self._lock:
+            self._stats['bad_length'] += 1
+            first = counter not in self._stats
+            self._stats[counter] = self._stats.get(counter, 0) + 1
+        if first:
+            print('Dropping %d bit frames, not in the accepted lengths %s' % (
+                    bits, ','.join(str(n) for n in sorted(self._lengths))))
+
+    def GetStats(self):
+        """Returns a dict of counters: forwarded, duplicate, bad_length, bad_parity.
+
+        Plus bad_length_<bits> for each length that was rejected.
+        """
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import unittest
+
+# Local imports.
+import swipe_filter
+import wiegand
+
+
+class TestSwipeFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.seen = []
+        self.details = []
+        self.filter = swipe_filter.SwipeFilter(self._Handler, window=1.0,
+                                               lengths=(26, 34, 32))
+
+    def _Handler(self, rfid, **details):
+        self.seen.append(rfid)
+        self.details.append(details)
+
+    def testDuplicates(self):
+        value = wiegand.Encode(26, 12, 3456)
+        # A held card: repeats keep being dropped as long as they keep coming.
+        for i in xrange(10):
+            self.filter.ReadFrame(26, value, now=1000 + i * 0.5)
+        # Another reader, and later on the same one.
+        self.filter.ReadFrame(26, value, reader='back', now=1001)
+        self.filter.ReadFrame(26, value, now=1010)
+        # Alternating cards aren't repeats.
+        self.filter.ReadCode('abcd', now=1010.1)
+        self.filter.ReadFrame(26, value, now=1010.2)
+        self.assertEqual([str(value)] * 3 + ['abcd', str(value)], self.seen)
+        self.assertEqual(dict(facility=12, card=3456), self.details[0])
+        self.assertEqual({}, self.details[3])
+        self.assertEqual(dict(forwarded=5, duplicate=9, bad_length=0, bad_parity=0),
+                         self.filter.GetStats())
+
+    def testValidation(self):
+        value = wiegand.Encode(34, 1, 2)
+        self.assertFalse(self.filter.ReadFrame(34, value ^ 1))
+        self.assertFalse(self.filter.ReadFrame(34, value ^ (1 << 20)))
+        self.assertFalse(self.filter.ReadFrame(37, wiegand.Encode(37, 1, 2)))
+        self.assertFalse(self.filter.ReadFrame(4, 5))
+        self.assertEqual([], self.seen)
+        self.assertTrue(self.filter.ReadFrame(34, value))
+        # Configured lengths without a known format aren't checked.
+        self.assertTrue(self.filter.ReadFrame(32, 0xdeadbeef))
+        self.assertEqual([dict(facility=1, card=2), {}], self.details)
+        self.assertEqual(dict(forwarded=2, duplicate=0, bad_length=2, bad_parity=2,
+                              bad_length_37=1, bad_length_4=1),
+                         self.filter.GetStats())
+
+    def testAllLengths(self):
+        # By default, frames of any length are passed on, as readers send
+        # them; only known formats are parity checked.
+        self.filter = swipe_filter.SwipeFilter(self._Handler)
+        self.assertTrue(self.filter.ReadFrame(35, 0x123456789))
+        self.assertTrue(self.filter.ReadFrame(40, 0x12345678ab))
+        self.assertFalse(self.filter.ReadFrame(26, wiegand.Encode(26, 1, 2) ^ 1))
+        self.assertEqual([str(0x123456789), str(0x12345678ab)], self.seen)
+        self.assertEqual(dict(forwarded=2, duplicate=0, bad_length=0, bad_parity=1),
+                         self.filter.GetStats())
+
+    def testParseLengths(self):
+        self.assertIsNone(swipe_filter.ParseLengths(''))
+        self.assertEqual((26, 35), swipe_filter.ParseLengths('26,35'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+#
+# Rate limiting for unknown RFID tags.
+#
+# A broken or unknown tag lying next to the reader gets read over and over.
+# Without a filter, every read means a user database lookup, a log line and a
+# dashboard update. UnknownTagFilter remembers unknown tags for a short time
+# (a negative cache): repeated reads are only counted, in memory, and
+# reported as a single "seen N times in T seconds" record when the entry
+# expires.
+#
+# It can also guard against brute-force scanning: if too many different
+# unknown tags show up within a short window, the reader is locked out for a
+# while, and all tags, known or not, are ignored. That lets anyone with a
+# handful of cheap tags keep members out, so the lockout is off unless a
+# limit is given.
+
+import collections
+import threading
+import time
+
+# Decisions of UnknownTagFilter.Check().
+LOOKUP = 'lookup'
+SUPPRESS = 'suppress'
+LOCKED_OUT = 'locked_out'
+
+
+class UnknownTagFilter(object):
+    """Negative cache and brute-force lockout for unknown tags.
+
+    Usage, for each read:
+
+        decision = tag_filter.Check(rfid)
+        if decision == LOOKUP:
+            authorized, name = users.AuthorizeRfidTag(rfid)
+            if name is None:
+                tag_filter.AddUnknown(rfid)
+    """
+
+    def __init__(self, report, ttl=30, limit=0, window=60, lockout=60,
+                 max_entries=1000):
+        """Constructor.
+
+        Args:
+            report: function called with keyword arguments for a log record
+                (action='unknown_tag_repeat' or 'unknown_tag_lockout', ...),
+                e.g. LogWriter.Log.
+            ttl: float, seconds an unknown tag is remembered.
+            limit: int, lock the reader out once more than this many
+                different unknown tags were seen within window seconds. 0, the
+                default, disables the lockout.
+            window: float, see limit.
+            lockout: float, seconds to ignore all tags for.
+            max_entries: int, max number of unknown tags remembered. The
+                oldest ones are forgotten first.
+        """
+        self._report = report
+        self._ttl = ttl
+        self._limit = limit
+        self._window = window
+        self._lockout = lockout
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # Maps rfid to [first read, last read, suppressed reads], oldest
+        # first. Entries expire ttl seconds after their first read.
+        self._entries = collections.OrderedDict()
+        # Times of recent lookups of unknown tags, for the lockout.
+        self._recent = collections.deque()
+        # The reader is locked out until this time.
+        self._locked_until = 0
+        # Reads ignored during the current lockout.
+        self._locked_reads = 0
+
+    def Check(self, rfid, now=None):
+        """Decides what to do with a read.
+
+        Returns:
+            LOOKUP if the tag should be looked up as usual, SUPPRESS if it is
+            a known unknown tag, LOCKED_OUT if the reader is locked out.
+        """
+        now = now or time.time()
+        reports = []
+        with self._lock:
+            self._Expire(now, reports)
+            if now < self._locked_until:
+                self._locked_reads += 1
+                decision = LOCKED_OUT
+            else:
+                entry = self._entries.get(rfid.lower())
+                if entry is None:
+                    decision = LOOKUP
+                else:
+                    entry[1] = now
+                    entry[2] += 1
+                    decision = SUPPRESS
+        self._Report(reports)
+        return decision
+
+    def AddUnknown(self, rfid, now=None):
+        """Remembers that a tag isn't in the user database."""
+        now = now or time.time()
+        reports = []
+        with self._lock:
+            self._entries[rfid.lower()] = [now, now, 0]
+            while len(self._entries) > self._max_entries:
+                self._ReportEntry(self._entries.popitem(last=False), reports)
+            if self._limit:
+                self._recent.append(now)
+                while self._recent and self._recent[0] <= now - self._window:
+                    self._recent.popleft()
+                if len(self._recent) > self._limit:
+                    self._locked_until = now + self._lockout
+                    self._locked_reads = 0
+                    reports.append(dict(action='unknown_tag_lockout',
+                                        tags=len(self._recent), seconds=self._window,
+                                        lockout=self._lockout))
+                    self._recent.clear()
+        self._Report(reports)
+
+    def Clear(self):
+        """Forgets all unknown tags, e.g. after users were added."""
+        reports = []
+        with self._lock:
+            while self._entries:
+                self._ReportEntry(self._entries.popitem(last=False), reports)
+        self._Report(reports)
+
+    def _Expire(self, now, reports):
+        """Drops expired entries and ends the lockout. Needs the lock."""
+        while self._entries:
+            rfid, entry = next(self._entries.iteritems())
+            if entry[0] > now - self._ttl:
+                break
+            del self._entries[rfid]
+            self._ReportEntry((rfid, entry), reports)
+        if self._locked_until and now >= self._locked_until:
+            reports.append(dict(action='unknown_tag_lockout_end',
+                                ignored=self._locked_reads))
+            self._locked_until = 0
+
+    @staticmethod
+    def _ReportEntry(item, reports):
+        rfid, (first, last, count) = item
+        if count:
+            reports.append(dict(action='unknown_tag_repeat', rfid=rfid,
+                                count=count, seconds=round(last - first, 1)))
+
+    def _Report(self, reports):
+        # Outside of the lock, reporting may block on I/O.
+        for fields in reports:
+            self._report(**fields)
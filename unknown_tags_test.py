@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import unittest
+
+# Local imports.
+import unknown_tags
+
+
+class TestUnknownTagFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.reports = []
+        self.filter = unknown_tags.UnknownTagFilter(
+                lambda **fields: self.reports.append(fields),
+                ttl=30, limit=3, window=60, lockout=100)
+
+    def testNegativeCache(self):
+        self.assertEqual(unknown_tags.LOOKUP, self.filter.Check('abcd', 1000))
+        self.filter.AddUnknown('abcd', 1000)
+        for i in xrange(50):
+            self.assertEqual(unknown_tags.SUPPRESS, self.filter.Check('ABCD', 1001 + i * 0.5))
+        self.assertEqual(unknown_tags.LOOKUP, self.filter.Check('1111', 1010))
+        self.assertEqual([], self.reports)
+
+        # Expired: looked up again, and the repeats are reported once.
+        self.assertEqual(unknown_tags.LOOKUP, self.filter.Check('abcd', 1030))
+        self.assertEqual([{'action': 'unknown_tag_repeat', 'rfid': 'abcd',
+                           'count': 50, 'seconds': 25.5}], self.reports)
+
+    def testClear(self):
+        self.filter.AddUnknown('abcd', 1000)
+        self.filter.Check('abcd', 1001)
+        self.filter.Clear()
+        self.assertEqual(1, len(self.reports))
+        self.assertEqual(unknown_tags.LOOKUP, self.filter.Check('abcd', 1002))
+
+    def testLockout(self):
+        for i in xrange(3):
+            self.filter.AddUnknown('%04x' % i, 1000 + i)
+        self.assertEqual([], self.reports)
+        # Old lookups fall out of the window.
+        self.filter.AddUnknown('1000', 1061)
+        self.assertEqual([], self.reports)
+        self.filter.AddUnknown('1001', 1062)
+        self.filter.AddUnknown('1002', 1063)
+        self.assertEqual([], self.reports)
+        self.filter.AddUnknown('1003', 1064)
+        self.assertEqual('unknown_tag_lockout', self.reports[-1]['action'])
+
+        # Everything is ignored until the lockout ends.
+        for i in xrange(5):
+            self.assertEqual(unknown_tags.LOCKED_OUT, self.filter.Check('beef', 1100 + i))
+        self.assertEqual(unknown_tags.LOOKUP, self.filter.Check('beef', 1164))
+        self.assertEqual({'action': 'unknown_tag_lockout_end', 'ignored': 5},
+                         self.reports[-1])
+
+    def testLockoutOffByDefault(self):
+        tag_filter = unknown_tags.UnknownTagFilter(
+                lambda **fields: self.reports.append(fields))
+        for i in xrange(100):
+            tag_filter.AddUnknown('%04x' % i, 1000)
+        self.assertEqual(unknown_tags.LOOKUP, tag_filter.Check('abcd', 1001))
+
+    def testMaxEntries(self):
+        tag_filter = unknown_tags.UnknownTagFilter(
+                lambda **fields: self.reports.append(fields), limit=0, max_entries=2)
+        for i in xrange(100):
+            tag_filter.AddUnknown('%04x' % i, 1000)
+        self.assertEqual(unknown_tags.SUPPRESS, tag_filter.Check('%04x' % 99, 1001))
+        self.assertEqual(unknown_tags.LOOKUP, tag_filter.Check('0000', 1001))
+
+
+if __name__ == '__main__':
+    unittest.main()
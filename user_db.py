@@ -22,18 +22,33 @@
 #    "user": username for logging in
 #    "password": sha1 hash of the password (echo -n 'pwd' | sha1sum)
 #    "admin=yes": allow editing user database/adding new keys
+#    "doors": comma-separated doors the tag opens (see door_config), all
+#        doors if missing
 #
 # When new users are added by the system, they are appended to the
 # end of the file. To maintain comments and formatting, new users
-# are added as text to the end of the file and the file gets reparsed.
+# are added as text to the end of the file. In incremental mode (the
+# default), only the new record is appended and fsync-ed.
 #
-# Future ideas
-# ============
+# Writes are crash-safe: the database is replaced by writing a temp file,
+# fsync-ing it, renaming it over the old one and fsync-ing the directory (see
+# durable_io for the cheaper, less safe levels). On startup, leftovers of an
+# interrupted write are cleaned up and a corrupt file is restored from the
+# newest intact backup.
 #
-# Implement time-based access control. E.g., have a section in the file
-# that defines times, and then define allowed time periods per-user. This
-# would allow most users access during work nights, for example. Possible
-# format:
+# Every version of the database is backed up to a backup_store.BackupStore,
+# which stores each distinct content once, stores appended records as small
+# deltas, and thins out old backups.
+#
+# The same interface is also implemented on top of SQLite, by
+# sqlite_user_db.SqliteUserDb; Instantiate() picks one by URI scheme.
+#
+# Time-based access control
+# =========================
+#
+# A [times] section defines named weekly schedules, and users with a time=
+# key may only get in during those (see schedule.py for the format). Lines
+# before the first section header are users. E.g.:
 #
 # [times]
 # workday:wed 1830-2300
@@ -44,19 +59,67 @@
 from __future__ import print_function
 
 import collections
+import csv
 import hashlib
+import hmac
 import os
 import re
-import shutil
+import threading
 import time
 
+# Local imports.
+import backup_store
+import durable_io
+import schedule
+
 
-User = collections.namedtuple('User', 'rfid name user password admin')
+User = collections.namedtuple('User', 'rfid name user password admin time doors')
 
 
 class UserDbError(Exception):
     """Failed to parse user file."""
-    pass
+
+    def __init__(self, message, diagnostics=None):
+        super(UserDbError, self).__init__(message)
+        # List of (line number, message) tuples, one per bad line, if known.
+        self.diagnostics = diagnostics or []
+
+
+# Valid (lowercase) RFID serial number.
+_RFID_RE = re.compile(r'^[a-f0-9]+$')
+
+# Template for the keyword arguments of User.
+_EMPTY_FIELDS = dict.fromkeys(User._fields)
+
+
+def _IsTruncated(raw):
+    """Returns whether only the last line of raw keeps it from parsing.
+
+    Lines are appended with their newline, so a last line without one that
+    fails to parse is what an append cut short by a power cut leaves. (Or a
+    typo on the last line of a file saved without a final newline, which
+    editors normally add.)
+    """
+    if raw.endswith('\n'):
+        return False
+    try:
+        _ParseDatabase(raw[:raw.rfind('\n') + 1])
+    except UserDbError:
+        return False
+    return True
+
+
+def _UnusedPath(path):
+    """Returns path, or path with a time suffix if it exists."""
+    if not os.path.exists(path):
+        return path
+    stamped = '%s.%s' % (path, time.strftime('%Y%m%d-%H%M%S'))
+    candidate = stamped
+    suffix = 0
+    while os.path.exists(candidate):
+        suffix += 1
+        candidate = '%s.%d' % (stamped, suffix)
+    return candidate
 
 
 def _ReadFileOrDefault(filename, default):
@@ -71,19 +134,31 @@ def _ReadFileOrDefault(filename, default):
 def _NormalizeRfid(rfid):
     """Normalizes and checks whether given RFID value is valid."""
     clean = rfid.strip().lower()
-    if re.match('^[a-f0-9]+$', clean):
+    if _RFID_RE.match(clean):
         return rfid
     if not rfid:
         raise UserDbError('RFID empty!')
     raise UserDbError('Invalid RFID: %s' % rfid)
 
 
+def _DoorAllowed(doors, door):
+    """Returns whether a doors= value gives access to door."""
+    if not doors or door is None:
+        return True
+    return door in [d.strip() for d in doors.split(',')]
+
+
+def _StripComment(orig_line):
+    """Returns the line without comments and surrounding whitespace."""
+    return orig_line.partition('#')[0].strip()
+
+
 def _ParseUserLine(line, orig_line):
     """Parses a single user database line."""
-    items = re.split('\s*:\s*', line)
+    items = [item.strip() for item in line.split(':')]
     if len(items) < 2:
         raise UserDbError('Failed to parse line: %s' % orig_line)
-    fields = dict((key, None) for key in User._fields)
+    fields = _EMPTY_FIELDS.copy()
     fields['rfid'] = _NormalizeRfid(items[0])
     fields['name'] = items[1]
 
@@ -92,52 +167,481 @@ def _ParseUserLine(line, orig_line):
 
     # Parse the rest of fields.
     for item in items[2:]:
-        if '=' not in item:
+        key, sep, value = item.partition('=')
+        if not sep:
             raise UserDbError('Failed to parse line: %s' % orig_line)
-        key, value = re.split('\s*=\s*', item, 1)
+        key = key.rstrip()
         # Make sure the field name is valid.
         if key not in fields:
             raise UserDbError('Invalid key "%s" in line: %s' % (key, orig_line))
-        fields[key] = value
+        fields[key] = value.lstrip()
 
     return User(**fields)
 
 
-def _ParseUsers(blob):
-    """Parses a blob of text into User instances.
+def _ParseRawLine(orig_line):
+    """Parses one raw line of the user database.
 
-    Resulting dict maps lowercase RFID serial numbers to User instances.
+    Returns:
+        User instance, or None if the line is empty or a comment.
     """
-    users = {}
-    for orig_line in blob.splitlines():
-        line = orig_line.strip()
-        # Strip off comments.
-        line = re.sub('\s*#.*$', '', line)
+    line = _StripComment(orig_line)
+    if not line:
+        # Empty line or comment only.
+        return None
+    return _ParseUserLine(line, orig_line)
+
+
+# Parsed user database:
+#   users: OrderedDict mapping lowercase RFID serial numbers to User
+#       instances, in file order.
+#   schedules: schedule.Schedules, with every time= value in use compiled.
+#   in_users: bool, whether the text ends in the [users] section, i.e.
+#       whether user lines can be appended without a section header.
+_Database = collections.namedtuple('_Database', 'users schedules in_users')
+
+_SECTIONS = ('times', 'users')
+
+
+def _ParseDatabase(blob):
+    """Parses a blob of text into a _Database.
+
+    Lines before the first section header are users.
+
+    Raises:
+        UserDbError: if any line fails to parse, or a user refers to a
+            schedule that isn't defined. Its diagnostics list every bad line,
+            not just the first one.
+    """
+    users = collections.OrderedDict()
+    schedules = schedule.Schedules()
+    # (line number, User) for users with a time= key.
+    timed = []
+    diagnostics = []
+    section = 'users'
+    for number, orig_line in enumerate(blob.splitlines(), 1):
+        line = _StripComment(orig_line)
         if not line:
             # Empty line or comment only.
             continue
-        parsed = _ParseUserLine(line, orig_line)
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip().lower()
+            if section not in _SECTIONS:
+                diagnostics.append((number, 'Unknown section: %s' % line))
+            continue
+        try:
+            if section == 'times':
+                items = line.split(':')
+                if len(items) < 2:
+                    raise UserDbError('Failed to parse line: %s' % orig_line)
+                schedules.Add(items[0].strip(), items[1:])
+                continue
+            parsed = _ParseUserLine(line, orig_line)
+        except (UserDbError, schedule.ScheduleError), e:
+            diagnostics.append((number, str(e)))
+            continue
         users[parsed.rfid] = parsed
-    return users
+        if parsed.time:
+            timed.append((number, parsed))
+    # Schedules may be defined after the users that refer to them.
+    for number, user in timed:
+        try:
+            schedules.Compile(user.time)
+        except schedule.ScheduleError, e:
+            diagnostics.append((number, str(e)))
+    if diagnostics:
+        diagnostics.sort()
+        raise UserDbError(
+                '\n'.join('Line %d: %s' % d for d in diagnostics), diagnostics)
+    return _Database(users, schedules, section == 'users')
+
+
+def _ParseUsers(blob):
+    """Parses a blob of text into User instances.
+
+    Resulting dict maps lowercase RFID serial numbers to User instances.
+
+    Raises:
+        UserDbError: if any line fails to parse.
+    """
+    return _ParseDatabase(blob).users
+
+
+def ParseImport(blob, fmt='auto'):
+    """Splits a bulk import into rows of fields, for UserDb.AddUsers.
+
+    Args:
+        blob: str, either CSV (rfid,name[,key=value...], with an optional
+            "rfid,name" header line) or the native colon-delimited format.
+        fmt: str, 'csv', 'native' or 'auto'. With 'auto', the blob is taken to
+            be in the native format if any non-comment line has a colon in it.
+
+    Returns:
+        List of (line number, list of fields) tuples. Blank lines and comments
+        are skipped.
+    """
+    lines = []
+    for number, orig_line in enumerate(blob.splitlines(), 1):
+        line = _StripComment(orig_line)
+        if line:
+            lines.append((number, line))
+
+    if fmt == 'auto':
+        fmt = 'native' if any(':' in line for _, line in lines) else 'csv'
+    if fmt == 'native':
+        return [(number, line.split(':')) for number, line in lines]
+    if fmt != 'csv':
+        raise UserDbError('Unknown import format: %s' % fmt)
+
+    rows = []
+    for number, line in lines:
+        fields = next(csv.reader([line]))
+        if not rows and [f.strip().lower() for f in fields[:2]] == ['rfid', 'name']:
+            # Header line.
+            continue
+        rows.append((number, fields))
+    return rows
+
+
+# Everything the readers need, swapped in as a single object so that a
+# reader never sees the raw text of one version of the database together with
+# the parsed users of another.
+_Snapshot = collections.namedtuple(
+        '_Snapshot', 'raw users users_by_name schedules in_users')
+
+
+def _IndexUsernames(users):
+    """Builds a map from lowercase usernames to tuples of User instances.
+
+    Only users that can log in (have both a username and a password) are
+    included. A username that occurs more than once maps to all its users,
+    in the order of users, and any of their passwords logs in.
+    """
+    index = {}
+    for u in users.itervalues():
+        if u.user and u.password:
+            index[u.user.lower()] = index.get(u.user.lower(), ()) + (u,)
+    return index
+
+
+def _MakeSnapshot(raw, db):
+    """Returns a _Snapshot of the raw database and its parsed _Database."""
+    return _Snapshot(raw, db.users, _IndexUsernames(db.users), db.schedules, db.in_users)
+
+
+def _CheckPassword(expected_digest, password):
+    """Returns whether password hashes to expected_digest, in constant time."""
+    digest = hashlib.sha1(password).hexdigest().lower()
+    return hmac.compare_digest(expected_digest, digest)
+
+
+def _MakeUserLine(rfid, name):
+    """Returns (line, User) for a new user, checking that it reads back."""
+    rfid = _NormalizeRfid(rfid)
+    name = name.replace(':', '')  # strip out colons.
+    if not rfid or not name:
+        raise UserDbError('RFID or name not provided')
+    line = '%s:%s' % (rfid, name)
+    # Make sure the record reads back the same way before writing it.
+    user = _ParseRawLine(line)
+    if user is None:
+        raise UserDbError('Failed to parse line: %s' % line)
+    return line, user
+
+
+def _MakeImportLines(rows, known, schedules):
+    """Validates rows to import, see UserDb.AddUsers.
+
+    Args:
+        rows: iterable of (line number, fields) tuples.
+        known: container of the RFID serial numbers already in the database.
+        schedules: schedule.Schedules of the database. Left untouched,
+            readers may be using it.
+
+    Returns:
+        (list of (line, User) tuples, copy of schedules with the time=
+        values of the new users compiled).
+
+    Raises:
+        UserDbError: listing every invalid row.
+    """
+    errors = []
+    result = []
+    added = set()
+    schedules = schedules.Copy()
+    for number, fields in rows:
+        fields = [f.strip() for f in fields]
+        try:
+            if len(fields) < 2:
+                raise UserDbError('Failed to parse line: %s' % ':'.join(fields))
+            rfid = _NormalizeRfid(fields[0])
+            name = fields[1].replace(':', '')  # strip out colons.
+            for field in fields[2:]:
+                if ':' in field:
+                    raise UserDbError('Invalid field: %s' % field)
+            line = ':'.join([rfid, name] + fields[2:])
+            user = _ParseRawLine(line)
+            if user is None:
+                raise UserDbError('Failed to parse line: %s' % line)
+            if user.rfid in known or user.rfid in added:
+                raise UserDbError('RFID tag already exists in database: %s' % user.rfid)
+            if user.time:
+                schedules.Compile(user.time)
+        except (UserDbError, schedule.ScheduleError), e:
+            errors.append('Line %d: %s' % (number, e))
+            continue
+        added.add(user.rfid)
+        result.append((line, user))
+
+    if errors:
+        raise UserDbError('\n'.join(errors))
+    if not result:
+        raise UserDbError('Nothing to import')
+    return result, schedules
+
+
+def _FormatRecord(raw_tail, in_users, action, admin_user, lines):
+    """Returns text to append for new users, with a comment saying who added them.
+
+    Args:
+        raw_tail: str, end of the current database, to tell whether it ends
+            with a newline.
+        in_users: bool, whether the database ends in the [users] section.
+        action: str, e.g. 'Added'.
+        admin_user: str, who is adding the users.
+        lines: list of str, user lines.
+    """
+    record = ''
+    if raw_tail and not raw_tail.endswith('\n'):
+        record += '\n'
+    if not in_users:
+        record += '[users]\n'
+    record += '# %s on %s by %s\n' % (
+            action, time.strftime('%Y-%m-%d %H:%M:%S'), admin_user)
+    record += ''.join(line + '\n' for line in lines)
+    return record
+
+
+def Instantiate(uri, backup_dir, **kwargs):
+    """Opens the user database at uri.
+
+    Args:
+        uri: str, 'sqlite:<path>' for an SQLite database (see sqlite_user_db),
+            or 'file:<path>' or a plain path for a text file. A '//' after the
+            scheme is skipped, so 'sqlite:///var/lib/users.sqlite' works too.
+        backup_dir: str, directory to keep backups in. Must exist, unless
+            read_only is passed.
+        kwargs: passed on to the constructor of the backend.
+    """
+    scheme, sep, path = uri.partition(':')
+    if not sep or scheme not in ('file', 'sqlite'):
+        return UserDb(uri, backup_dir, **kwargs)
+    if path.startswith('//'):
+        path = path[2:]
+    if scheme == 'sqlite':
+        import sqlite_user_db
+        return sqlite_user_db.SqliteUserDb(path, backup_dir, **kwargs)
+    return UserDb(path, backup_dir, **kwargs)
 
 
 class UserDb(object):
-    """Class keeping track of users."""
+    """Class keeping track of users.
+
+    The database file may be edited by another process. Reads check (at most
+    once every reload_interval seconds) whether the file's inode, size or
+    modification time changed, and if so, swap in a freshly parsed snapshot.
+    Snapshots are never modified once published, so readers on other threads
+    always see a consistent view without taking any locks. Writers (including
+    reloads) are serialized by a single lock and publish a new snapshot with
+    one attribute assignment.
+    """
+
+    def __init__(self, user_file, backup_dir, incremental=True, reload_interval=1,
+                 durability=durable_io.FULL, read_only=False):
+        """Constructor.
 
-    def __init__(self, user_file, backup_dir):
+        Args:
+            user_file: str, path of the user database.
+            backup_dir: str, directory to keep backups in. Must exist, unless
+                read_only.
+            incremental: bool, if True, AddUser appends to the database file
+                and backs up just the new record as a delta, instead of
+                rewriting, backing up and reparsing the whole database.
+            reload_interval: float, min seconds between checks of the file
+                for changes made by someone else.
+            durability: str, one of durable_io.LEVELS. How hard to try to get
+                changes (and their backups) on disk before returning.
+            read_only: bool, if True, only look users up, for a process
+                next to the one editing the database (door_daemon.py). Changes
+                raise UserDbError, and a damaged file is left for the writer
+                to recover; until it does, no tags are authorized.
+        """
         # Expand '~/'.
         self._user_file = os.path.expanduser(user_file)
-        # Expand '~/'.
-        self._backup_dir = os.path.expanduser(backup_dir)
-
-        if not os.path.isdir(self._backup_dir):
-            raise ValueError('Backup directory "%s" does not exist!' % self._backup_dir)
+        self._read_only = read_only
+
+        durable_io.CheckLevel(durability)
+        self._durability = durability
+        self._incremental = incremental
+        # Serializes everything that writes the file or publishes snapshots.
+        self._write_lock = threading.Lock()
+        if read_only:
+            self._backup_dir = None
+            self._backups = None
+        else:
+            # Expand '~/'.
+            self._backup_dir = os.path.expanduser(backup_dir)
+            if not os.path.isdir(self._backup_dir):
+                raise ValueError('Backup directory "%s" does not exist!' % self._backup_dir)
+            self._backups = backup_store.BackupStore(self._backup_dir,
+                                                     durability=durability)
+        # Digest of the backup of the current snapshot, if we wrote it.
+        # Incremental additions are backed up as deltas on top of it.
+        self._backup_digest = None
+
+        self._reload_interval = reload_interval
+        # time.time() of the last check for changes of the file.
+        self._last_check = time.time()
 
         # Raw user database. Note: we append new users to the file (and the raw version) so
         # that we can keep the formatting and comments.
-        self._users_raw = _ReadFileOrDefault(self._user_file, '# User database.\n')
-        # Parsed user database, mapping from lowercase RFID serial numbers to User objects.
-        self._users = _ParseUsers(self._users_raw)
+        raw, db = self._Load() if read_only else self._LoadOrRecover()
+        # Signature of the file as we last read or wrote it.
+        self._file_signature = self._GetFileSignature()
+        # Current _Snapshot. Its users map lowercase RFID serial numbers to
+        # User objects, its users_by_name map lowercase usernames to User
+        # objects.
+        self._snapshot = _MakeSnapshot(raw, db)
+
+    def _Load(self):
+        """Reads the database file, without recovering it.
+
+        Returns:
+            (raw, _Database) tuple, of an empty database if the file is
+            missing or doesn't parse.
+        """
+        raw = _ReadFileOrDefault(self._user_file, '')
+        try:
+            return raw, _ParseDatabase(raw)
+        except UserDbError, e:
+            # Picked up by _Reload() once the writer fixes the file.
+            print('Not loading %s: %s' % (self._user_file, e))
+            return '', _ParseDatabase('')
+
+    def _CheckWritable(self):
+        if self._read_only:
+            raise UserDbError('User database is read-only')
+
+    def _LoadOrRecover(self):
+        """Reads the database file, recovering from an interrupted write.
+
+        A leftover temp file means a save never completed; the database file
+        still holds the last committed version, so the temp file is removed.
+        If the database file looks like a power cut hit it (it is empty,
+        contains NUL bytes or ends in a truncated line, see _IsTruncated),
+        it is moved aside to <file>.corrupt (or <file>.corrupt.<time> if
+        that exists) and replaced with the newest backup that is intact.
+        Any other parse error, like a typo in a hand edit, is raised:
+        restoring a backup would silently undo the edit.
+
+        Returns:
+            (raw, _Database) tuple.
+
+        Raises:
+            UserDbError if the file doesn't parse and isn't damaged the way a
+            power cut leaves it, or is and no backup is usable.
+        """
+        tmp = self._user_file + '.tmp'
+        if os.path.exists(tmp):
+            print('Removing %s left over from an interrupted save' % tmp)
+            os.remove(tmp)
+
+        raw = _ReadFileOrDefault(self._user_file, None)
+        if raw is None:
+            raw = '# User database.\n'
+            return raw, _ParseDatabase(raw)
+        error = None
+        if not raw:
+            error = UserDbError('File is empty')
+        elif '\0' in raw:
+            error = UserDbError('File contains NUL bytes')
+        else:
+            try:
+                return raw, _ParseDatabase(raw)
+            except UserDbError, e:
+                if not _IsTruncated(raw):
+                    raise
+                error = UserDbError('Last line is truncated: %s' % e, e.diagnostics)
+
+        print('%s is corrupt: %s' % (self._user_file, error))
+        for backup in self._backups.List():
+            try:
+                blob = self._backups.Get(backup.digest)
+                if '\0' in blob:
+                    continue
+                db = _ParseDatabase(blob)
+            except (backup_store.BackupStoreError, UserDbError), e:
+                print('Skipping backup %s: %s' % (backup.digest, e))
+                continue
+            print('Restoring backup %s from %s' % (
+                    backup.digest, time.ctime(backup.timestamp)))
+            os.rename(self._user_file, _UnusedPath(self._user_file + '.corrupt'))
+            durable_io.WriteAtomically(self._user_file, blob, self._durability)
+            return blob, db
+        if not raw:
+            # Nothing to lose.
+            return raw, _ParseDatabase(raw)
+        raise error
+
+    def _GetFileSignature(self):
+        """Returns (inode, size, mtime) of the database file, or None."""
+        try:
+            st = os.stat(self._user_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def _MaybeReload(self, force=False):
+        """Picks up changes made to the database file by someone else.
+
+        Readers call this without holding the write lock. If a writer is busy,
+        they skip the check; the writer checks the file itself and publishes
+        the result.
+
+        Args:
+            force: bool, check now even if we checked recently. Callers
+                passing True must hold the write lock.
+        """
+        now = time.time()
+        if not force:
+            if now - self._last_check < self._reload_interval:
+                return
+            if not self._write_lock.acquire(False):
+                return
+            try:
+                self._Reload(now)
+            finally:
+                self._write_lock.release()
+        else:
+            self._Reload(now)
+
+    def _Reload(self, now):
+        """Reparses the file if it changed. Needs the write lock."""
+        self._last_check = now
+        signature = self._GetFileSignature()
+        if signature is None or signature == self._file_signature:
+            return
+        self._file_signature = signature
+        raw = _ReadFileOrDefault(self._user_file, '')
+        try:
+            db = _ParseDatabase(raw)
+        except UserDbError, e:
+            # Keep serving the last good version.
+            print('Not reloading %s: %s' % (self._user_file, e))
+            return
+        self._snapshot = _MakeSnapshot(raw, db)
+        # Our last backup no longer matches the file.
+        self._backup_digest = None
 
     def AuthorizeUser(self, user, password):
         """Checks whether given user/password combo is valid.
@@ -153,83 +657,178 @@ class UserDb(object):
         """
         if not user or not password:
             return (False, None)
-        sha1 = hashlib.sha1()
-        sha1.update(password)
-        digest = sha1.hexdigest().lower()
-        for u in self._users.itervalues():
-            if not u.user or not u.password:
-                continue
-
-            if u.user.lower() == user.lower() and u.password == digest:
+        self._MaybeReload()
+        for u in self._snapshot.users_by_name.get(user.lower(), ()):
+            if _CheckPassword(u.password, password):
                 return (True, u.admin)
         return (False, None)
 
-    def AuthorizeRfidTag(self, rfid):
+    def AuthorizeRfidTag(self, rfid, now=None, door=None):
         """Checks whether given RFID tag is authorized.
 
         Args:
             rfid: string, RFID serial number.
+            now: float, time of the swipe, defaults to now.
+            door: str, name of the door the tag was read at, if known.
 
         Returns:
            (authorized, name) tuple, where:
-             authorized: bool, whether the user is authorized
+             authorized: bool, whether the user is authorized. False for
+               known users outside of their time windows, or at a door
+               they don't have access to.
              name: str or None. If str, name associated with RFID tag.
         """
-        rfid = rfid.lower()
-        if rfid not in self._users:
+        self._MaybeReload()
+        snapshot = self._snapshot
+        u = snapshot.users.get(rfid.lower())
+        if u is None:
             return (False, None)
-        # TODO: we could add the time based logic here.
-        return (True, self._users[rfid].name)
+        if not _DoorAllowed(u.doors, door):
+            return (False, u.name)
+        if u.time and not snapshot.schedules.IsAllowed(
+                u.time, schedule.MinuteOfWeek(now)):
+            return (False, u.name)
+        return (True, u.name)
 
-    def _SaveAndBackupUserDatabase(self):
-        """Saves self._users_raw and backs it up."""
-        # Write to a temp file and then move it in place to make the operation atomic.
-        tmp = self._user_file + '.tmp'
-        with open(tmp, 'w') as fh:
-            fh.write(self._users_raw)
+    def _SaveAndBackupUserDatabase(self, raw, db):
+        """Saves raw, backs it up and publishes it with its parsed _Database.
+
+        Needs the write lock.
+        """
+        # First, back it up.
+        self._backup_digest = self._backups.Save(raw)
 
-        # First, copy to a backup.
-        backup_name = time.strftime('%Y%m%d_%H%M%S.db')
-        backup_file = os.path.join(self._backup_dir, backup_name)
-        shutil.copy(tmp, backup_file)
+        # Then write it to a temp file and move it in place, so that the file
+        # is always either the old or the new version.
+        durable_io.WriteAtomically(self._user_file, raw, self._durability)
+        self._file_signature = self._GetFileSignature()
 
-        # Then, move it in place.
-        os.rename(tmp, self._user_file)
+        self._snapshot = _MakeSnapshot(raw, db)
 
-        # Reparse the user list.
-        self._users = _ParseUsers(self._users_raw)
+    def _AppendUserRecord(self, record, user):
+        """Appends a single record to the database without rewriting it.
+
+        The record is appended (and fsync-ed, unless durability is none) to
+        the database file and backed up as a delta on top of the latest
+        backup. A new snapshot with the user added is published; the current
+        one is left untouched. Needs the write lock.
+        """
+        snapshot = self._snapshot
+        with open(self._user_file, 'a') as fh:
+            fh.write(record)
+            durable_io.Sync(fh, self._durability)
+        self._file_signature = self._GetFileSignature()
+        raw = snapshot.raw + record
+        self._backup_digest = self._backups.Append(self._backup_digest, raw, record)
+
+        users = collections.OrderedDict(snapshot.users)
+        users[user.rfid] = user
+        users_by_name = snapshot.users_by_name
+        if user.user and user.password:
+            users_by_name = dict(users_by_name)
+            users_by_name[user.user.lower()] = (
+                    users_by_name.get(user.user.lower(), ()) + (user,))
+        self._snapshot = _Snapshot(raw, users, users_by_name, snapshot.schedules, True)
 
     def AddUser(self, rfid, name, admin_user):
         """Adds a new user to the database."""
-        rfid = _NormalizeRfid(rfid)
-        name = name.replace(':', '')  # strip out colons.
+        self._CheckWritable()
+        line, user = _MakeUserLine(rfid, name)
+        with self._write_lock:
+            self._AddUserLocked(line, user, admin_user)
+
+    def _AddUserLocked(self, line, user, admin_user):
+        self._MaybeReload(force=True)
+        snapshot = self._snapshot
+        if user.rfid in snapshot.users:
+            raise UserDbError('RFID tag already exists in database')
 
-        if not rfid or not name:
-            raise UserDbError('RFID or name not provided')
+        record = _FormatRecord(snapshot.raw, snapshot.in_users, 'Added', admin_user, [line])
 
-        if rfid in self._users:
-            raise UserDbError('RFID tag already exists in database')
+        if (self._incremental and self._backup_digest is not None and
+                os.path.exists(self._user_file)):
+            self._AppendUserRecord(record, user)
+        else:
+            users = collections.OrderedDict(snapshot.users)
+            users[user.rfid] = user
+            self._SaveAndBackupUserDatabase(
+                    snapshot.raw + record, _Database(users, snapshot.schedules, True))
+
+    def AddUsers(self, rows, admin_user):
+        """Adds many users to the database with a single write and backup.
+
+        Every row is validated before anything is written. If any row is
+        invalid, nothing is added.
 
-        if not self._users_raw.endswith('\n'):
-            self._users_raw += '\n'
+        Args:
+            rows: iterable of (line number, fields) tuples, as returned by
+                ParseImport. The fields are rfid, name and optional
+                key=value strings.
+            admin_user: str, who is adding the users.
 
-        self._users_raw += '# Added on %s by %s\n' % (
-                time.strftime('%Y-%m-%d %H:%M:%S'), admin_user)
-        self._users_raw += '%s:%s\n' % (rfid, name)
+        Returns:
+            int, number of users added.
 
-        self._SaveAndBackupUserDatabase()
+        Raises:
+            UserDbError: listing every invalid row.
+        """
+        self._CheckWritable()
+        with self._write_lock:
+            return self._AddUsersLocked(rows, admin_user)
+
+    def _AddUsersLocked(self, rows, admin_user):
+        self._MaybeReload(force=True)
+        snapshot = self._snapshot
+        new_users, schedules = _MakeImportLines(rows, snapshot.users, snapshot.schedules)
+        users = collections.OrderedDict(snapshot.users)
+        for _, user in new_users:
+            users[user.rfid] = user
+        records = _FormatRecord(snapshot.raw, snapshot.in_users, 'Imported', admin_user,
+                                [line for line, _ in new_users])
+
+        self._SaveAndBackupUserDatabase(
+                snapshot.raw + records, _Database(users, schedules, True))
+        return len(new_users)
 
     def GetUserDatabase(self):
         """Returns the raw user database."""
-        return self._users_raw
+        self._MaybeReload()
+        return self._snapshot.raw
 
     def ReplaceUserDatabase(self, new_users_raw):
         """Replaces the user database with a new one."""
+        self._CheckWritable()
         # First, make sure we can parse the new database. If we can't, this will raise.
-        parsed = _ParseUsers(new_users_raw)
+        db = _ParseDatabase(new_users_raw)
         # As a sanity check, make sure there is at least one user in the new parsed data.
-        if not parsed:
+        if not db.users:
             raise UserDbError('New user database should include at least one record')
-        self._users_raw = new_users_raw
 
-        self._SaveAndBackupUserDatabase()
+        with self._write_lock:
+            self._SaveAndBackupUserDatabase(new_users_raw, db)
+
+    def ListBackups(self):
+        """Returns backups as backup_store.Backup tuples, newest first."""
+        self._CheckWritable()
+        return self._backups.List()
+
+    def DiffBackup(self, digest):
+        """Returns a unified diff from a backup to the current database."""
+        self._CheckWritable()
+        try:
+            return self._backups.Diff(digest, self.GetUserDatabase())
+        except backup_store.BackupStoreError, e:
+            raise UserDbError(str(e))
+
+    def RestoreBackup(self, digest):
+        """Replaces the user database with a backup."""
+        self._CheckWritable()
+        try:
+            blob = self._backups.Get(digest)
+        except backup_store.BackupStoreError, e:
+            raise UserDbError(str(e))
+        self.ReplaceUserDatabase(blob)
+
+    def Close(self):
+        """Nothing to release; the file is only open while being written."""
+        pass
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# Micro-benchmarks for the user database.
+#
+# Usage: user_db_benchmark.py [benchmark ...]
+#
+# Without arguments, runs all benchmarks.
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import re
+import shutil
+import tempfile
+import time
+
+# Local imports.
+import durable_io
+import user_db
+
+
+def _MakeDatabase(count, with_passwords=False):
+    """Returns the text of a synthetic database with count users."""
+    lines = ['# Synthetic user database.']
+    for i in xrange(count):
+        line = '%08x:user %d' % (i, i)
+        if with_passwords:
+            digest = hashlib.sha1('pwd%d' % i).hexdigest()
+            line += ':user=user%d:password=%s' % (i, digest)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def _LegacyParseUsers(blob):
+    """The regular expression based parser user_db used to have."""
+    users = {}
+    for orig_line in blob.splitlines():
+        line = orig_line.strip()
+        line = re.sub('\s*#.*$', '', line)
+        if not line:
+            continue
+        items = re.split('\s*:\s*', line)
+        fields = dict((key, None) for key in user_db.User._fields)
+        if not re.match('^[a-f0-9]+$', items[0].strip().lower()):
+            raise user_db.UserDbError('Invalid RFID: %s' % items[0])
+        fields['rfid'] = items[0]
+        fields['name'] = items[1]
+        for item in items[2:]:
+            key, value = re.split('\s*=\s*', item, 1)
+            fields[key] = value
+        users[fields['rfid']] = user_db.User(**fields)
+    return users
+
+
+def _Time(func, repeat):
+    """Returns average seconds per call of func over repeat calls."""
+    start = time.time()
+    for _ in xrange(repeat):
+        func()
+    return (time.time() - start) / repeat
+
+
+def _Percentile(values, fraction):
+    """Returns the value below which the given fraction of values fall."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class _TempDb(object):
+    """Context manager creating a UserDb in a temp directory."""
+
+    def __init__(self, blob=None, **kwargs):
+        self._blob = blob
+        self._kwargs = kwargs
+
+    def __enter__(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = self.temp_dir + '/users.db'
+        if self._blob is not None:
+            with open(self.path, 'w') as fh:
+                fh.write(self._blob)
+        return user_db.UserDb(self.path, self.temp_dir, **self._kwargs)
+
+    def __exit__(self, *unused_exc_info):
+        shutil.rmtree(self.temp_dir)
+
+
+def BenchmarkLogin():
+    """AuthorizeUser latency as the database grows."""
+    print('%10s %14s %14s' % ('users', 'hit (us)', 'miss (us)'))
+    for count in (100, 1000, 10000, 100000):
+        with _TempDb(_MakeDatabase(count, with_passwords=True)) as users:
+            last = count - 1
+            hit = _Time(lambda: users.AuthorizeUser(
+                    'USER%d' % last, 'pwd%d' % last), 10000)
+            miss = _Time(lambda: users.AuthorizeUser('nobody', 'pwd'), 10000)
+            print('%10d %14.2f %14.2f' % (count, hit * 1e6, miss * 1e6))
+
+
+def BenchmarkEnroll():
+    """Enrolling tags one AddUser call at a time, full rewrite vs incremental.
+
+    The full rewrite path is quadratic; at 10k tags it takes several minutes.
+    """
+    print('%10s %14s %14s' % ('tags', 'full (s)', 'incremental (s)'))
+    for count in (1000, 10000):
+        timings = []
+        for incremental in (False, True):
+            with _TempDb(incremental=incremental) as users:
+                start = time.time()
+                for i in xrange(count):
+                    users.AddUser('%08x' % i, 'user %d' % i, 'benchmark')
+                timings.append(time.time() - start)
+        print('%10d %14.2f %14.2f' % (count, timings[0], timings[1]))
+
+
+def BenchmarkImport():
+    """Importing 5k tags with AddUsers vs one AddUser call per tag."""
+    count = 5000
+    rows = [(i + 1, ['%08x' % i, 'user %d' % i]) for i in xrange(count)]
+    with _TempDb() as users:
+        start = time.time()
+        for _, (rfid, name) in rows:
+            users.AddUser(rfid, name, 'benchmark')
+        one_by_one = time.time() - start
+    with _TempDb() as users:
+        start = time.time()
+        users.AddUsers(rows, 'benchmark')
+        bulk = time.time() - start
+    print('%10s %14s %14s' % ('tags', 'AddUser (s)', 'AddUsers (s)'))
+    print('%10d %14.3f %14.3f' % (count, one_by_one, bulk))
+
+
+def BenchmarkParse():
+    """Parsing a 100k-line database, regular expressions vs compiled parser."""
+    lines = []
+    for i in xrange(50000):
+        lines.append('# Added on 2016-01-01 12:00:00 by admin')
+        line = ' %08x : user %d ' % (i, i)
+        if i % 10 == 0:
+            line += ': user = user%d : password = %s  # with login' % (
+                    i, hashlib.sha1('pwd%d' % i).hexdigest())
+        lines.append(line)
+    blob = '\n'.join(lines) + '\n'
+    assert _LegacyParseUsers(blob) == user_db._ParseUsers(blob)
+
+    legacy = _Time(lambda: _LegacyParseUsers(blob), 3)
+    current = _Time(lambda: user_db._ParseUsers(blob), 3)
+    print('%10s %14s %14s %10s' % ('lines', 'regexp (s)', 'compiled (s)', 'speedup'))
+    print('%10d %14.3f %14.3f %9.1fx' % (len(lines), legacy, current, legacy / current))
+
+
+def BenchmarkCommit():
+    """Commit latency of each durability level, for a 1k-user database.
+
+    Run it on the target machine: the cost of fsync depends entirely on the
+    storage, from nothing on tmpfs to tens of milliseconds on an SD card.
+    Set TMPDIR to a directory on the same filesystem as --user_db.
+    """
+    blob = _MakeDatabase(1000)
+    repeat = 50
+    print('%10s %14s %14s %14s %14s' % ('level', 'save (ms)', 'save p99 (ms)',
+                                        'append (ms)', 'append p99 (ms)'))
+    for durability in durable_io.LEVELS:
+        with _TempDb(blob, durability=durability) as users:
+            saves = []
+            for i in xrange(repeat):
+                start = time.time()
+                users.ReplaceUserDatabase(blob + '# %d\n' % i)
+                saves.append(time.time() - start)
+            appends = []
+            for i in xrange(repeat):
+                start = time.time()
+                users.AddUser('f%07x' % i, 'user %d' % i, 'benchmark')
+                appends.append(time.time() - start)
+        print('%10s %14.2f %14.2f %14.2f %14.2f' % (
+                durability,
+                sum(saves) / repeat * 1e3, _Percentile(saves, 0.99) * 1e3,
+                sum(appends) / repeat * 1e3, _Percentile(appends, 0.99) * 1e3))
+
+
+def BenchmarkBackends():
+    """Startup and mutation cost of the text file vs the SQLite backend.
+
+    startup: opening an existing database and checking one tag.
+    add: one AddUser call, averaged over 20, after the first one (which
+        backs up the whole database).
+    replace: one ReplaceUserDatabase call, i.e. a save from /edit.
+    """
+    print('%10s %8s %12s %12s %12s %12s' % (
+            'users', 'backend', 'startup (s)', 'add (ms)', 'replace (s)', 'lookup (us)'))
+    for count in (1000, 10000, 100000):
+        blob = _MakeDatabase(count, with_passwords=True)
+        for backend in ('text', 'sqlite'):
+            temp_dir = tempfile.mkdtemp()
+            try:
+                if backend == 'text':
+                    uri = temp_dir + '/users.db'
+                    with open(uri, 'w') as fh:
+                        fh.write(blob)
+                else:
+                    uri = 'sqlite:' + temp_dir + '/users.sqlite'
+                    setup = user_db.Instantiate(uri, temp_dir)
+                    setup.ReplaceUserDatabase(blob)
+                    setup.Close()
+
+                start = time.time()
+                users = user_db.Instantiate(uri, temp_dir)
+                users.AuthorizeRfidTag('%08x' % (count - 1))
+                startup = time.time() - start
+
+                users.AddUser('f0000000', 'first', 'benchmark')
+                start = time.time()
+                for i in xrange(1, 21):
+                    users.AddUser('f%07x' % i, 'user %d' % i, 'benchmark')
+                add = (time.time() - start) / 20
+
+                replace = _Time(lambda: users.ReplaceUserDatabase(blob), 3)
+                lookup = _Time(lambda: users.AuthorizeRfidTag('%08x' % (count // 2)), 10000)
+                users.Close()
+            finally:
+                shutil.rmtree(temp_dir)
+            print('%10d %8s %12.3f %12.2f %12.3f %12.2f' % (
+                    count, backend, startup, add * 1e3, replace, lookup * 1e6))
+
+
+BENCHMARKS = {
+    'backends': BenchmarkBackends,
+    'commit': BenchmarkCommit,
+    'parse': BenchmarkParse,
+    'import': BenchmarkImport,
+    'enroll': BenchmarkEnroll,
+    'login': BenchmarkLogin,
+}
+
+
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Benchmarks to run, one of %s (default: all)' %
+                        ', '.join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark: %s' % name)
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print('== %s: %s' % (name, BENCHMARKS[name].__doc__.splitlines()[0]))
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    Main()
@@ -2,14 +2,22 @@
 
 import os
 import shutil
+import sqlite3
 import tempfile
+import threading
+import time
 import unittest
 
 # Local imports.
+import sqlite_user_db
 import user_db
 
 
-class TestUserDb(unittest.TestCase):
+class _UserDbTests(object):
+    """Tests run against every backend.
+
+    Subclasses implement _Open() and _Stored().
+    """
 
     def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
@@ -19,8 +27,16 @@ class TestUserDb(unittest.TestCase):
         if os.path.isdir(self.temp_dir):
             shutil.rmtree(self.temp_dir)
 
+    def _Open(self, **kwargs):
+        """Returns a user database in self.temp_dir."""
+        raise NotImplementedError
+
+    def _Stored(self):
+        """Returns the database as stored, read back without caches."""
+        raise NotImplementedError
+
     def testStuff(self):
-        users = user_db.UserDb(self.user_db, self.temp_dir)
+        users = self._Open()
 
         def _TestValid(rfid, expected_name):
             valid, name = users.AuthorizeRfidTag(rfid)
@@ -44,12 +60,11 @@ class TestUserDb(unittest.TestCase):
         _TestValid('abcd', 'johnny')
         _TestValid('1111', 'bobby')
 
-        # Test that the file was written.
-        with open(self.user_db) as fh:
-            contents = fh.read()
-            self.assertIn('bobby', contents)
-            self.assertIn(' by admin', contents)
-            self.assertIn(' by magical_superpowers', contents)
+        # Test that the database was written.
+        contents = self._Stored()
+        self.assertIn('bobby', contents)
+        self.assertIn(' by admin', contents)
+        self.assertIn(' by magical_superpowers', contents)
 
         # Try to replace with empty or broken values.
         self.assertRaises(user_db.UserDbError, users.ReplaceUserDatabase, '# foo')
@@ -57,6 +72,16 @@ class TestUserDb(unittest.TestCase):
         self.assertRaises(user_db.UserDbError, users.ReplaceUserDatabase, ':zz')
         self.assertRaises(user_db.UserDbError, users.ReplaceUserDatabase, 'a:b:invalid=field')
 
+        # Every bad line is reported, with its line number.
+        try:
+            users.ReplaceUserDatabase('# ok\nf00:bar\nxyz:bad\n\nf01:baz:user\n')
+        except user_db.UserDbError, e:
+            self.assertEqual([3, 5], [number for number, _ in e.diagnostics])
+            self.assertEqual('Invalid RFID: xyz', e.diagnostics[0][1])
+            self.assertEqual('Failed to parse line: f01:baz:user', e.diagnostics[1][1])
+        else:
+            self.fail('ReplaceUserDatabase should have failed')
+
         # Replace with a good database. Also test user/password handling.
         users.ReplaceUserDatabase(
                 ' f00 :   bar :user=foo: ' +
@@ -67,20 +92,413 @@ class TestUserDb(unittest.TestCase):
         valid, admin = users.AuthorizeUser('foo', 'meh')
         self.assertTrue(valid)
         self.assertEqual('yes', admin)
+        # Usernames are case-insensitive.
+        self.assertTrue(users.AuthorizeUser('FoO', 'meh')[0])
         self.assertFalse(users.AuthorizeUser('foo', 'meh2')[0])
         self.assertFalse(users.AuthorizeUser('zing', 'meh')[0])
 
-        # Test that the file was written.
-        with open(self.user_db) as fh:
-            contents = fh.read()
-            self.assertIn('f00', contents)
+        # Test that the database was written.
+        self.assertIn('f00', self._Stored())
 
-        # Test recreating the object. The file should be read in.
-        users2 = user_db.UserDb(self.user_db, self.temp_dir)
+        # Test recreating the object. The database should be read in.
+        users = self._Open()
         _TestNotValid('abcd')
         _TestValid('f00', 'bar')
 
-        # TODO: add a test for backups.
+    def testBackups(self):
+        users = self._Open()
+        users.ReplaceUserDatabase('abcd:johnny\n')
+        users.AddUser('1111', 'bobby', 'admin')
+        # Saving the same content again doesn't store it again.
+        users.ReplaceUserDatabase('abcd:johnny\n')
+        backups = users.ListBackups()
+        self.assertEqual(3, len(backups))
+        self.assertEqual(backups[0].digest, backups[2].digest)
+        self.assertEqual(1, len(os.listdir(os.path.join(self.temp_dir, 'objects'))))
+
+        diff = users.DiffBackup(backups[1].digest)
+        self.assertIn('-1111:bobby', diff)
+        users.RestoreBackup(backups[1].digest)
+        self.assertTrue(users.AuthorizeRfidTag('1111')[0])
+        self.assertEqual(4, len(users.ListBackups()))
+
+        self.assertRaises(user_db.UserDbError, users.RestoreBackup, 'f' * 40)
+        self.assertRaises(user_db.UserDbError, users.RestoreBackup, '../../etc/passwd')
+
+    def testIncrementalAddUser(self):
+        users = self._Open()
+        users.AddUser('abcd', 'johnny', 'admin')
+        users.AddUser('1111', 'bobby', 'admin')
+        users.AddUser('2222', 'jimmy', 'admin')
+
+        # One full backup, plus deltas with the records added since.
+        backups = users.ListBackups()
+        self.assertEqual(3, len(backups))
+        self.assertEqual(1, len(os.listdir(os.path.join(self.temp_dir, 'objects'))))
+        self.assertEqual(2, len(os.listdir(os.path.join(self.temp_dir, 'deltas'))))
+        contents = self._Stored()
+        self.assertEqual(contents, users.GetUserDatabase())
+        self.assertEqual(contents, users._backups.Get(backups[0].digest))
+        self.assertNotIn('bobby', users._backups.Get(backups[2].digest))
+
+        # Everything reads back.
+        users2 = self._Open()
+        for rfid in ('abcd', '1111', '2222'):
+            self.assertTrue(users2.AuthorizeRfidTag(rfid)[0])
+
+        # Names that would not read back are rejected before anything is written.
+        self.assertRaises(user_db.UserDbError, users.AddUser, '3333', '#x', 'admin')
+        self.assertFalse(users.AuthorizeRfidTag('3333')[0])
+
+    def testAddUsers(self):
+        users = self._Open()
+        users.AddUser('abcd', 'johnny', 'admin')
+
+        # Invalid rows are all reported, and nothing is added.
+        rows = user_db.ParseImport('1111:bobby\nabcd:dup\nxyz:bad\n1111:again\n')
+        try:
+            users.AddUsers(rows, 'admin')
+        except user_db.UserDbError, e:
+            message = str(e)
+        else:
+            self.fail('AddUsers should have failed')
+        self.assertIn('Line 2:', message)
+        self.assertIn('Line 3:', message)
+        self.assertIn('Line 4:', message)
+        self.assertNotIn('Line 1:', message)
+        self.assertFalse(users.AuthorizeRfidTag('1111')[0])
+
+        # CSV with a header line, one write for all rows.
+        csv_blob = ('rfid,name\n'
+                    '1111,"Bobby, Jr."\n'
+                    '# comment\n'
+                    '2222,jimmy,user=jimmy,'
+                    'password=26c4202eb475d02864b40827dfff11a14657aa41\n')
+        self.assertEqual(2, users.AddUsers(user_db.ParseImport(csv_blob), 'admin'))
+        self.assertEqual((True, 'Bobby, Jr.'), users.AuthorizeRfidTag('1111'))
+        self.assertTrue(users.AuthorizeUser('jimmy', 'meh')[0])
+        self.assertIn(' by admin', self._Stored())
+
+        self.assertRaises(user_db.UserDbError, users.AddUsers,
+                          user_db.ParseImport('# nothing'), 'admin')
+        self.assertRaises(user_db.UserDbError, user_db.ParseImport, 'a,b', 'xml')
+
+    def testConcurrentReadsAndWrites(self):
+        users = self._Open()
+        users.ReplaceUserDatabase('abcd:johnny\n')
+        stop = threading.Event()
+        errors = []
+
+        def _Reader():
+            while not stop.is_set():
+                # abcd is in every version of the database.
+                if users.AuthorizeRfidTag('abcd') != (True, 'johnny'):
+                    errors.append('abcd not authorized')
+                    return
+
+        def _Adder(offset):
+            i = 0
+            while not stop.is_set():
+                try:
+                    users.AddUser('%x' % (0x100000 + i * 2 + offset), 'user', 'admin')
+                except user_db.UserDbError:
+                    # Replaced by a database that already has this tag.
+                    pass
+                except Exception, e:
+                    errors.append(e)
+                    return
+                i += 1
+
+        def _Replacer():
+            i = 0
+            while not stop.is_set():
+                try:
+                    users.ReplaceUserDatabase('abcd:johnny\n%x:replaced\n' % (0x200000 + i))
+                except Exception, e:
+                    errors.append(e)
+                    return
+                i += 1
+
+        threads = [threading.Thread(target=_Reader) for _ in xrange(8)]
+        threads += [threading.Thread(target=_Adder, args=(offset,)) for offset in (0, 1)]
+        threads.append(threading.Thread(target=_Replacer))
+        for thread in threads:
+            thread.start()
+        time.sleep(1)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+        # What we serve is what is stored, and it parses.
+        self.assertEqual(self._Stored(), users.GetUserDatabase())
+        users2 = self._Open()
+        self.assertEqual((True, 'johnny'), users2.AuthorizeRfidTag('abcd'))
+
+        # Two writers adding the same tag: exactly one of them wins.
+        results = []
+
+        def _AddSame():
+            try:
+                users.AddUser('feed', 'same', 'admin')
+                results.append(True)
+            except user_db.UserDbError:
+                results.append(False)
+        threads = [threading.Thread(target=_AddSame) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, results.count(True))
+
+    def testTimeWindows(self):
+        users = self._Open()
+        users.ReplaceUserDatabase(
+                'abcd:johnny\n'
+                '[times]\n'
+                'workday:wed 1830-2300\n'
+                '[users]\n'
+                '1111:bobby:time=workday\n'
+                '2222:jimmy:time=workday,weekend\n'
+                '[times]\n'
+                'weekend:sat,sun 0000-2400\n')
+        # Wednesday, January 6th 2016, 19:00 and 12:00 local time, and
+        # Saturday.
+        evening = time.mktime((2016, 1, 6, 19, 0, 0, 0, 0, -1))
+        noon = time.mktime((2016, 1, 6, 12, 0, 0, 0, 0, -1))
+        saturday = time.mktime((2016, 1, 9, 12, 0, 0, 0, 0, -1))
+        self.assertEqual((True, 'johnny'), users.AuthorizeRfidTag('abcd', noon))
+        self.assertEqual((True, 'bobby'), users.AuthorizeRfidTag('1111', evening))
+        self.assertEqual((False, 'bobby'), users.AuthorizeRfidTag('1111', noon))
+        self.assertEqual((False, 'bobby'), users.AuthorizeRfidTag('1111', saturday))
+        self.assertEqual((True, 'jimmy'), users.AuthorizeRfidTag('2222', saturday))
+
+        # Added users land in the [users] section, and may use schedules.
+        users.AddUser('3333', 'kim', 'admin')
+        users.AddUsers(user_db.ParseImport('4444:lee:time=weekend\n'), 'admin')
+        users = self._Open()
+        self.assertTrue(users.AuthorizeRfidTag('3333', noon)[0])
+        self.assertEqual((False, 'lee'), users.AuthorizeRfidTag('4444', noon))
+        self.assertTrue(users.AuthorizeRfidTag('2222', saturday)[0])
+        self.assertRaises(user_db.UserDbError, users.AddUsers,
+                          user_db.ParseImport('5555:max:time=never\n'), 'admin')
+
+        # Undefined schedules and bad windows are reported by line.
+        try:
+            users.ReplaceUserDatabase('[times]\nx:wed 9-10\n[users]\n1111:bobby:time=y\n[foo]\n')
+        except user_db.UserDbError, e:
+            self.assertEqual([2, 4, 5], [number for number, _ in e.diagnostics])
+        else:
+            self.fail('ReplaceUserDatabase should have failed')
+
+    def testDuplicateUsername(self):
+        users = self._Open()
+        users.ReplaceUserDatabase(
+                'f00:bar:user=foo:password=26c4202eb475d02864b40827dfff11a14657aa41\n'
+                'f01:baz:user=FOO:admin=yes:'
+                'password=ee754569151843119585e2512b64478386f9cc12\n')
+        # Either password logs in, as the user it belongs to.
+        self.assertEqual((True, None), users.AuthorizeUser('foo', 'meh'))
+        self.assertEqual((True, 'yes'), users.AuthorizeUser('foo', 'meh2'))
+        self.assertFalse(users.AuthorizeUser('foo', 'meh3')[0])
+        users.AddUsers([(1, ['f02', 'qux', 'user=foo',
+                             'password=9e0fa01c7bb1d2c1a1e0ae5d1ec7d3baf0a7a4f5'])], 'admin')
+        self.assertTrue(users.AuthorizeUser('foo', 'meh')[0])
+        self.assertTrue(users.AuthorizeUser('foo', 'meh2')[0])
+
+    def testDoors(self):
+        users = self._Open()
+        users.ReplaceUserDatabase('abcd:johnny\n'
+                                  '1111:bobby:doors=front, workshop\n'
+                                  '2222:jimmy:doors=back\n')
+        self.assertEqual((True, 'johnny'), users.AuthorizeRfidTag('abcd', door='back'))
+        self.assertEqual((True, 'bobby'), users.AuthorizeRfidTag('1111', door='workshop'))
+        self.assertEqual((False, 'bobby'), users.AuthorizeRfidTag('1111', door='back'))
+        self.assertEqual((False, 'jimmy'), users.AuthorizeRfidTag('2222', door='front'))
+        # Unknown door, e.g. the web interface.
+        self.assertEqual((True, 'jimmy'), users.AuthorizeRfidTag('2222'))
+
+    def testReadOnly(self):
+        users = self._Open()
+        users.AddUser('abcd', 'johnny', 'admin')
+        reader = self._Open(read_only=True)
+        self.assertEqual((True, 'johnny'), reader.AuthorizeRfidTag('abcd'))
+        # Sees what the writer changes.
+        users.AddUser('1111', 'bobby', 'admin')
+        self.assertEqual((True, 'bobby'), reader.AuthorizeRfidTag('1111'))
+        self.assertRaises(user_db.UserDbError, reader.AddUser, '2222', 'jimmy', 'admin')
+        self.assertRaises(user_db.UserDbError, reader.AddUsers, [(1, ['2222', 'jimmy'])],
+                          'admin')
+        self.assertRaises(user_db.UserDbError, reader.ReplaceUserDatabase, '2222:jimmy\n')
+        self.assertRaises(user_db.UserDbError, reader.ListBackups)
+        self.assertFalse(reader.AuthorizeRfidTag('2222')[0])
+        self.assertTrue(users.ListBackups())
+
+
+class TestUserDb(_UserDbTests, unittest.TestCase):
+
+    def _Open(self, **kwargs):
+        # Check for external changes on every read.
+        kwargs.setdefault('reload_interval', 0)
+        return user_db.UserDb(self.user_db, self.temp_dir, **kwargs)
+
+    def _Stored(self):
+        with open(self.user_db) as fh:
+            return fh.read()
+
+    def testEditsKeepFileOrder(self):
+        # The first of the repeated username's records with a matching
+        # password wins, so the users must stay in file order.
+        lines = ['%04x:foo%d:user=foo:password=26c4202eb475d02864b40827dfff11a14657aa41'
+                 % (0xff - i, i) for i in xrange(30)]
+        lines[0] += ':admin=yes'
+        with open(self.user_db, 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+        users = self._Open()
+        self.assertEqual((True, 'yes'), users.AuthorizeUser('foo', 'meh'))
+        # Rewrites the whole file, then appends.
+        users.AddUser('abcd', 'johnny', 'admin')
+        users.AddUser('abce', 'jimmy', 'admin')
+        users.AddUsers([(1, ['abcf', 'bobby'])], 'admin')
+        self.assertEqual((True, 'yes'), users.AuthorizeUser('foo', 'meh'))
+        expected = ['%04x' % (0xff - i) for i in xrange(30)] + ['abcd', 'abce', 'abcf']
+        self.assertEqual(expected, users._snapshot.users.keys())
+        self.assertEqual(expected, [line.split(':')[0] for line in self._Stored().splitlines()
+                                    if line and not line.startswith('#')])
+
+    def testRecoversFromInterruptedSave(self):
+        users = user_db.UserDb(self.user_db, self.temp_dir)
+        users.ReplaceUserDatabase('abcd:johnny\n')
+        users.AddUser('1111', 'bobby', 'admin')
+        # A save that never got to the rename.
+        with open(self.user_db + '.tmp', 'w') as fh:
+            fh.write('abcd:johnny\n11')
+
+        users = user_db.UserDb(self.user_db, self.temp_dir)
+        self.assertFalse(os.path.exists(self.user_db + '.tmp'))
+        self.assertTrue(users.AuthorizeRfidTag('1111')[0])
+
+    def testRecoversCorruptFile(self):
+        users = user_db.UserDb(self.user_db, self.temp_dir)
+        users.ReplaceUserDatabase('abcd:johnny\n')
+        users.AddUser('1111', 'bobby', 'admin')
+        expected = users.GetUserDatabase()
+
+        corrupt = []
+        for garbage in ('', 'abcd:johnny\n\0\0\0\0', 'abcd:johnny\n# Added on\n11'):
+            with open(self.user_db, 'w') as fh:
+                fh.write(garbage)
+            users = user_db.UserDb(self.user_db, self.temp_dir)
+            self.assertEqual(expected, users.GetUserDatabase())
+            with open(self.user_db) as fh:
+                self.assertEqual(expected, fh.read())
+            # Earlier corrupt files are kept.
+            moved = [f for f in os.listdir(self.temp_dir) if '.corrupt' in f]
+            self.assertEqual(len(corrupt) + 1, len(moved))
+            new, = set(moved) - set(corrupt)
+            with open(os.path.join(self.temp_dir, new)) as fh:
+                self.assertEqual(garbage, fh.read())
+            corrupt = moved
+
+    def testParseErrorIsNotRecovered(self):
+        users = user_db.UserDb(self.user_db, self.temp_dir)
+        users.ReplaceUserDatabase('abcd:johnny\n')
+        users.AddUser('1111', 'bobby', 'admin')
+        # Typos in hand edits, even with a last line without a newline.
+        for edit in ('abcd:johnny\nxyz:bobby\n', 'abcd:johnny:tiem=always\n1111:bobby',
+                     'abcd:johnny\n1111:bobby:x=y\n'):
+            with open(self.user_db, 'w') as fh:
+                fh.write(edit)
+            self.assertRaises(user_db.UserDbError, user_db.UserDb, self.user_db,
+                              self.temp_dir)
+            with open(self.user_db) as fh:
+                self.assertEqual(edit, fh.read())
+            self.assertFalse(os.path.exists(self.user_db + '.corrupt'))
+
+    def testCorruptFileWithoutBackups(self):
+        with open(self.user_db, 'w') as fh:
+            fh.write('abcd:johnny\n\0\0\0\0')
+        self.assertRaises(user_db.UserDbError, user_db.UserDb, self.user_db, self.temp_dir)
+        self.assertRaises(ValueError, user_db.UserDb, self.user_db, self.temp_dir,
+                          durability='sometimes')
+
+    def testReloadsExternalChanges(self):
+        users = user_db.UserDb(self.user_db, self.temp_dir, reload_interval=0)
+        users.AddUser('abcd', 'johnny', 'admin')
+
+        # Another process rewrites the file.
+        with open(self.user_db + '.new', 'w') as fh:
+            fh.write('1111:bobby\n')
+        os.rename(self.user_db + '.new', self.user_db)
+        self.assertFalse(users.AuthorizeRfidTag('abcd')[0])
+        self.assertEqual((True, 'bobby'), users.AuthorizeRfidTag('1111'))
+
+        # Additions go on top of the external version.
+        users.AddUser('2222', 'jimmy', 'admin')
+        with open(self.user_db) as fh:
+            contents = fh.read()
+        self.assertTrue(contents.startswith('1111:bobby\n'))
+        self.assertIn('2222:jimmy', contents)
+
+        # A broken external edit is ignored, the last good version is kept.
+        with open(self.user_db, 'a') as fh:
+            fh.write('not valid\n')
+        self.assertTrue(users.AuthorizeRfidTag('2222')[0])
+
+    def testReadOnlyLeavesDamageToTheWriter(self):
+        with open(self.user_db, 'w') as fh:
+            fh.write('abcd:johnny\n111')
+        reader = user_db.UserDb(self.user_db, None, reload_interval=0, read_only=True)
+        self.assertFalse(reader.AuthorizeRfidTag('abcd')[0])
+        self.assertEqual(['users.db'], os.listdir(self.temp_dir))
+        with open(self.user_db, 'w') as fh:
+            fh.write('abcd:johnny\n1111:bobby\n')
+        self.assertEqual((True, 'bobby'), reader.AuthorizeRfidTag('1111'))
+
+    def testInstantiate(self):
+        self.assertIsInstance(user_db.Instantiate(self.user_db, self.temp_dir),
+                              user_db.UserDb)
+        self.assertIsInstance(user_db.Instantiate('file://' + self.user_db, self.temp_dir),
+                              user_db.UserDb)
+        self.assertIsInstance(user_db.Instantiate('sqlite:' + self.user_db, self.temp_dir),
+                              sqlite_user_db.SqliteUserDb)
+
+
+class TestSqliteUserDb(_UserDbTests, unittest.TestCase):
+
+    def _Open(self, **kwargs):
+        return user_db.Instantiate('sqlite://' + self.user_db, self.temp_dir, **kwargs)
+
+    def _Stored(self):
+        users = sqlite_user_db.SqliteUserDb(self.user_db, self.temp_dir)
+        contents = users.GetUserDatabase()
+        users.Close()
+        return contents
+
+    def testExternalChanges(self):
+        users = self._Open()
+        users.AddUser('abcd', 'johnny', 'admin')
+        other = self._Open()
+        other.AddUser('1111', 'bobby', 'admin')
+        # Seen right away, and the next backup is of the whole database.
+        self.assertTrue(users.AuthorizeRfidTag('1111')[0])
+        users.AddUser('2222', 'jimmy', 'admin')
+        latest = users.ListBackups()[0].digest
+        self.assertEqual(self._Stored(), users._backups.Get(latest))
+
+    def testMigration(self):
+        # A database from before users had doors.
+        conn = sqlite3.connect(self.user_db)
+        conn.executescript(sqlite_user_db._SCHEMA.replace('login TEXT,\n    doors TEXT',
+                                                          'login TEXT'))
+        conn.execute("INSERT INTO users (rfid, name) VALUES ('abcd', 'johnny')")
+        conn.commit()
+        conn.close()
+        users = self._Open()
+        self.assertEqual((True, 'johnny'), users.AuthorizeRfidTag('abcd', door='front'))
+        users.AddUser('1111', 'bobby', 'admin')
+        users.ReplaceUserDatabase('2222:jimmy:doors=back\n')
+        self.assertEqual((False, 'jimmy'), users.AuthorizeRfidTag('2222', door='front'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+# The web interface.
+#
+# WebApp only handles HTTP. Everything else is up to a backend with the
+# methods listed in BACKEND_METHODS: RFIDLovePotion.Server itself when the
+# web server runs in its process (--serve=dev), or a door_ipc.Client talking
+# to it from web worker processes (--serve=production, see wsgi.py).
+
+from __future__ import print_function
+
+from flask import (Flask, Response, jsonify, redirect, render_template, request,
+                   session, stream_with_context, url_for)
+import threading
+import time
+
+# Local imports.
+import reverse_proxy_hack
+import user_db
+
+# Number of most recent user database backups listed on /edit.
+BACKUPS_SHOWN = 20
+# Milliseconds between polls of dashboards that didn't get a stream.
+POLL_INTERVAL = 5000
+
+# Methods WebApp calls on its backend.
+BACKEND_METHODS = (
+    'AddUser',
+    'DiffBackup',
+    'GetEvents',
+    'GetStatus',
+    'GetUserDatabase',
+    'ImportUsers',
+    'ListBackups',
+    'Login',
+    'QueryEvents',
+    'Quit',
+    'ReplaceUserDatabase',
+    'RestoreBackup',
+    'Unlock',
+    'WaitEvents',
+)
+
+
+class WebApp(object):
+    """Flask application of the web interface."""
+
+    def __init__(self, backend, secret_key, debug=False, max_streams=None):
+        """Constructor.
+
+        Args:
+            backend: object with the methods of BACKEND_METHODS.
+            secret_key: str, key signing the session cookies. All workers
+                serving the same users need the same key.
+            debug: bool, whether to run Flask in debug mode.
+            max_streams: int or None, max number of /events streams open at
+                once. Each holds a request thread for as long as the page is
+                open; beyond this, dashboards poll every POLL_INTERVAL. None
+                for no limit, when each request gets a thread of its own.
+        """
+        self._backend = backend
+        # Free stream slots, or None for no limit.
+        self._streams = None
+        if max_streams is not None:
+            self._streams = threading.BoundedSemaphore(max_streams)
+        self.app = Flask(__name__)
+        self.app.debug = debug
+        self.app.wsgi_app = reverse_proxy_hack.ReverseProxied(
+                self.app.wsgi_app)
+        self.app.secret_key = secret_key
+        self.app.add_url_rule('/', 'index', self._IndexHandler, methods=['GET', 'POST'])
+        self.app.add_url_rule('/logout', 'logout', self._LogoutHandler, methods=['GET', 'POST'])
+        self.app.add_url_rule('/login', 'login', self._LoginHandler, methods=['GET', 'POST'])
+        self.app.add_url_rule('/open', 'open', self._OpenHandler, methods=['POST'])
+        self.app.add_url_rule('/edit', 'edit', self._EditHandler, methods=['GET', 'POST'])
+        self.app.add_url_rule('/import', 'import', self._ImportHandler, methods=['GET', 'POST'])
+        self.app.add_url_rule('/log', 'log', self._QueryLogHandler)
+        self.app.add_url_rule('/events', 'events', self._EventsHandler)
+        self.app.add_url_rule('/quitquitquit', 'quitquitquit', self._QuitHandler)
+
+    def _EditHandler(self):
+        if not session.get('admin') == 'yes':
+            return redirect(url_for('login'))
+        message = ''
+        diagnostics = []
+        users = self._backend.GetUserDatabase()
+        if request.method == 'POST' and request.form.get('save'):
+            users = request.form['users']
+            if users:
+                try:
+                    self._backend.ReplaceUserDatabase(users)
+                    message = 'Saved!'
+                except user_db.UserDbError, e:
+                    print(e)
+                    diagnostics = e.diagnostics
+                    message = 'Not saved!' if diagnostics else str(e)
+        elif request.method == 'POST' and request.form.get('restore'):
+            digest = request.form['restore']
+            try:
+                self._backend.RestoreBackup(digest, session.get('user'))
+                users = self._backend.GetUserDatabase()
+                message = 'Restored backup %s!' % digest[:12]
+            except user_db.UserDbError, e:
+                print(e)
+                message = 'Not restored: %s' % str(e)
+        diff = None
+        if request.args.get('diff'):
+            try:
+                diff = self._backend.DiffBackup(request.args['diff'])
+            except user_db.UserDbError, e:
+                message = str(e)
+        backups = [(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)), digest)
+                   for timestamp, digest in self._backend.ListBackups(BACKUPS_SHOWN)]
+        return render_template('edit.html', users=users, message=message,
+                               diagnostics=diagnostics, backups=backups,
+                               diff=diff, diff_digest=request.args.get('diff'))
+
+    def _ImportHandler(self):
+        if not session.get('admin') == 'yes':
+            return redirect(url_for('login'))
+        message = ''
+        users = ''
+        if request.method == 'POST' and request.form.get('import'):
+            users = request.form.get('users', '')
+            upload = request.files.get('file')
+            if upload and upload.filename:
+                users = upload.read()
+            try:
+                count = self._backend.ImportUsers(
+                        users, request.form.get('format', 'auto'), session.get('user'))
+            except user_db.UserDbError, e:
+                print(e)
+                message = 'Import failed: %s' % str(e)
+            else:
+                message = 'Imported %d users!' % count
+                users = ''
+        return render_template('import.html', users=users, message=message)
+
+    def _IndexHandler(self):
+        if not session.get('logged_in'):
+            return redirect(url_for('login', _external=True))
+        message = ''
+        if session.get('admin') == 'yes':
+            if request.method == 'POST' and request.form.get('add'):
+                rfid = request.form.get('rfid')
+                name = request.form.get('name')
+                try:
+                    self._backend.AddUser(rfid, name, session.get('user'))
+                except user_db.UserDbError, e:
+                    print(e)
+                    message = 'Failed to add user: %s' % str(e)
+                else:
+                    message = 'User added!'
+
+        status = self._backend.GetStatus()
+        return render_template(
+                'index.html',
+                admin=session.get('admin'),
+                doors=status['doors'],
+                last_event=status['last_event'],
+                last_lines=status['last_lines'],
+                rfid=status['rfid'],
+                message=message)
+
+    def _QueryLogHandler(self):
+        if not session.get('logged_in'):
+            return redirect(url_for('login', _external=True))
+
+        def _ParseTime(value, end_of_day=False):
+            try:
+                return time.mktime(time.strptime(value, '%Y-%m-%d %H:%M'))
+            except ValueError:
+                pass
+            try:
+                day = time.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return None
+            if end_of_day:
+                # Midnight at the end of the day; mktime() normalizes the date.
+                day = day[:2] + (day.tm_mday + 1,) + day[3:8] + (-1,)
+            return time.mktime(day)
+
+        args = request.args
+        limit = max(1, min(args.get('limit', 50, type=int), 1000))
+        since = _ParseTime(args.get('since', ''))
+        # A date alone includes that day.
+        until = _ParseTime(args.get('until', ''), end_of_day=True)
+        events = self._backend.QueryEvents(
+                rfid=args.get('rfid') or None,
+                user=args.get('user') or None,
+                action=args.get('action') or None,
+                since=since,
+                until=until,
+                before=args.get('before', type=int),
+                limit=limit)
+        if args.get('format') == 'json':
+            return jsonify(events=events)
+        for event in events:
+            event['time'] = time.strftime(
+                    '%Y-%m-%d %H:%M:%S', time.localtime(event['timestamp']))
+        next_args = dict(args.items())
+        next_args['before'] = events[-1]['id'] if events and len(events) == limit else None
+        return render_template(
+                'log.html',
+                events=events,
+                query=args,
+                next_url=(url_for('log', **next_args)
+                          if next_args['before'] is not None else None))
+
+    def _EventsHandler(self):
+        """Streams new log lines (and unknown tags, to admins) as Server-Sent Events.
+
+        If all stream slots are taken, sends what is new right away and ends
+        the response; the browser reconnects after POLL_INTERVAL, and so
+        polls until a slot frees up.
+        """
+        if not session.get('logged_in'):
+            return redirect(url_for('login', _external=True))
+        admin = session.get('admin') == 'yes'
+        # Browsers send Last-Event-ID when they reconnect. On the first
+        # connection, the page tells us what it already shows.
+        last = request.headers.get('Last-Event-ID', type=int)
+        if last is None:
+            last = request.args.get('since', type=int)
+        if last is None:
+            last = self._backend.GetStatus()['last_event']
+
+        def _Format(number, kind, data):
+            lines = ['id: %d' % number, 'event: %s' % kind]
+            lines += ['data: %s' % line for line in data.rstrip('\n').split('\n')]
+            return '\n'.join(lines) + '\n\n'
+
+        def _Chunk(events):
+            return ''.join(_Format(number, kind, data) for number, kind, data in events
+                           if kind == 'log' or admin)
+
+        def _Generate(last):
+            # Taken here rather than in the handler: a response that is never
+            # sent wouldn't give its slot back.
+            if self._streams is not None and not self._streams.acquire(False):
+                yield 'retry: %d\n\n' % POLL_INTERVAL + _Chunk(self._backend.GetEvents(last))
+                return
+            try:
+                # Tell the browser to reconnect quickly if the connection drops.
+                yield 'retry: 3000\n\n'
+                while True:
+                    events = self._backend.WaitEvents(last)
+                    if not events:
+                        # Heartbeat; fails if the client went away.
+                        yield ': keepalive\n\n'
+                        continue
+                    last = events[-1][0]
+                    chunk = _Chunk(events)
+                    if chunk:
+                        yield chunk
+            finally:
+                if self._streams is not None:
+                    self._streams.release()
+
+        response = Response(stream_with_context(_Generate(last)),
+                            mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Don't let nginx buffer the stream.
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _QuitHandler(self):
+        func = request.environ.get('werkzeug.server.shutdown')
+        if func is not None:
+            func()
+        else:
+            # A worker of --serve=production; the server stops the workers.
+            self._backend.Quit()
+        return 'bye bye'
+
+    def _LoginHandler(self):
+        if request.method == 'POST':
+            user = request.form['user']
+            pwd = request.form['password']
+            if user and pwd:
+                authorized, admin = self._backend.Login(user, pwd)
+                if authorized:
+                    session['logged_in'] = True
+                    session['admin'] = admin
+                    session['user'] = user
+                    return redirect(url_for('index', _external=True))
+        return self.app.send_static_file('login.html')
+
+    def _OpenHandler(self):
+        if request.method == 'POST':
+            if session.get('logged_in'):
+                self._backend.Unlock(session.get('user'), request.form.get('door') or None)
+        return redirect(url_for('index', _external=True))
+
+    def _LogoutHandler(self):
+        session.pop('logged_in', None)
+        return redirect(url_for('index', _external=True))
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import time
+import unittest
+
+# Local imports.
+import user_db
+import web_app
+
+
+class _FakeBackend(object):
+    """Backend of WebApp, recording the calls that change something."""
+
+    def __init__(self):
+        # (method, args) tuples.
+        self.calls = []
+        # (number, kind, data) tuples.
+        self.events = []
+        self.queries = []
+        self.error = None
+        # Set while a stream waits for events.
+        self.waiting = threading.Event()
+        self.release = threading.Event()
+
+    def _Record(self, method, *args):
+        self.calls.append((method,) + args)
+        if self.error is not None:
+            raise self.error
+
+    def AddUser(self, rfid, name, admin_user):
+        self._Record('AddUser', rfid, name, admin_user)
+
+    def DiffBackup(self, digest):
+        return '-abcd:johnny\n+abcd:jimmy\n'
+
+    def GetEvents(self, last):
+        return [event for event in self.events if event[0] > last]
+
+    def GetStatus(self):
+        return dict(doors=['front', 'back'], last_event=len(self.events),
+                    last_lines='[2026-10-17 10:00:00] action:swipe\n', rfid='f00d')
+
+    def GetUserDatabase(self):
+        return 'abcd:johnny\n'
+
+    def ImportUsers(self, text, fmt, admin_user):
+        self._Record('ImportUsers', text, fmt, admin_user)
+        return len(text.splitlines())
+
+    def ListBackups(self, count):
+        return [(1000000000, 'a' * 40), (900000000, 'b' * 40)][:count]
+
+    def Login(self, user, password):
+        self.calls.append(('Login', user, password))
+        if (user, password) == ('bob', 'secret'):
+            return True, 'yes'
+        return False, None
+
+    def QueryEvents(self, **kwargs):
+        self.queries.append(kwargs)
+        return [dict(id=i, timestamp=1000000000 - i, action='swipe', rfid='abcd')
+                for i in xrange(kwargs['limit'], 0, -1)]
+
+    def Quit(self):
+        self._Record('Quit')
+
+    def ReplaceUserDatabase(self, users):
+        self._Record('ReplaceUserDatabase', users)
+
+    def RestoreBackup(self, digest, admin_user):
+        self._Record('RestoreBackup', digest, admin_user)
+
+    def Unlock(self, user, door=None):
+        self._Record('Unlock', user, door)
+        return True
+
+    def WaitEvents(self, last):
+        self.waiting.set()
+        self.release.wait(5)
+        return self.GetEvents(last)
+
+
+class TestWebApp(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _FakeBackend()
+        self.app = web_app.WebApp(self.backend, 'secret key', max_streams=1).app
+        self.app.testing = True
+        self.client = self.app.test_client()
+
+    def _Login(self, admin='yes', client=None):
+        with (client or self.client).session_transaction() as session:
+            session['logged_in'] = True
+            session['admin'] = admin
+            session['user'] = 'bob'
+
+    def testLogin(self):
+        response = self.client.get('/')
+        self.assertEqual(302, response.status_code)
+        self.assertIn('/login', response.headers['Location'])
+        response = self.client.post('/login', data=dict(user='bob', password='wrong'))
+        self.assertEqual(200, response.status_code)
+        response = self.client.post('/login', data=dict(user='bob', password='secret'))
+        self.assertEqual(302, response.status_code)
+        self.assertEqual([('Login', 'bob', 'wrong'), ('Login', 'bob', 'secret')],
+                         self.backend.calls)
+        response = self.client.get('/')
+        self.assertEqual(200, response.status_code)
+        self.assertIn('action:swipe', response.data)
+        # More than one door: the user picks one to open.
+        self.assertIn('value="back"', response.data)
+        self.assertIn('f00d', response.data)
+
+        self.client.get('/logout')
+        self.assertEqual(302, self.client.get('/').status_code)
+
+    def testOpen(self):
+        self.client.post('/open', data=dict(door='back'))
+        self.assertEqual([], self.backend.calls)
+        self._Login(admin=None)
+        response = self.client.post('/open', data=dict(door='back'))
+        self.assertEqual(302, response.status_code)
+        self.client.post('/open')
+        self.assertEqual([('Unlock', 'bob', 'back'), ('Unlock', 'bob', None)],
+                         self.backend.calls)
+
+    def testAddUser(self):
+        self._Login(admin=None)
+        self.client.post('/', data=dict(add='1', rfid='f00d', name='jimmy'))
+        self.assertEqual([], self.backend.calls)
+        self._Login()
+        response = self.client.post('/', data=dict(add='1', rfid='f00d', name='jimmy'))
+        self.assertIn('User added!', response.data)
+        self.backend.error = user_db.UserDbError('RFID tag already exists in database')
+        response = self.client.post('/', data=dict(add='1', rfid='f00d', name='jimmy'))
+        self.assertIn('Failed to add user: RFID tag already exists', response.data)
+        self.assertEqual([('AddUser', 'f00d', 'jimmy', 'bob')] * 2, self.backend.calls)
+
+    def testEdit(self):
+        self._Login(admin=None)
+        self.assertEqual(302, self.client.get('/edit').status_code)
+        self._Login()
+        response = self.client.get('/edit?diff=' + 'a' * 40)
+        self.assertIn('abcd:johnny', response.data)
+        self.assertIn('+abcd:jimmy', response.data)
+        self.assertIn('aaaaaaaaaaaa', response.data)
+
+        response = self.client.post('/edit', data=dict(save='1', users='f00d:jimmy\n'))
+        self.assertIn('Saved!', response.data)
+        # Diagnostics come back as lists from the IPC backend.
+        self.backend.error = user_db.UserDbError('Line 1: bad', [[1, 'Invalid RFID: xyz']])
+        response = self.client.post('/edit', data=dict(save='1', users='xyz:jimmy\n'))
+        self.assertIn('Not saved!', response.data)
+        self.assertIn('Line 1: Invalid RFID: xyz', response.data)
+        self.backend.error = None
+        response = self.client.post('/edit', data=dict(restore='b' * 40))
+        self.assertIn('Restored backup bbbbbbbbbbbb!', response.data)
+        self.assertEqual([('ReplaceUserDatabase', 'f00d:jimmy\n'),
+                          ('ReplaceUserDatabase', 'xyz:jimmy\n'),
+                          ('RestoreBackup', 'b' * 40, 'bob')], self.backend.calls)
+
+    def testImport(self):
+        self._Login()
+        response = self.client.post('/import', data=dict(
+                import_='1', users='f00d,jimmy\n'))
+        self.assertEqual([], self.backend.calls)
+        response = self.client.post('/import', data={
+                'import': '1', 'users': 'f00d,jimmy\nf00e,johnny\n', 'format': 'csv'})
+        self.assertIn('Imported 2 users!', response.data)
+        self.assertEqual([('ImportUsers', 'f00d,jimmy\nf00e,johnny\n', 'csv', 'bob')],
+                         self.backend.calls)
+
+    def testLog(self):
+        self._Login(admin=None)
+        response = self.client.get('/log?format=json&rfid=abcd&limit=2')
+        events = json.loads(response.data)['events']
+        self.assertEqual([2, 1], [event['id'] for event in events])
+        response = self.client.get('/log?limit=2&since=2026-10-17&until=2026-10-18')
+        # The last event of a full page is the cursor for the next one.
+        self.assertIn('before=1', response.data)
+        query = self.backend.queries[-1]
+        self.assertEqual(time.mktime((2026, 10, 17, 0, 0, 0, 0, 0, -1)), query['since'])
+        # A date alone includes that day.
+        self.assertEqual(time.mktime((2026, 10, 19, 0, 0, 0, 0, 0, -1)), query['until'])
+        self.client.get('/log?until=2026-10-18 12:30')
+        self.assertEqual(time.mktime((2026, 10, 18, 12, 30, 0, 0, 0, -1)),
+                         self.backend.queries[-1]['until'])
+
+    def testLogLimit(self):
+        self._Login(admin=None)
+        for limit, expected in (('0', 1), ('-1', 1), ('5000', 1000), ('x', 50)):
+            response = self.client.get('/log?limit=' + limit)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(expected, self.backend.queries[-1]['limit'])
+        # No events, no next page.
+        self.backend.QueryEvents = lambda **kwargs: []
+        response = self.client.get('/log?limit=0')
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('before=', response.data)
+
+    def testEvents(self):
+        self.backend.events = [(1, 'log', 'one\n'), (2, 'rfid', 'f00d'),
+                               (3, 'log', 'three\n')]
+        self._Login(admin=None)
+        response = self.client.get('/events', headers={'Last-Event-ID': '1'})
+        stream = response.response
+        self.assertEqual('retry: 3000\n\n', next(stream))
+        self.backend.release.set()
+        # Only admins see unknown tags.
+        self.assertEqual('id: 3\nevent: log\ndata: three\n\n', next(stream))
+
+        # The only stream slot is taken: a second dashboard polls.
+        other = self.app.test_client()
+        self._Login(client=other)
+        polled = other.get('/events?since=1').data
+        self.assertEqual('retry: %d\n\nid: 2\nevent: rfid\ndata: f00d\n\n'
+                         'id: 3\nevent: log\ndata: three\n\n' % web_app.POLL_INTERVAL,
+                         polled)
+        # Closing the stream frees its slot.
+        response.close()
+        response = other.get('/events?since=3')
+        self.assertEqual('retry: 3000\n\n', next(response.response))
+        response.close()
+
+    def testQuit(self):
+        # Not the Werkzeug server: the backend stops the workers.
+        self.assertEqual('bye bye', self.client.get('/quitquitquit').data)
+        self.assertEqual([('Quit',)], self.backend.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# Validation of Wiegand frames.
+#
+# The common formats frame the data bits with two parity bits: the first bit
+# gives the first half of the data bits even parity, the last bit gives the
+# second half odd parity (for an odd number of data bits, the halves share
+# the middle bit). The data bits are a facility code followed by a card
+# number.
+
+import collections
+
+# Wiegand format: total number of bits, and how many of the data bits are
+# the card number. The remaining data bits are the facility code.
+Format = collections.namedtuple('Format', 'name bits card_bits')
+
+# A validated frame. value is the raw frame including parity bits, which is
+# what tags are stored as in the user database.
+Card = collections.namedtuple('Card', 'bits value facility card')
+
+FORMATS = dict((f.bits, f) for f in (
+    Format('H10301', 26, 16),
+    Format('H10306', 34, 16),
+    Format('H10304', 37, 19),
+))
+
+
+class WiegandError(Exception):
+    """Frame has an unknown length or bad parity."""
+    pass
+
+
+def _Parity(x):
+    return bin(x).count('1') & 1
+
+
+def Decode(bits, value):
+    """Validates a frame and splits it into facility code and card number.
+
+    Args:
+        bits: int, number of bits received.
+        value: int, the bits, first bit received being the most significant.
+
+    Returns:
+        Card.
+
+    Raises:
+        WiegandError: if the length isn't one of FORMATS, or a parity bit
+            doesn't match.
+    """
+    fmt = FORMATS.get(bits)
+    if fmt is None:
+        raise WiegandError('Unsupported frame length: %d bits' % bits)
+    data_bits = bits - 2
+    data = (value >> 1) & ((1 << data_bits) - 1)
+    half = (data_bits + 1) // 2
+    first_half = data >> (data_bits - half)
+    second_half = data & ((1 << half) - 1)
+    if _Parity(first_half) != value >> (bits - 1):
+        raise WiegandError('Bad leading parity: %d bits, value %x' % (bits, value))
+    if _Parity(second_half) == value & 1:
+        raise WiegandError('Bad trailing parity: %d bits, value %x' % (bits, value))
+    return Card(bits, value, data >> fmt.card_bits, data & ((1 << fmt.card_bits) - 1))
+
+
+def Encode(bits, facility, card):
+    """Returns the frame value for a facility code and card number.
+
+    The inverse of Decode(), for tests and simulations.
+    """
+    fmt = FORMATS[bits]
+    data_bits = bits - 2
+    data = (facility << fmt.card_bits) | card
+    if data >> data_bits:
+        raise WiegandError('Facility code or card number too big for %s' % fmt.name)
+    half = (data_bits + 1) // 2
+    even = _Parity(data >> (data_bits - half))
+    odd = 1 - _Parity(data & ((1 << half) - 1))
+    return (even << (bits - 1)) | (data << 1) | odd
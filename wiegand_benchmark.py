@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# Benchmark for the reader path, from Wiegand edges to the tag seen handler.
+#
+# Runs RealHardware on fake_pigpio, so it works on any Linux box. Synthetic
+# traces of random 26/34/37-bit frames are replayed with noise: spikes shorter
+# than the glitch filter, spikes long enough to look like a bit, and frames
+# spoilt by both lines falling at once.
+#
+# Usage: wiegand_benchmark.py [--frames N] [--latency_frames N] [--trace FILE]
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+# Local imports.
+import fake_pigpio
+import wiegand
+
+
+def _Percentile(values, fraction):
+    """Returns the value below which the given fraction of values fall."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _MakeTrace(hw, count, rand, noise=0.2, spoilt=0.05, junk=0.05, gap=20000):
+    """Returns a trace of count frames, back to back.
+
+    Returns:
+        (edges, frames), frames being a list of (bits, value, last tick) for
+        each frame that should reach the handler.
+    """
+    data_0, data_1 = hw.doors[0].data_low, hw.doors[0].data_high
+    edges = []
+    frames = []
+    tick = 1000
+    for _ in xrange(count):
+        bits = rand.choice(sorted(wiegand.FORMATS))
+        card_bits = wiegand.FORMATS[bits].card_bits
+        value = wiegand.Encode(bits, rand.randrange(1 << (bits - 2 - card_bits)),
+                               rand.randrange(1 << card_bits))
+        frame, end = fake_pigpio.FrameEdges(data_0, data_1, bits, value, tick)
+        edges.extend(frame)
+        if rand.random() < noise:
+            # Filtered out by pigpio.
+            edges.extend(fake_pigpio.Glitch([rand.choice((data_0, data_1))],
+                                            rand.randrange(tick, end), 3))
+        if rand.random() < spoilt:
+            edges.extend(fake_pigpio.Glitch([data_0, data_1],
+                                            rand.randrange(tick, end - 2000) + 500, 100))
+        else:
+            frames.append((bits, value, frame[-1][0]))
+        tick = end + gap
+        if rand.random() < junk:
+            # A lone pulse, a 1 bit frame.
+            edges.extend(fake_pigpio.Glitch([data_1], tick, 100))
+            tick += gap
+    edges.sort()
+    return edges, frames
+
+
+class _Handler(object):
+    """Tag seen handler recording (time, rfid, details) per read."""
+
+    def __init__(self):
+        self.reads = []
+        self._done = threading.Event()
+        self._expected = None
+
+    def __call__(self, rfid, **details):
+        self.reads.append((time.time(), rfid, details))
+        if len(self.reads) == self._expected:
+            self._done.set()
+
+    def Wait(self, expected, timeout):
+        self._expected = expected
+        if len(self.reads) < expected:
+            self._done.wait(timeout)
+
+
+def _Accuracy(frames, reads):
+    """Returns (correct, missed, false accepts) of reads against frames."""
+    expected = {}
+    for bits, value, _ in frames:
+        card = wiegand.Decode(bits, value)
+        key = (str(value), card.facility, card.card)
+        expected[key] = expected.get(key, 0) + 1
+    correct = false = 0
+    for _, rfid, details in reads:
+        key = (rfid, details.get('facility'), details.get('card'))
+        if expected.get(key):
+            expected[key] -= 1
+            correct += 1
+        else:
+            false += 1
+    return correct, len(frames) - correct, false
+
+
+def BenchmarkThroughput(hw, count):
+    """Replays all frames at once and times decoding."""
+    handler = _Handler()
+    hw.SetTagSeenHandler(handler)
+    edges, frames = _MakeTrace(hw, count, random.Random(42))
+    start = time.time()
+    hw.pi.Replay(edges)
+    handler.Wait(len(frames), timeout=60)
+    elapsed = max(handler.reads[-1][0] - start, 1e-6) if handler.reads else 0
+    correct, missed, false = _Accuracy(frames, handler.reads)
+    print('%d frames (%d valid) in %.3fs: %.0f frames/s' % (
+            count, len(frames), elapsed, len(handler.reads) / elapsed if elapsed else 0))
+    print('accuracy: %d correct, %d missed, %d false accepts' % (correct, missed, false))
+    print('decoder: %s' % hw.readers[hw.default_door].GetStats())
+    print('filter: %s' % hw.swipes.GetStats())
+
+
+def BenchmarkLatency(hw, count):
+    """Replays frames in real time; time from last edge to handler."""
+    handler = _Handler()
+    hw.SetTagSeenHandler(handler)
+    edges, frames = _MakeTrace(hw, count, random.Random(7), spoilt=0, junk=0)
+    written = dict(hw.pi.Replay(edges, realtime=True))
+    handler.Wait(len(frames), timeout=10)
+    if len(handler.reads) != len(frames):
+        print('only %d of %d frames decoded' % (len(handler.reads), len(frames)))
+        return
+    latencies = [(read[0] - written[frame[2]]) * 1e3
+                 for frame, read in zip(frames, handler.reads)]
+    print('%d frames, last edge to handler: p50 %.2fms, p99 %.2fms, max %.2fms' % (
+            len(latencies), _Percentile(latencies, 0.5), _Percentile(latencies, 0.99),
+            max(latencies)))
+
+
+def ReplayTrace(hw, path):
+    """Prints what a recorded notification pipe dump decodes to."""
+    handler = _Handler()
+    hw.SetTagSeenHandler(handler)
+    with open(path, 'rb') as fh:
+        hw.pi.ReplayReports(fh.read())
+    # Let the last frame end.
+    time.sleep(0.5)
+    for _, rfid, details in handler.reads:
+        print(rfid, ' '.join('%s:%s' % item for item in sorted(details.items())))
+    print('decoder: %s' % hw.readers[hw.default_door].GetStats())
+    print('filter: %s' % hw.swipes.GetStats())
+
+
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=10000,
+                        help='Frames for the throughput benchmark')
+    parser.add_argument('--latency_frames', type=int, default=50,
+                        help='Frames for the latency benchmark, replayed in real time')
+    parser.add_argument('--trace', help='Replay a recorded notification pipe dump instead')
+    args = parser.parse_args()
+
+    restore = fake_pigpio.Install()
+    import real_hardware
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # No deduplication: random cards may repeat.
+        hw = real_hardware.RealHardware(1, os.path.join(tmpdir, 'pins.cfg'),
+                                        swipe_window=0)
+        hw.Initialize()
+        if args.trace:
+            ReplayTrace(hw, args.trace)
+        else:
+            if args.frames:
+                print('== throughput: %s' % BenchmarkThroughput.__doc__)
+                BenchmarkThroughput(hw, args.frames)
+            if args.latency_frames:
+                print('== latency: %s' % BenchmarkLatency.__doc__)
+                BenchmarkLatency(hw, args.latency_frames)
+        hw.ShutDown()
+    finally:
+        shutil.rmtree(tmpdir)
+        restore()
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Wiegand decoder reading edges in bulk from a pigpio notification pipe.
+#
+# The pigpio sample decoder runs a Python callback for every bit, and arms
+# two watchdogs (two more round trips to the pigpio daemon) for every frame.
+# Under CPU load the callbacks fall behind and bits get lost.
+#
+# Instead, pigpio writes a 12 byte report for every level change of the data
+# lines into a pipe (a "notification"). A thread reads whatever has piled up
+# with a single read, unpacks all reports at once and assembles frames from
+# the ticks (microsecond timestamps) pigpio recorded. Frames end when the
+# lines have been quiet for bit_timeout milliseconds, measured either from the
+# ticks (for frames that are already followed by the next one) or by a
+# timeout on the read.
+
+import os
+import select
+import struct
+import threading
+
+# Path of the pipe of a notification handle. Replaced by tests.
+NOTIFY_PIPE = '/dev/pigpio%d'
+
+# Format of a notification report: seqno, flags, tick, level.
+_REPORT = struct.Struct('HHII')
+# Reports read at most with one read.
+_MAX_REPORTS = 512
+
+# Report flags for watchdog timeouts, keep-alives and events. Their level
+# field isn't a level change of the data lines.
+_SPECIAL_FLAGS = (1 << 5) | (1 << 6) | (1 << 7)
+
+
+class FrameAssembler(object):
+    """Assembles Wiegand frames from level reports.
+
+    A falling edge on the data 0 line is a 0 bit, one on the data 1 line a 1
+    bit. Both lines falling at once is a glitch, and spoils the frame.
+    """
+
+    def __init__(self, gpio_0, gpio_1, bit_timeout=5):
+        """Constructor.
+
+        Args:
+            gpio_0: int, gpio of the data 0 (green) line.
+            gpio_1: int, gpio of the data 1 (white) line.
+            bit_timeout: float, milliseconds of quiet that end a frame.
+        """
+        self._mask_0 = 1 << gpio_0
+        self._mask_1 = 1 << gpio_1
+        self._timeout = int(bit_timeout * 1000)
+        # Both lines idle high.
+        self._level = self._mask_0 | self._mask_1
+        self._last_tick = None
+        self._bits = 0
+        self._value = 0
+        self._glitch = False
+        self.stats = dict(frames=0, glitches=0)
+
+    @property
+    def in_frame(self):
+        return self._bits > 0 or self._glitch
+
+    def Feed(self, tick, level):
+        """Processes a report of the levels of all gpios after a change.
+
+        Returns:
+            List of (bits, value) frames completed by this report.
+        """
+        frames = []
+        if (self.in_frame and self._last_tick is not None and
+                (tick - self._last_tick) & 0xffffffff > self._timeout):
+            frames.extend(self.Flush())
+        fell = self._level & ~level
+        self._level = level
+        fell_0 = fell & self._mask_0
+        fell_1 = fell & self._mask_1
+        if not (fell_0 or fell_1):
+            return frames
+        self._last_tick = tick
+        if fell_0 and fell_1:
+            self._glitch = True
+        elif not self._glitch:
+            self._bits += 1
+            self._value = (self._value << 1) | (1 if fell_1 else 0)
+        return frames
+
+    def Flush(self):
+        """Ends the current frame.
+
+        Returns:
+            List with the (bits, value) frame, empty if there was none or it
+            was spoilt by a glitch.
+        """
+        frames = []
+        if self._glitch:
+            self.stats['glitches'] += 1
+        elif self._bits:
+            self.stats['frames'] += 1
+            frames.append((self._bits, self._value))
+        self._bits = 0
+        self._value = 0
+        self._glitch = False
+        return frames
+
+
+class NotifyDecoder(object):
+    """Decodes a Wiegand reader from a pigpio notification pipe."""
+
+    def __init__(self, pi, gpio_0, gpio_1, callback, bit_timeout=5, glitch_us=10):
+        """Constructor. Starts decoding right away.
+
+        Args:
+            pi: pigpio.pi, connection to the pigpio daemon on this machine.
+            gpio_0: int, gpio of the data 0 (green) line.
+            gpio_1: int, gpio of the data 1 (white) line.
+            callback: function, called with the number of bits and the value
+                of each frame, from the decoder thread.
+            bit_timeout: float, milliseconds of quiet that end a frame.
+            glitch_us: int, level changes shorter than this many
+                microseconds are ignored by pigpio. 0 disables the filter.
+        """
+        import pigpio
+        self._pi = pi
+        self._callback = callback
+        self._bit_timeout = bit_timeout / 1000.0
+        self._assembler = FrameAssembler(gpio_0, gpio_1, bit_timeout)
+
+        for gpio in (gpio_0, gpio_1):
+            pi.set_mode(gpio, pigpio.INPUT)
+            pi.set_pull_up_down(gpio, pigpio.PUD_UP)
+            if glitch_us:
+                pi.set_glitch_filter(gpio, glitch_us)
+
+        self._handle = pi.notify_open()
+        self._fd = os.open(NOTIFY_PIPE % self._handle, os.O_RDONLY)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._Run, name='wiegand-decoder')
+        self._thread.daemon = True
+        self._thread.start()
+        pi.notify_begin(self._handle, (1 << gpio_0) | (1 << gpio_1))
+
+    def _Run(self):
+        pending = ''
+        while not self._stop.is_set():
+            # Wait for the end of a frame, or poll for the stop flag.
+            timeout = self._bit_timeout if self._assembler.in_frame else 0.5
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if not readable:
+                self._Emit(self._assembler.Flush())
+                continue
+            data = os.read(self._fd, _REPORT.size * _MAX_REPORTS)
+            if not data:
+                # Notification closed.
+                break
+            pending += data
+            count = len(pending) // _REPORT.size
+            fields = struct.unpack('HHII' * count, pending[:count * _REPORT.size])
+            pending = pending[count * _REPORT.size:]
+            for i in xrange(0, len(fields), 4):
+                if fields[i + 1] & _SPECIAL_FLAGS:
+                    continue
+                self._Emit(self._assembler.Feed(fields[i + 2], fields[i + 3]))
+        self._Emit(self._assembler.Flush())
+
+    def _Emit(self, frames):
+        for bits, value in frames:
+            self._callback(bits, value)
+
+    def GetStats(self):
+        """Returns a dict of counters: frames, glitches."""
+        return dict(self._assembler.stats)
+
+    def cancel(self):
+        """Stops decoding and closes the notification."""
+        self._stop.set()
+        self._pi.notify_close(self._handle)
+        self._thread.join()
+        os.close(self._fd)
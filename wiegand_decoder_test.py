@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import Queue
+import unittest
+
+# Local imports.
+import fake_pigpio
+import wiegand
+import wiegand_decoder
+
+GPIO_0 = 17
+GPIO_1 = 18
+IDLE = (1 << GPIO_0) | (1 << GPIO_1)
+
+
+def _Reports(bits, value, tick, period=2000, width=50):
+    """Returns (tick, level) reports for a frame, and the tick after it."""
+    reports = []
+    for i in reversed(xrange(bits)):
+        gpio = GPIO_1 if value >> i & 1 else GPIO_0
+        reports.append((tick, IDLE & ~(1 << gpio)))
+        reports.append((tick + width, IDLE))
+        tick += period
+    return reports, tick
+
+
+class TestFrameAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.assembler = wiegand_decoder.FrameAssembler(GPIO_0, GPIO_1, bit_timeout=5)
+
+    def _Feed(self, reports):
+        frames = []
+        for tick, level in reports:
+            frames.extend(self.assembler.Feed(tick, level))
+        return frames
+
+    def testFrames(self):
+        value_26 = wiegand.Encode(26, 12, 3456)
+        value_37 = wiegand.Encode(37, 1000, 123456)
+        first, tick = _Reports(26, value_26, 1000)
+        # Back to back, the second frame ends the first one.
+        second, tick = _Reports(37, value_37, tick + 10000)
+        self.assertEqual([(26, value_26)], self._Feed(first + second))
+        self.assertTrue(self.assembler.in_frame)
+        self.assertEqual([(37, value_37)], self.assembler.Flush())
+        self.assertFalse(self.assembler.in_frame)
+        self.assertEqual([], self.assembler.Flush())
+
+    def testTickWraparound(self):
+        value = wiegand.Encode(34, 7, 8)
+        reports, _ = _Reports(34, value, 0xffffffff - 30000)
+        reports = [(tick & 0xffffffff, level) for tick, level in reports]
+        self.assertEqual([], self._Feed(reports))
+        self.assertEqual([(34, value)], self.assembler.Flush())
+
+    def testGlitch(self):
+        reports, tick = _Reports(26, wiegand.Encode(26, 1, 2), 0)
+        # Both lines falling at once spoil the frame.
+        reports.insert(10, (reports[9][0] + 500, 0))
+        reports.insert(11, (reports[9][0] + 550, IDLE))
+        # Other gpios don't matter.
+        reports.insert(3, (reports[2][0] + 10, IDLE | 1 << 4))
+        self.assertEqual([], self._Feed(reports))
+        self.assertEqual([], self.assembler.Flush())
+        self.assertEqual(dict(frames=0, glitches=1), self.assembler.stats)
+
+
+class TestNotifyDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.restore = fake_pigpio.Install()
+        self.pi = fake_pigpio.pi()
+        self.frames = Queue.Queue()
+        self.decoder = wiegand_decoder.NotifyDecoder(
+                self.pi, GPIO_0, GPIO_1, lambda bits, value: self.frames.put((bits, value)))
+
+    def tearDown(self):
+        self.decoder.cancel()
+        self.pi.stop()
+        self.restore()
+
+    def _Get(self, count):
+        return [self.frames.get(timeout=2) for _ in xrange(count)]
+
+    def testReplay(self):
+        self.assertEqual(fake_pigpio.PUD_UP, self.pi.pulls[GPIO_0])
+        self.assertEqual(10, self.pi.glitch_filters[GPIO_1])
+        values = [wiegand.Encode(26, 1, 2), wiegand.Encode(34, 3, 4), wiegand.Encode(37, 5, 6)]
+        edges, tick = fake_pigpio.FrameEdges(GPIO_0, GPIO_1, 26, values[0], 1000)
+        # Spikes shorter than the glitch filter, within and between frames.
+        edges += fake_pigpio.Glitch([GPIO_1], edges[4][0] + 500, 3)
+        edges += fake_pigpio.Glitch([GPIO_0, GPIO_1], tick + 3000, 5)
+        # Back to back frames, the second one spoilt by both lines falling.
+        frame, tick = fake_pigpio.FrameEdges(GPIO_0, GPIO_1, 34, values[1], tick + 10000)
+        edges += frame
+        frame, tick = fake_pigpio.FrameEdges(GPIO_0, GPIO_1, 26, values[0], tick + 10000)
+        edges += frame + fake_pigpio.Glitch([GPIO_0, GPIO_1], frame[20][0] + 500, 100)
+        frame, tick = fake_pigpio.FrameEdges(GPIO_0, GPIO_1, 37, values[2], tick + 10000)
+        edges += frame
+        self.pi.Replay(sorted(edges))
+        self.assertEqual([(26, values[0]), (34, values[1]), (37, values[2])], self._Get(3))
+        self.assertEqual(dict(frames=3, glitches=1), self.decoder.GetStats())
+
+    def testRealtime(self):
+        value = wiegand.Encode(26, 7, 8)
+        written = self.pi.Replay(
+                fake_pigpio.FrameEdges(GPIO_0, GPIO_1, 26, value, 0)[0], realtime=True)
+        self.assertEqual([(26, value)], self._Get(1))
+        self.assertGreaterEqual(written[-1][1] - written[0][1], 0.045)
+
+
+if __name__ == '__main__':
+    unittest.main()
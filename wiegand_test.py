@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+import unittest
+
+# Local imports.
+import wiegand
+
+
+class TestWiegand(unittest.TestCase):
+
+    def testRoundTrip(self):
+        for bits, facility, card in ((26, 255, 65535), (34, 1234, 5678), (37, 65535, 524287)):
+            value = wiegand.Encode(bits, facility, card)
+            self.assertEqual(wiegand.Card(bits, value, facility, card),
+                             wiegand.Decode(bits, value))
+            # Any single flipped bit is caught.
+            for bit in xrange(bits):
+                self.assertRaises(wiegand.WiegandError, wiegand.Decode, bits, value ^ (1 << bit))
+
+    def testKnownFrame(self):
+        # Facility code 1, card 1.
+        self.assertEqual(0b10000000100000000000000010, wiegand.Encode(26, 1, 1))
+        self.assertRaises(wiegand.WiegandError, wiegand.Encode, 26, 256, 1)
+        self.assertRaises(wiegand.WiegandError, wiegand.Decode, 30, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+#
+# WSGI entry point of the gunicorn workers started by
+# RFIDLovePotion.py --serve=production:
+#
+#   gunicorn --worker-class gthread wsgi:app
+#
+# The workers keep no state of their own. They reach the RFIDLovePotion.py
+# process, which owns the hardware, the log and the user database, on the
+# socket given in LOVEPOTION_CONTROL_SOCKET, and share its session key. Each
+# streams live updates to at most LOVEPOTION_MAX_STREAMS dashboards.
+
+import binascii
+import os
+
+# Local imports.
+import door_ipc
+import user_db
+import web_app
+
+app = web_app.WebApp(
+        door_ipc.Client(os.environ['LOVEPOTION_CONTROL_SOCKET'],
+                        errors=(user_db.UserDbError,)),
+        binascii.unhexlify(os.environ['LOVEPOTION_SECRET_KEY']),
+        max_streams=int(os.environ['LOVEPOTION_MAX_STREAMS'])).app